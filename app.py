@@ -4,13 +4,14 @@ from prevent_calculator import PREVENTCalculator
 from calculators.gastro import FIB4Calculator, MELDCalculator, ChildPughCalculator
 from calculators.nephro import eGFRCalculator, KtVCalculator
 from calculators.endocrino import BMICalculator, HOMAIRCalculator, HOMABetaCalculator
+from calculators.patient import PatientRecord
+from calculators.registry import IncrementalEvaluator, default_registry
 
-# Helper function to get optional PREVENT parameters
-def get_prevent_optional_params(patient_data):
-    """Get UACR and HbA1c values if checkboxes are checked and values are valid"""
-    uacr_value = patient_data.get('uacr') if patient_data.get('use_uacr', False) and patient_data.get('uacr', 0) > 0 else None
-    hba1c_value = patient_data.get('hba1c') if patient_data.get('use_hba1c', False) and patient_data.get('hba1c', 0) > 0 else None
-    return uacr_value, hba1c_value
+# Shared PREVENT calculator: st.cache_resource keeps it (and its result cache) across reruns
+@st.cache_resource
+def get_prevent_calculator():
+    """Return a PREVENT calculator that caches results for repeated inputs"""
+    return PREVENTCalculator(cache_size=256)
 
 # Page configuration
 st.set_page_config(
@@ -209,7 +210,10 @@ st.markdown("""
 
 # Initialize session state for patient data
 if 'patient_data' not in st.session_state:
-    st.session_state.patient_data = {}
+    st.session_state.patient_data = PatientRecord()
+# Each session keeps its last evaluation, so an edit only recomputes the calculators that depend on it
+if 'evaluator' not in st.session_state:
+    st.session_state.evaluator = IncrementalEvaluator(default_registry(get_prevent_calculator()))
 
 # Title
 st.title("⚕️ Calculadoras Médicas")
@@ -311,34 +315,34 @@ with tabs[0]:
         platelets = optional_number_input("Plaquetas (×10⁹/L)", "platelets", help_text="Deixe vazio se não disponível")
     
     # Automatically save data to session state as user inputs
-    st.session_state.patient_data = {
-        'age': age,
-        'sex': sex,
-        'weight': weight,
-        'height': height,
-        'diabetes': diabetes,
-        'smoker': smoker,
-        'on_bp_meds': on_bp_meds,
-        'on_statins': on_statins,
-        'dialysis': dialysis,
-        'sbp': sbp,
-        'total_chol': total_chol,
-        'hdl_chol': hdl_chol,
-        'creatinine': creatinine,
-        'egfr': egfr,
-        'uacr': uacr,
-        'use_uacr': use_uacr,
-        'fasting_glucose': fasting_glucose,
-        'hba1c': hba1c,
-        'use_hba1c': use_hba1c,
-        'fasting_insulin': fasting_insulin,
-        'ast': ast,
-        'alt': alt,
-        'bilirubin': bilirubin,
-        'albumin': albumin,
-        'inr': inr,
-        'platelets': platelets
-    }
+    st.session_state.patient_data = PatientRecord(
+        age=age,
+        sex=sex,
+        weight=weight,
+        height=height,
+        diabetes=diabetes,
+        smoker=smoker,
+        on_bp_meds=on_bp_meds,
+        on_statins=on_statins,
+        dialysis=dialysis,
+        sbp=sbp,
+        total_chol=total_chol,
+        hdl_chol=hdl_chol,
+        creatinine=creatinine,
+        egfr=egfr,
+        uacr=uacr,
+        use_uacr=use_uacr,
+        fasting_glucose=fasting_glucose,
+        hba1c=hba1c,
+        use_hba1c=use_hba1c,
+        fasting_insulin=fasting_insulin,
+        ast=ast,
+        alt=alt,
+        bilirubin=bilirubin,
+        albumin=albumin,
+        inr=inr,
+        platelets=platelets
+    )
     
     st.markdown("---")
     st.markdown("""
@@ -348,6 +352,9 @@ with tabs[0]:
     </div>
     """, unsafe_allow_html=True)
 
+# Every calculator is evaluated once per rerun; the dashboard and the specialty tabs share the results
+evaluation = st.session_state.evaluator.update(st.session_state.patient_data) if st.session_state.patient_data else None
+
 # ========== TAB 2: ALL CALCULATORS DASHBOARD ==========
 with tabs[1]:
     st.header("🏥 Dashboard - Todas as Calculadoras")
@@ -356,29 +363,9 @@ with tabs[1]:
     if not st.session_state.patient_data:
         st.warning("⚠️ Por favor, preencha os dados do paciente na aba 'Dados do Paciente' primeiro.")
     else:
-        pd_data = st.session_state.patient_data
-        
-        # Helper function to check if required data is valid/realistic
-        def has_valid_data(params_needed):
-            """Check if the patient data has realistic values for required parameters"""
-            for param in params_needed:
-                val = pd_data.get(param)
-                if isinstance(val, bool): continue
-                if val is None or val <= 0: return False
-            return True
-        
         # Check calculator availability
-        calc_availability = {
-            'IMC': has_valid_data(['weight', 'height']),
-            'HOMA-IR': has_valid_data(['fasting_glucose', 'fasting_insulin']),
-            'HOMA-Beta': has_valid_data(['fasting_glucose', 'fasting_insulin']),
-            'FIB-4': has_valid_data(['age', 'ast', 'alt', 'platelets']),
-            'MELD': has_valid_data(['creatinine', 'bilirubin', 'inr']),
-            'Child-Pugh': has_valid_data(['bilirubin', 'albumin', 'inr']),
-            'eTFG': has_valid_data(['creatinine', 'age']),
-            'Kt/V': has_valid_data(['weight']),
-            'PREVENT': has_valid_data(['age', 'sbp', 'total_chol', 'hdl_chol', 'egfr', 'weight', 'height'])
-        }
+        calc_availability = {name: name in evaluation['results']
+                             for name in st.session_state.evaluator.registry.calculators}
         
         # ... (O restante do arquivo não precisa de alteração, mas será incluído para completude) ...
         st.markdown("### 🫀 Cardiologia")
@@ -398,31 +385,13 @@ with tabs[1]:
             </div>
         """, unsafe_allow_html=True)
         
-        if not is_available:
-            st.warning(f"⚠️ **Dados faltantes para PREVENT.** Verifique idade, PA, colesterol, TFG, peso e altura.")
+        if 'PREVENT' in evaluation['errors']:
+            st.error(f"Erro ao calcular PREVENT: {evaluation['errors']['PREVENT']}")
+        elif not is_available:
+            st.warning(f"⚠️ **Dados faltantes para PREVENT.** Verifique idade, PA, colesterol, TFG (ou creatinina), peso e altura.")
         else:
             try:
-                sex_code = 'F' if pd_data['sex'] == "Feminino" else 'M'
-                calculator = PREVENTCalculator()
-                
-                uacr_value, hba1c_value = get_prevent_optional_params(pd_data)
-                
-                results = calculator.calculate_risk_score(
-                    age=pd_data['age'],
-                    sex=sex_code,
-                    total_cholesterol=pd_data['total_chol'],
-                    hdl_cholesterol=pd_data['hdl_chol'],
-                    sbp=pd_data['sbp'],
-                    on_bp_meds=pd_data['on_bp_meds'],
-                    diabetes=pd_data['diabetes'],
-                    smoker=pd_data['smoker'],
-                    egfr=pd_data['egfr'],
-                    weight=pd_data['weight'],
-                    height=pd_data['height'],
-                    on_statins=pd_data['on_statins'],
-                    uacr=uacr_value,
-                    hba1c=hba1c_value
-                )
+                results = evaluation['results']['PREVENT']
                 
                 risk_category = results.get('risk_category', 'Indisponível')
                 risk_class_map = {'Baixo': 'risk-low', 'Limítrofe': 'risk-borderline', 'Intermediário': 'risk-intermediate', 'Alto': 'risk-high'}
@@ -454,32 +423,13 @@ with tabs[2]:
     </div>
     """, unsafe_allow_html=True)
     
-    if not st.session_state.patient_data or not has_valid_data(['age', 'sbp', 'total_chol', 'hdl_chol', 'egfr', 'weight', 'height']):
+    if evaluation is not None and 'PREVENT' in evaluation['errors']:
+        st.error(f"Erro ao calcular: {evaluation['errors']['PREVENT']}")
+    elif evaluation is None or 'PREVENT' not in evaluation['results']:
         st.warning("⚠️ Por favor, preencha todos os dados necessários na aba 'Dados do Paciente' para calcular o risco PREVENT.")
     else:
         try:
-            pd_data = st.session_state.patient_data
-            sex_code = 'F' if pd_data['sex'] == "Feminino" else 'M'
-            
-            calculator = PREVENTCalculator()
-            uacr_value, hba1c_value = get_prevent_optional_params(pd_data)
-            
-            results = calculator.calculate_risk_score(
-                age=pd_data.get('age'),
-                sex=sex_code,
-                total_cholesterol=pd_data.get('total_chol'),
-                hdl_cholesterol=pd_data.get('hdl_chol'),
-                sbp=pd_data.get('sbp'),
-                on_bp_meds=pd_data.get('on_bp_meds'),
-                diabetes=pd_data.get('diabetes'),
-                smoker=pd_data.get('smoker'),
-                egfr=pd_data.get('egfr'),
-                weight=pd_data.get('weight'),
-                height=pd_data.get('height'),
-                on_statins=pd_data.get('on_statins'),
-                uacr=uacr_value,
-                hba1c=hba1c_value
-            )
+            results = evaluation['results']['PREVENT']
             
             risk_category = results.get('risk_category', 'Indisponível')
             risk_class_map = {'Baixo': 'risk-low', 'Limítrofe': 'risk-borderline', 'Intermediário': 'risk-intermediate', 'Alto': 'risk-high'}
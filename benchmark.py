@@ -0,0 +1,89 @@
+"""
+Benchmark for the PREVENT Calculator
+Measures throughput of the scalar, batch and parallel scoring paths on a synthetic cohort
+"""
+import argparse
+import os
+import time
+
+try:
+    import numpy as np
+    from prevent_calculator import PREVENTCalculator
+except ImportError:
+    print("Error: Required packages not installed.")
+    print("Please run: pip install -r requirements.txt")
+    exit(1)
+
+
+def synthetic_cohort(n, seed=0):
+    """Generate n random patients within the PREVENT input ranges"""
+    rng = np.random.default_rng(seed)
+    return {
+        'age': rng.uniform(30, 79, n),
+        'sex': rng.choice(['F', 'M'], n),
+        'total_cholesterol': rng.uniform(130, 320, n),
+        'hdl_cholesterol': rng.uniform(20, 100, n),
+        'sbp': rng.uniform(90, 200, n),
+        'on_bp_meds': rng.random(n) < 0.3,
+        'diabetes': rng.random(n) < 0.2,
+        'smoker': rng.random(n) < 0.2,
+        'egfr': rng.uniform(15, 140, n),
+        'weight': rng.uniform(45, 130, n),
+        'height': rng.uniform(150, 195, n),
+        'on_statins': rng.random(n) < 0.3,
+        'uacr': np.where(rng.random(n) < 0.5, rng.uniform(0, 300, n), np.nan),
+    }
+
+
+def timed(func, *args, **kwargs):
+    """Run func once and return the elapsed time in seconds"""
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_scalar(cohort, n):
+    """Loop calculate_risk_score over the first n patients"""
+    calculator = PREVENTCalculator()
+    rows = []
+    for i in range(n):
+        row = {name: values[i].item() for name, values in cohort.items()}
+        if np.isnan(row['uacr']):
+            row['uacr'] = None
+        rows.append(row)
+    return timed(lambda: [calculator.calculate_risk_score(**row) for row in rows])
+
+
+def main():
+    """Run the benchmarks and print rows per second for each path"""
+    parser = argparse.ArgumentParser(description='PREVENT throughput benchmark')
+    parser.add_argument('--rows', type=int, default=2_000_000, help='Cohort size for batch/parallel runs')
+    parser.add_argument('--scalar-rows', type=int, default=5_000, help='Patients for the scalar loop')
+    parser.add_argument('--chunk-size', type=int, default=100_000, help='Rows per shard')
+    args = parser.parse_args()
+
+    cohort = synthetic_cohort(args.rows)
+    calculator = PREVENTCalculator()
+
+    print("\n" + "="*60)
+    print(f"PREVENT Benchmark - {args.rows} pacientes, {os.cpu_count()} CPUs")
+    print("="*60)
+
+    scalar = args.scalar_rows / bench_scalar(cohort, args.scalar_rows)
+    print(f"Escalar (calculate_risk_score): {scalar:>14,.0f} pacientes/s  ({1e6 / scalar:.1f} µs/chamada)")
+
+    batch = args.rows / timed(calculator.calculate_batch, **cohort)
+    print(f"Lote (calculate_batch):         {batch:>14,.0f} pacientes/s  ({batch / scalar:.0f}x)")
+
+    workers = 1
+    while workers <= os.cpu_count():
+        elapsed = timed(calculator.calculate_parallel, workers=workers, chunk_size=args.chunk_size, **cohort)
+        parallel = args.rows / elapsed
+        print(f"Paralelo ({workers:>2} processos):         {parallel:>14,.0f} pacientes/s  "
+              f"(escala {parallel / batch:.2f}x)")
+        workers *= 2
+    print("="*60 + "\n")
+
+
+if __name__ == '__main__':
+    main()
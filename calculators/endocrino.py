@@ -4,6 +4,28 @@ Contains BMI, HOMA-IR, and HOMA-beta calculators
 """
 import numpy as np
 
+from calculators.patient import record_fields
+from calculators.validation import INVALID, VALID, first_error, masked, validate_columns
+
+# Category codes returned by the calculate_batch methods. Each tuple is indexed by its code;
+# code 0 means the index could not be computed for that row.
+BMI_CLASSES = ('Indisponível', 'Baixo peso', 'Peso normal', 'Sobrepeso', 'Obesidade Grau I',
+               'Obesidade Grau II', 'Obesidade Grau III')
+BMI_RISKS = ('Indisponível', 'Baixo', 'Normal', 'Aumentado', 'Moderado', 'Alto', 'Muito Alto')
+BMI_THRESHOLDS = (18.5, 25, 30, 35, 40)
+HOMA_IR_INTERPRETATIONS = ('Indisponível', 'Normal', 'Resistência insulínica leve',
+                           'Resistência insulínica significativa')
+HOMA_IR_THRESHOLDS = (2.5, 3.8)
+HOMA_BETA_INTERPRETATIONS = ('Indisponível', 'Função de células beta reduzida', 'Função de células beta normal',
+                             'Função de células beta aumentada')
+
+
+def _digitize_codes(values, thresholds):
+    """int8 codes 1..len(thresholds)+1 of left-closed bins, 0 where values is NaN"""
+    codes = np.digitize(values, thresholds).astype(np.int8) + 1
+    codes[np.isnan(values)] = 0
+    return codes
+
 
 class BMICalculator:
     """
@@ -30,6 +52,30 @@ class BMICalculator:
         # Calculate BMI
         bmi = weight / (height_m ** 2)
         
+        return self.classify(bmi)
+    
+    def calculate_record(self, record):
+        """
+        Calculate BMI from a patient's weight and height
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        
+        Returns:
+        - As for calculate; raises ValueError when a required field was not entered
+        """
+        return self.calculate(*record_fields(record, ('weight', 'height')))
+    
+    def classify(self, bmi):
+        """
+        WHO classification of an already calculated BMI
+        
+        Parameters:
+        - bmi: Unrounded BMI (kg/m²), e.g. shared with PREVENT
+        
+        Returns:
+        - Dictionary with BMI and classification, as for calculate
+        """
         # WHO Classification
         if bmi < 18.5:
             classification = "Baixo peso"
@@ -55,6 +101,27 @@ class BMICalculator:
             'classification': classification,
             'risk': risk
         }
+    
+    def calculate_batch(self, weight, height):
+        """
+        Calculate BMI for many patients with array operations
+        
+        Parameters:
+        - weight: Array of weights in kg
+        - height: Array of heights in cm
+        
+        Returns:
+        - Dictionary with the unrounded 'bmi' array (NaN for invalid rows), 'classification_code'
+          (int8 codes into BMI_CLASSES and BMI_RISKS) and 'error', int8 codes into VALIDATION_ERRORS
+        """
+        cols, error = validate_columns({'weight': weight, 'height': height}, positive=('weight', 'height'))
+        return self._score_batch(cols, error)
+    
+    def _score_batch(self, cols, error):
+        """BMI and WHO class codes from validated weight/height columns"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bmi = masked(cols['weight'] / (cols['height'] / 100) ** 2, error)
+        return {'bmi': bmi, 'classification_code': _digitize_codes(bmi, BMI_THRESHOLDS), 'error': error}
 
 
 class HOMAIRCalculator:
@@ -95,6 +162,40 @@ class HOMAIRCalculator:
             'interpretation': interpretation,
             'recommendation': recommendation
         }
+    
+    def calculate_record(self, record):
+        """
+        Calculate HOMA-IR from a patient's fasting glucose and insulin
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        
+        Returns:
+        - As for calculate; raises ValueError when a required field was not entered
+        """
+        return self.calculate(*record_fields(record, ('fasting_glucose', 'fasting_insulin')))
+    
+    def calculate_batch(self, fasting_glucose, fasting_insulin):
+        """
+        Calculate HOMA-IR for many patients with array operations
+        
+        Parameters:
+        - fasting_glucose: Array of fasting glucose values (mg/dL)
+        - fasting_insulin: Array of fasting insulin values (μU/mL)
+        
+        Returns:
+        - Dictionary with the unrounded 'homa_ir' array (NaN for invalid rows), 'interpretation_code'
+          (int8 codes into HOMA_IR_INTERPRETATIONS) and 'error', int8 codes into VALIDATION_ERRORS
+        """
+        cols, error = validate_columns({'fasting_glucose': fasting_glucose, 'fasting_insulin': fasting_insulin},
+                                       positive=('fasting_glucose', 'fasting_insulin'))
+        return self._score_batch(cols, error)
+    
+    def _score_batch(self, cols, error):
+        """HOMA-IR and its interpretation codes from validated glucose/insulin columns"""
+        homa_ir = masked((cols['fasting_glucose'] * cols['fasting_insulin']) / 405, error)
+        return {'homa_ir': homa_ir, 'interpretation_code': _digitize_codes(homa_ir, HOMA_IR_THRESHOLDS),
+                'error': error}
 
 
 class HOMABetaCalculator:
@@ -118,6 +219,8 @@ class HOMABetaCalculator:
         
         # Convert glucose from mg/dL to mmol/L for formula
         glucose_mmol = fasting_glucose / 18
+        if glucose_mmol == 3.5:
+            raise ValueError("HOMA-Beta indefinido para glicemia de 63 mg/dL")
         
         # HOMA-Beta formula
         homa_beta = (20 * fasting_insulin) / (glucose_mmol - 3.5)
@@ -141,3 +244,73 @@ class HOMABetaCalculator:
             'interpretation': interpretation,
             'recommendation': recommendation
         }
+    
+    def calculate_record(self, record):
+        """
+        Calculate HOMA-Beta from a patient's fasting glucose and insulin
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        
+        Returns:
+        - As for calculate; raises ValueError when a required field was not entered
+        """
+        return self.calculate(*record_fields(record, ('fasting_glucose', 'fasting_insulin')))
+    
+    def calculate_batch(self, fasting_glucose, fasting_insulin):
+        """
+        Calculate HOMA-Beta for many patients with array operations
+        
+        Parameters:
+        - fasting_glucose: Array of fasting glucose values (mg/dL)
+        - fasting_insulin: Array of fasting insulin values (μU/mL)
+        
+        Returns:
+        - Dictionary with the unrounded 'homa_beta' array (NaN for invalid rows), 'interpretation_code'
+          (int8 codes into HOMA_BETA_INTERPRETATIONS) and 'error', int8 codes into VALIDATION_ERRORS;
+          a glucose of 63 mg/dL, where the formula divides by zero, is INVALID
+        """
+        cols, error = validate_columns({'fasting_glucose': fasting_glucose, 'fasting_insulin': fasting_insulin},
+                                       positive=('fasting_glucose', 'fasting_insulin'))
+        return self._score_batch(cols, error)
+    
+    def _score_batch(self, cols, error):
+        """HOMA-Beta and its interpretation codes from validated glucose/insulin columns"""
+        glucose_mmol = cols['fasting_glucose'] / 18
+        error = first_error(error, np.where(glucose_mmol == 3.5, INVALID, VALID))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            homa_beta = masked(np.maximum(0, (20 * cols['fasting_insulin']) / (glucose_mmol - 3.5)), error)
+        # The normal range 50-150% is closed on both ends, hence np.select rather than np.digitize
+        codes = np.select([homa_beta < 50, homa_beta <= 150], [1, 2], 3).astype(np.int8)
+        codes[np.isnan(homa_beta)] = 0
+        return {'homa_beta': homa_beta, 'interpretation_code': codes, 'error': error}
+
+
+class EndocrinePanelCalculator:
+    """
+    BMI, HOMA-IR and HOMA-Beta for a whole population in one call
+    """
+    
+    def calculate_batch(self, weight, height, fasting_glucose, fasting_insulin):
+        """
+        Calculate the three metabolic indices from columns given once
+        
+        The glucose/insulin pair is converted and validated once and shared by HOMA-IR and
+        HOMA-Beta; BMI is validated on weight and height only, so a missing insulin does not
+        blank it.
+        
+        Parameters:
+        - weight (kg), height (cm), fasting_glucose (mg/dL), fasting_insulin (μU/mL): Arrays
+        
+        Returns:
+        - Dictionary with the 'bmi', 'homa_ir' and 'homa_beta' results, each as returned by
+          the calculate_batch method of its calculator
+        """
+        body, body_error = validate_columns({'weight': weight, 'height': height}, positive=('weight', 'height'))
+        labs, lab_error = validate_columns({'fasting_glucose': fasting_glucose, 'fasting_insulin': fasting_insulin},
+                                           positive=('fasting_glucose', 'fasting_insulin'))
+        return {
+            'bmi': BMICalculator()._score_batch(body, body_error),
+            'homa_ir': HOMAIRCalculator()._score_batch(labs, lab_error),
+            'homa_beta': HOMABetaCalculator()._score_batch(labs, lab_error),
+        }
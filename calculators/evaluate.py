@@ -0,0 +1,140 @@
+"""
+Evaluate All
+Runs every calculator whose inputs a patient has, sharing the derived values between them
+"""
+import numpy as np
+
+from calculators.endocrino import BMICalculator, EndocrinePanelCalculator
+from calculators.gastro import HepaticPanelCalculator
+from calculators.nephro import KtVCalculator, eGFRCalculator
+from calculators.patient import SEX_CODES, is_present, records_to_columns
+from calculators.registry import IncrementalEvaluator, default_registry
+from calculators.validation import float_column
+from prevent_calculator import PREVENTCalculator
+
+
+def evaluate_all(patient, prevent_calculator=None):
+    """
+    Evaluate every calculator whose inputs are present in one patient record
+
+    Runs the nodes of default_registry once, so the derived values (sex code, BMI, eGFR)
+    are calculated once and shared exactly as in the app's incremental evaluation.
+
+    Parameters:
+    - patient: PatientRecord or dictionary of patient data, keyed like the app's patient
+      data (age, sex, weight, height, total_chol, hdl_chol, creatinine, egfr, ...)
+    - prevent_calculator: PREVENTCalculator to use, e.g. one with a result cache
+
+    Returns:
+    - Dictionary with 'derived' ('sex' as 'F'/'M' or None, unrounded 'bmi' and
+      'creatinine_egfr', 'egfr' as entered else the unrounded creatinine eGFR, 'egfr_source' ('informada', 'creatinina' or None) and
+      the 'eTFG' result or None), 'results' (calculator name -> result dictionary of its
+      calculate method) and 'errors' (calculator name -> message for calculators that
+      rejected their inputs)
+    """
+    evaluation = IncrementalEvaluator(default_registry(prevent_calculator)).update(patient)
+    derived = dict(evaluation['derived'])
+    derived['eTFG'] = evaluation['results'].get('eTFG')
+    if derived['egfr'] is None:
+        derived['egfr_source'] = None
+    else:
+        derived['egfr_source'] = 'informada' if is_present(patient.get('egfr')) else 'creatinina'
+    return {'derived': derived, 'results': evaluation['results'], 'errors': evaluation['errors']}
+
+
+def _batch_columns(data, n):
+    """
+    Accessors for float columns of the cohort: NaN where a field is absent, 0 for absent flags
+    
+    Each field is converted once and the array is reused by every calculator that needs it.
+    """
+    converted = {}
+
+    def column(name):
+        if name not in converted:
+            converted[name] = (np.broadcast_to(float_column(data[name]), (n,)) if name in data
+                               else np.full(n, np.nan))
+        return converted[name]
+
+    def flag(name):
+        values = column(name)
+        return np.where(np.isnan(values), 0.0, values)
+    return column, flag
+
+
+def evaluate_all_batch(data, prevent_calculator=None):
+    """
+    Evaluate every calculator whose input columns are present over a whole cohort
+
+    Every field is converted to a float array once; BMI and eGFR are computed once and
+    shared (PREVENT gets the derived BMI and uses eGFR from creatinine where eGFR is
+    missing), and the hepatic and endocrine panels share their lab arrays. Which calculators
+    run is decided from the columns present, with the node schemas of default_registry
+    (see CalculatorRegistry.available).
+
+    Parameters:
+    - data: pandas DataFrame, PatientFrame or dict of columns with the patient record
+      fields, or a list of PatientRecord objects
+    - prevent_calculator: PREVENTCalculator to use
+
+    Returns:
+    - Dictionary with 'derived' ('sex' as 1.0 female / 0.0 male / NaN, 'bmi', 'egfr') and
+      'results', calculator name -> calculate_batch result arrays; invalid or incomplete rows
+      are NaN with an error code instead of raising
+    """
+    if isinstance(data, list):
+        data = records_to_columns(data)
+    # Row count from the first column that is not a broadcast scalar
+    n = next((len(data[name]) for name in data.keys() if np.ndim(data[name])), 0)
+    column, flag = _batch_columns(data, n)
+    if 'sex' in data:
+        sex = np.asarray(data['sex'].to_numpy() if hasattr(data['sex'], 'to_numpy') else data['sex'], dtype=object)
+        female = [code for code, value in SEX_CODES.items() if value == 'F']
+        male = [code for code, value in SEX_CODES.items() if value == 'M']
+        sex = np.where(np.isin(sex, female), 1.0, np.where(np.isin(sex, male), 0.0, np.nan))
+        sex = np.broadcast_to(sex, (n,))
+    else:
+        sex = np.full(n, np.nan)
+    calculator = prevent_calculator or PREVENTCalculator()
+    has = default_registry(calculator).available(data.keys())
+
+    results = {}
+    bmi = BMICalculator().calculate_batch(column('weight'), column('height'))
+    if 'IMC' in has:
+        results['IMC'] = bmi
+
+    egfr = column('egfr')
+    if 'eTFG' in has:
+        results['eTFG'] = eGFRCalculator().calculate_batch(column('creatinine'), column('age'), sex)
+        egfr = np.where(np.isnan(egfr), results['eTFG']['egfr'], egfr)
+
+    if {'HOMA-IR', 'HOMA-Beta'} & has:
+        endocrine = EndocrinePanelCalculator().calculate_batch(
+            column('weight'), column('height'), column('fasting_glucose'), column('fasting_insulin'))
+        results.update({name: endocrine[key] for name, key in (('HOMA-IR', 'homa_ir'), ('HOMA-Beta', 'homa_beta'))
+                        if name in has})
+
+    if {'FIB-4', 'MELD', 'Child-Pugh'} & has:
+        hepatic = HepaticPanelCalculator().calculate_batch(
+            column('age'), column('ast'), column('alt'), column('platelets'), column('bilirubin'), column('inr'),
+            column('creatinine'), column('albumin'), data.get('ascites', 'none'), data.get('encephalopathy', 'none'),
+            data.get('dialysis', False))
+        results.update({name: hepatic[key] for name, key in (('FIB-4', 'fib4'), ('MELD', 'meld'),
+                                                              ('Child-Pugh', 'child_pugh')) if name in has})
+
+    if 'Kt/V' in has:
+        post_weight = column('post_weight')
+        results['Kt/V'] = KtVCalculator().calculate_batch(
+            column('pre_bun'), column('post_bun'), column('dialysis_time'), column('ultrafiltration'),
+            np.where(np.isnan(post_weight), column('weight'), post_weight))
+
+    if 'PREVENT' in has:
+        uacr = np.where(flag('use_uacr') != 0, column('uacr'), np.nan) if 'use_uacr' in data else column('uacr')
+        hba1c = np.where(flag('use_hba1c') != 0, column('hba1c'), np.nan) if 'use_hba1c' in data else column('hba1c')
+        results['PREVENT'] = calculator.calculate_batch(
+            age=column('age'), sex=sex, total_cholesterol=column('total_chol'), hdl_cholesterol=column('hdl_chol'),
+            sbp=column('sbp'), on_bp_meds=flag('on_bp_meds'), diabetes=flag('diabetes'), smoker=flag('smoker'),
+            egfr=egfr, weight=column('weight'), height=column('height'), on_statins=flag('on_statins'),
+            uacr=np.where(uacr > 0, uacr, np.nan), hba1c=np.where(hba1c > 0, hba1c, np.nan), bmi=bmi['bmi'])
+
+    return {'derived': {'sex': sex, 'bmi': bmi['bmi'], 'egfr': egfr}, 'results': results}
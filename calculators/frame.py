@@ -0,0 +1,140 @@
+"""
+Patient Frame
+Columnar cohort container whose arrays the batch calculators read without copying
+"""
+import numpy as np
+
+from calculators.parallel import shard_bounds
+from calculators.patient import TEXT_FIELDS, records_to_columns
+
+
+class PatientFrame:
+    """
+    Cohort data as one NumPy array per field, with null masks
+
+    Float columns mark nulls with NaN, which is what the calculate_batch methods expect;
+    other columns (sex, flags, integer labs) carry an explicit boolean null mask. The frame
+    behaves like the dict of columns the batch methods take (frame['age'], 'egfr' in frame,
+    keys()), so it can be passed as their data argument, e.g.
+    PREVENTCalculator().calculate_batch(data=frame) or evaluate_all_batch(frame).
+    Projection and slicing return new frames over the same buffers.
+    """
+
+    def __init__(self, columns, nulls=None):
+        """
+        Parameters:
+        - columns: Dict of field name -> 1-D array (kept as is, not copied)
+        - nulls: Dict of field name -> boolean array, True where the value is missing
+        """
+        self._columns = {name: np.asarray(values) for name, values in columns.items()}
+        self._nulls = {name: np.asarray(mask, dtype=bool) for name, mask in (nulls or {}).items()}
+        lengths = {len(values) for values in self._columns.values()} | {len(mask) for mask in self._nulls.values()}
+        if len(lengths) > 1:
+            raise ValueError("Todas as colunas devem ter o mesmo número de linhas")
+        self._n_rows = lengths.pop() if lengths else 0
+
+    @classmethod
+    def from_pandas(cls, df):
+        """
+        Wrap a pandas DataFrame
+
+        NumPy-backed float and bool columns are shared with the DataFrame; nullable
+        extension columns (Float64, Int64, boolean) are converted once, with their NA mask.
+        """
+        columns, nulls = {}, {}
+        for name in df.columns:
+            series = df[name]
+            if series.dtype.kind in 'fb' and isinstance(series.dtype, np.dtype):
+                columns[name] = series.to_numpy()
+                continue
+            mask = series.isna().to_numpy()
+            if series.dtype.kind in 'biuf':
+                columns[name] = series.to_numpy(dtype=float, na_value=np.nan)
+            else:
+                columns[name] = series.to_numpy(dtype=object)
+            if mask.any():
+                nulls[name] = mask
+        return cls(columns, nulls)
+
+    @classmethod
+    def from_arrow(cls, table):
+        """
+        Wrap a pyarrow Table
+
+        Numeric columns stored in one chunk without nulls are zero-copy views of the Arrow
+        buffers. Columns with nulls are converted once (NaN for numbers) and keep the
+        validity bitmap as their null mask.
+        """
+        import pyarrow as pa  # only needed for Arrow input
+
+        columns, nulls = {}, {}
+        for name in table.column_names:
+            chunked = table.column(name)
+            array = chunked.chunk(0) if chunked.num_chunks == 1 else chunked.combine_chunks()
+            zero_copy = array.null_count == 0 and (pa.types.is_integer(array.type) or pa.types.is_floating(array.type))
+            columns[name] = array.to_numpy(zero_copy_only=zero_copy)
+            if array.null_count:
+                nulls[name] = array.is_null().to_numpy(zero_copy_only=False)
+        return cls(columns, nulls)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a frame from PatientRecord objects (or patient dicts)"""
+        columns = records_to_columns(records)
+        nulls = {name: np.array([value is None for value in columns[name]], dtype=bool) for name in TEXT_FIELDS}
+        return cls(columns, nulls)
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def keys(self):
+        return self._columns.keys()
+
+    def get(self, name, default=None):
+        return self._columns.get(name, default)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return self._n_rows
+
+    def __getitem__(self, key):
+        """A column array by name, or a frame of the rows of a slice"""
+        if isinstance(key, slice):
+            return PatientFrame({name: values[key] for name, values in self._columns.items()},
+                                {name: mask[key] for name, mask in self._nulls.items()})
+        if key not in self._columns:
+            raise KeyError(key)
+        return self._columns[key]
+
+    def null_mask(self, name):
+        """Boolean array, True where the field is missing"""
+        if name in self._nulls:
+            return self._nulls[name]
+        values = self[name]
+        if values.dtype.kind == 'f':
+            return np.isnan(values)
+        if values.dtype.kind == 'O':
+            return np.array([value is None for value in values], dtype=bool)
+        return np.zeros(len(values), dtype=bool)
+
+    def project(self, names):
+        """Frame with only the given fields, sharing their arrays"""
+        unknown = [name for name in names if name not in self._columns]
+        if unknown:
+            raise ValueError(f"Colunas desconhecidas: {', '.join(unknown)}")
+        return PatientFrame({name: self._columns[name] for name in names},
+                            {name: self._nulls[name] for name in names if name in self._nulls})
+
+    def chunks(self, chunk_size):
+        """Consecutive frames of at most chunk_size rows, viewing this frame's arrays"""
+        for start, stop in shard_bounds(self._n_rows, chunk_size):
+            yield self[start:stop]
+
+    def __repr__(self):
+        return f"PatientFrame({self._n_rows} linhas, colunas={self.columns})"
@@ -4,6 +4,41 @@ Contains FIB-4, MELD, and Child-Pugh calculators
 """
 import numpy as np
 
+from calculators.patient import record_fields
+from calculators.validation import first_error, float_column, masked, sex_column, validate_columns
+
+# Category codes returned by the calculate_batch methods. Each tuple is indexed by its code;
+# code 0 means the score could not be computed for that row.
+FIB4_RISKS = ('Indisponível', 'Baixo', 'Intermediário', 'Alto')
+MELD_CATEGORIES = ('Indisponível', 'Doença hepática compensada', 'Doença hepática moderada',
+                   'Doença hepática grave', 'Doença hepática muito grave')
+MELD_THRESHOLDS = (10, 20, 30)
+CHILD_PUGH_CLASSES = ('Indisponível', 'A', 'B', 'C')
+CHILD_PUGH_THRESHOLDS = (7, 10)
+
+# Points of the Child-Pugh clinical findings; unknown or missing values score 1, as in calculate
+ASCITES_POINTS = {'none': 1, 'mild': 2, 'moderate_severe': 3}
+ENCEPHALOPATHY_POINTS = {'none': 1, 'grade_1_2': 2, 'grade_3_4': 3}
+
+
+def _category_codes(values, conditions):
+    """int8 codes 1..n for the first matching condition, 0 where values is NaN"""
+    codes = np.select(conditions, np.arange(1, len(conditions) + 1), len(conditions) + 1).astype(np.int8)
+    codes[np.isnan(values)] = 0
+    return codes
+
+
+def _finding_points(values, points):
+    """Map a column of categorical findings to points, 1 for anything unknown"""
+    values = np.asarray(values, dtype=object)
+    return np.select([values == name for name in points], list(points.values()), 1)
+
+
+def _flag_column(values):
+    """Boolean column from flags where None/NaN count as False"""
+    values = float_column(values)
+    return np.where(np.isnan(values), False, values != 0)
+
 
 class FIB4Calculator:
     """
@@ -45,6 +80,37 @@ class FIB4Calculator:
             'interpretation': interpretation,
             'risk': risk
         }
+    
+    def calculate_record(self, record):
+        """
+        Calculate FIB-4 from a patient's age, AST, ALT and platelets
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        
+        Returns:
+        - As for calculate; raises ValueError when a required field was not entered
+        """
+        return self.calculate(*record_fields(record, ('age', 'ast', 'alt', 'platelets')))
+    
+    def calculate_batch(self, age, ast, alt, platelets):
+        """
+        Calculate FIB-4 for many patients with array operations
+        
+        Parameters:
+        - age, ast, alt, platelets: Arrays with the same units as calculate
+        
+        Returns:
+        - Dictionary with the unrounded 'score' array (NaN for invalid rows), 'risk_code'
+          (int8 codes into FIB4_RISKS) and 'error', int8 codes into VALIDATION_ERRORS
+        """
+        cols, error = validate_columns({'age': age, 'ast': ast, 'alt': alt, 'platelets': platelets},
+                                       positive=('platelets', 'alt'))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = masked((cols['age'] * cols['ast']) / (cols['platelets'] * np.sqrt(cols['alt'])), error)
+        # 1.45 belongs to the intermediate band and 3.25 too, hence np.select rather than np.digitize
+        risk_code = _category_codes(score, [score < 1.45, score <= 3.25])
+        return {'score': score, 'risk_code': risk_code, 'error': error}
 
 
 class MELDCalculator:
@@ -100,6 +166,93 @@ class MELDCalculator:
             'interpretation': interpretation,
             'mortality': mortality
         }
+    
+    def calculate_record(self, record):
+        """
+        Calculate MELD from a patient's labs and dialysis flag
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        
+        Returns:
+        - As for calculate; raises ValueError when a required field was not entered
+        """
+        return self.calculate(*record_fields(record, ('creatinine', 'bilirubin', 'inr')),
+                              dialysis=bool(record.get('dialysis', False)))
+    
+    def _clamped_logs(self, creatinine, bilirubin, inr, dialysis):
+        """Logs of the labs floored at 1.0 (creatinine set to 4 on dialysis), as in calculate"""
+        creatinine = np.where(dialysis, 4.0, np.maximum(1.0, creatinine))
+        return {
+            'creatinine': np.log(creatinine),
+            'bilirubin': np.log(np.maximum(1.0, bilirubin)),
+            'inr': np.log(np.maximum(1.0, inr)),
+        }
+    
+    def calculate_batch(self, creatinine, bilirubin, inr, dialysis=False, sodium=None, albumin=None, sex=None):
+        """
+        Calculate MELD for many patients with array operations, optionally with MELD-Na and MELD 3.0
+        
+        Parameters:
+        - creatinine, bilirubin, inr: Arrays with the same units as calculate
+        - dialysis: Boolean array (or one flag for all rows); missing counts as False
+        - sodium: Serum sodium (mEq/L); adds MELD-Na (OPTN 2016)
+        - albumin, sex ('F'/'M'): Together with sodium, add MELD 3.0 (Kim et al., 2021)
+        
+        Returns:
+        - Dictionary with the integer 'score' (6-40, as floats so invalid rows can be NaN),
+          'category_code' (int8 codes into MELD_CATEGORIES) and 'error', int8 codes into
+          VALIDATION_ERRORS
+        - With sodium: 'meld_na' and 'meld_na_error'; with sodium, albumin and sex also
+          'meld_3' and 'meld_3_error' (scores 6-40, NaN for invalid rows)
+        """
+        cols, error = validate_columns({'creatinine': creatinine, 'bilirubin': bilirubin, 'inr': inr})
+        sodium = float_column(sodium) if sodium is not None else None
+        albumin = float_column(albumin) if albumin is not None else None
+        female = sex_column(sex) if sex is not None else None
+        return self._score_batch(cols, _flag_column(dialysis), error, sodium, albumin, female)
+    
+    def _score_batch(self, cols, dialysis, error, sodium=None, albumin=None, female=None):
+        """MELD and the variants whose inputs are given, from validated lab columns"""
+        logs = self._clamped_logs(cols['creatinine'], cols['bilirubin'], cols['inr'], dialysis)
+        meld = 3.78 * logs['bilirubin'] + 11.2 * logs['inr'] + 9.57 * logs['creatinine'] + 6.43
+        # np.round rounds halves to even like round() in calculate
+        score = masked(np.clip(np.round(meld), 6, 40), error)
+        category_code = np.digitize(score, MELD_THRESHOLDS).astype(np.int8) + 1
+        category_code[np.isnan(score)] = 0
+        results = {'score': score, 'category_code': category_code, 'error': error}
+
+        if sodium is not None:
+            results.update(self._meld_na(logs, sodium, error))
+        if sodium is not None and albumin is not None and female is not None:
+            results.update(self._meld_3(logs, sodium, albumin, female, error))
+        return results
+    
+    def _variant_error(self, error, *columns):
+        """Combine the MELD error codes with missing values of a variant's extra inputs"""
+        _, extra_error = validate_columns(dict(enumerate(columns)))
+        return first_error(error, extra_error)
+    
+    def _meld_na(self, logs, sodium, error):
+        """MELD-Na (OPTN 2016) from the clamped logs; creatinine is capped at 4"""
+        log_creatinine = np.minimum(logs['creatinine'], np.log(4.0))
+        meld_i = 0.957 * log_creatinine + 0.378 * logs['bilirubin'] + 1.120 * logs['inr'] + 0.643
+        meld_i = np.round(meld_i, 1) * 10
+        sodium_gap = 137 - np.clip(sodium, 125, 137)
+        meld_na = np.where(meld_i > 11, meld_i + 1.32 * sodium_gap - 0.033 * meld_i * sodium_gap, meld_i)
+        na_error = self._variant_error(error, sodium)
+        return {'meld_na': masked(np.clip(np.round(meld_na), 6, 40), na_error), 'meld_na_error': na_error}
+    
+    def _meld_3(self, logs, sodium, albumin, female, error):
+        """MELD 3.0 (Kim et al., 2021) from the clamped logs; creatinine is capped at 3"""
+        log_creatinine = np.minimum(logs['creatinine'], np.log(3.0))
+        sodium_gap = 137 - np.clip(sodium, 125, 137)
+        albumin_gap = 3.5 - np.clip(albumin, 1.5, 3.5)
+        meld_3 = (1.33 * female + 4.56 * logs['bilirubin'] + 0.82 * sodium_gap
+                  - 0.24 * sodium_gap * logs['bilirubin'] + 9.09 * logs['inr'] + 11.14 * log_creatinine
+                  + 1.85 * albumin_gap - 1.83 * albumin_gap * log_creatinine + 6)
+        meld_3_error = self._variant_error(error, sodium, albumin, female)
+        return {'meld_3': masked(np.clip(np.round(meld_3), 6, 40), meld_3_error), 'meld_3_error': meld_3_error}
 
 
 class ChildPughCalculator:
@@ -179,3 +332,85 @@ class ChildPughCalculator:
             'survival_1_year': survival_1yr,
             'survival_2_year': survival_2yr
         }
+    
+    def calculate_record(self, record):
+        """
+        Calculate Child-Pugh from a patient's labs and findings (None as 'none')
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        
+        Returns:
+        - As for calculate; raises ValueError when a required field was not entered
+        """
+        return self.calculate(*record_fields(record, ('bilirubin', 'albumin', 'inr')),
+                              record.get('ascites') or 'none', record.get('encephalopathy') or 'none')
+    
+    def calculate_batch(self, bilirubin, albumin, inr, ascites='none', encephalopathy='none'):
+        """
+        Calculate Child-Pugh for many patients with array operations
+        
+        Parameters:
+        - bilirubin, albumin, inr: Arrays with the same units as calculate
+        - ascites, encephalopathy: Arrays (or one value for all rows) of the categories
+          accepted by calculate
+        
+        Returns:
+        - Dictionary with the 'score' (5-15, as floats so invalid rows can be NaN),
+          'class_code' (int8 codes into CHILD_PUGH_CLASSES) and 'error', int8 codes into
+          VALIDATION_ERRORS
+        """
+        cols, error = validate_columns({'bilirubin': bilirubin, 'albumin': albumin, 'inr': inr})
+        return self._score_batch(cols, ascites, encephalopathy, error)
+    
+    def _score_batch(self, cols, ascites, encephalopathy, error):
+        """Child-Pugh from validated lab columns"""
+        bilirubin, albumin, inr = cols['bilirubin'], cols['albumin'], cols['inr']
+        points = (np.select([bilirubin < 2, bilirubin <= 3], [1, 2], 3)
+                  + np.select([albumin > 3.5, albumin >= 2.8], [1, 2], 3)
+                  + np.select([inr < 1.7, inr <= 2.3], [1, 2], 3)
+                  + np.broadcast_to(_finding_points(ascites, ASCITES_POINTS), bilirubin.shape)
+                  + np.broadcast_to(_finding_points(encephalopathy, ENCEPHALOPATHY_POINTS), bilirubin.shape))
+        score = masked(points, error)
+        class_code = np.digitize(score, CHILD_PUGH_THRESHOLDS).astype(np.int8) + 1
+        class_code[np.isnan(score)] = 0
+        return {'score': score, 'class_code': class_code, 'error': error}
+
+
+class HepaticPanelCalculator:
+    """
+    FIB-4, MELD and Child-Pugh for a whole population in one call
+    """
+    
+    def calculate_batch(self, age, ast, alt, platelets, bilirubin, inr, creatinine, albumin,
+                        ascites='none', encephalopathy='none', dialysis=False, sodium=None, sex=None):
+        """
+        Calculate the three hepatic scores from lab columns given once
+        
+        Every lab column is converted to a float array once and shared by the scores that
+        use it (bilirubin and INR by MELD and Child-Pugh). Each score is validated on its
+        own inputs, so e.g. a missing platelet count only blanks FIB-4.
+        
+        Parameters:
+        - age, ast, alt, platelets: FIB-4 inputs
+        - bilirubin, inr, creatinine, albumin: MELD and Child-Pugh labs
+        - ascites, encephalopathy: Child-Pugh findings
+        - dialysis: MELD dialysis flag
+        - sodium, sex: Optional; add MELD-Na and MELD 3.0 to the MELD results (albumin is shared)
+        
+        Returns:
+        - Dictionary with the 'fib4', 'meld' and 'child_pugh' results, each as returned by
+          the calculate_batch method of its calculator
+        """
+        labs, _ = validate_columns({'age': age, 'ast': ast, 'alt': alt, 'platelets': platelets,
+                                    'bilirubin': bilirubin, 'inr': inr, 'creatinine': creatinine,
+                                    'albumin': albumin})
+        meld_cols, meld_error = validate_columns({name: labs[name] for name in ('creatinine', 'bilirubin', 'inr')})
+        child_cols, child_error = validate_columns({name: labs[name] for name in ('bilirubin', 'albumin', 'inr')})
+        return {
+            'fib4': FIB4Calculator().calculate_batch(labs['age'], labs['ast'], labs['alt'], labs['platelets']),
+            'meld': MELDCalculator()._score_batch(
+                meld_cols, _flag_column(dialysis), meld_error, float_column(sodium) if sodium is not None else None,
+                labs['albumin'], sex_column(sex) if sex is not None else None),
+            'child_pugh': ChildPughCalculator()._score_batch(child_cols, ascites, encephalopathy, child_error),
+        }
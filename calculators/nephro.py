@@ -2,8 +2,55 @@
 Nephrology Calculators
 Contains eGFR and Kt/V calculators
 """
+import bisect
+import heapq
+
 import numpy as np
 
+from calculators.patient import SEX_CODES, record_fields
+from calculators.validation import INVALID, VALID, first_error, masked, sex_column, validate_columns
+
+# CKD stages returned as codes by eGFRCalculator.calculate_batch; code 0 means unavailable.
+# CKD_STAGE_THRESHOLDS are the lower eGFR bounds (mL/min/1.73m²) of stages G4 to G1.
+CKD_STAGES = ('Indisponível', 'G1 (Normal ou aumentada)', 'G2 (Levemente diminuída)',
+              'G3a (Leve a moderadamente diminuída)', 'G3b (Moderada a gravemente diminuída)',
+              'G4 (Gravemente diminuída)', 'G5 (Falência renal)')
+CKD_STAGE_DESCRIPTIONS = ('Indisponível', 'TFG normal ou aumentada', 'Leve redução da TFG',
+                          'Redução leve a moderada da TFG', 'Redução moderada a grave da TFG',
+                          'Redução grave da TFG', 'Falência renal')
+CKD_STAGE_THRESHOLDS = (15, 30, 45, 60, 90)
+
+# Sustained eGFR decline (mL/min/1.73m² per year) above which KDIGO considers progression rapid
+RAPID_DECLINE_THRESHOLD = 5.0
+
+# Session adequacy returned as codes by KtVCalculator.calculate_batch (spKt/V >= 1.4 / >= 1.2)
+KTV_ADEQUACY = ('Indisponível', 'Adequada', 'Limítrofe', 'Inadequada')
+KTV_THRESHOLDS = (1.2, 1.4)
+# KDOQI minimum weekly standard Kt/V
+STD_KTV_TARGET = 2.1
+# Upper limit of the ultrafiltration rate (mL/kg/h) allowed by the prescription optimizer
+MAX_UF_RATE = 13.0
+MINUTES_PER_WEEK = 10080
+
+
+def std_ktv(ektv, session_hours, sessions_per_week):
+    """
+    Weekly standard Kt/V (Leypoldt / FHN formula, without the ultrafiltration correction)
+
+    Parameters:
+    - ektv: Equilibrated Kt/V of a typical session
+    - session_hours: Session length in hours
+    - sessions_per_week: Number of sessions in the week
+
+    Returns:
+    - stdKt/V (scalar or array)
+    """
+    minutes = np.asarray(session_hours, dtype=float) * 60
+    with np.errstate(divide='ignore', invalid='ignore'):
+        removed = 1 - np.exp(-np.asarray(ektv, dtype=float))
+        return ((MINUTES_PER_WEEK * removed / minutes)
+                / (removed / ektv + MINUTES_PER_WEEK / (sessions_per_week * minutes) - 1))
+
 
 class eGFRCalculator:
     """
@@ -22,6 +69,28 @@ class eGFRCalculator:
         Returns:
         - Dictionary with eGFR and CKD stage
         """
+        return self.classify(self.creatinine_egfr(creatinine, age, sex))
+    
+    def calculate_record(self, record):
+        """
+        Calculate the creatinine eGFR from a patient's creatinine, age and sex
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        
+        Returns:
+        - As for calculate; raises ValueError when a required field was not entered
+        """
+        creatinine, age = record_fields(record, ('creatinine', 'age'))
+        return self.calculate(creatinine, age, SEX_CODES.get(record.get('sex')))
+    
+    def creatinine_egfr(self, creatinine, age, sex):
+        """
+        Unrounded CKD-EPI 2021 creatinine eGFR (mL/min/1.73m²), e.g. to share with PREVENT
+        
+        Parameters:
+        - creatinine, age, sex: As for calculate
+        """
         if sex == 'F':
             kappa = 0.7
             alpha = -0.241
@@ -36,7 +105,18 @@ class eGFRCalculator:
                 egfr = 142 * (creatinine / kappa) ** alpha * 0.9938 ** age
             else:
                 egfr = 142 * (creatinine / kappa) ** (-1.200) * 0.9938 ** age
+        return egfr
+    
+    def classify(self, egfr):
+        """
+        CKD stage of an already calculated eGFR
+        
+        Parameters:
+        - egfr: Unrounded eGFR (mL/min/1.73m²)
         
+        Returns:
+        - Dictionary with eGFR and CKD stage, as for calculate
+        """
         # Determine CKD stage
         if egfr >= 90:
             stage = "G1 (Normal ou aumentada)"
@@ -62,6 +142,128 @@ class eGFRCalculator:
             'stage': stage,
             'description': description
         }
+    
+    def calculate_batch(self, creatinine, age, sex, cystatin_c=None):
+        """
+        Calculate CKD-EPI eGFR and CKD stage for many results with array operations
+        
+        The creatinine (2021), cystatin C (2012) and creatinine-cystatin C (2021) equations
+        share the age and sex arrays and the scaled creatinine/cystatin ratios.
+        
+        Parameters:
+        - creatinine: Array of serum creatinine values (mg/dL)
+        - age: Array of ages in years
+        - sex: Array of 'F'/'M' (or 1/0 for female/male)
+        - cystatin_c: Optional array of serum cystatin C values (mg/L)
+        
+        Returns:
+        - Dictionary with the creatinine-based 'egfr' (unrounded, NaN for invalid rows),
+          'stage_code' (int8 codes into CKD_STAGES / CKD_STAGE_DESCRIPTIONS) and 'error',
+          int8 codes into VALIDATION_ERRORS
+        - With cystatin_c, the same three entries for the cystatin C equation ('egfr_cys',
+          'egfr_cys_stage_code', 'egfr_cys_error') and the combined equation ('egfr_cr_cys',
+          'egfr_cr_cys_stage_code', 'egfr_cr_cys_error')
+        """
+        demographics, demographics_error = validate_columns({'age': age, 'sex': sex_column(sex)})
+        age, female = demographics['age'], demographics['sex'] == 1
+        labs, creatinine_error = validate_columns({'creatinine': creatinine}, positive=('creatinine',))
+        error = first_error(demographics_error, creatinine_error)
+        creatinine_ratio = labs['creatinine'] / np.where(female, 0.7, 0.9)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            results = self._equation_results('egfr', self._creatinine_egfr(creatinine_ratio, age, female), error)
+            if cystatin_c is not None:
+                labs, cystatin_error = validate_columns({'cystatin_c': cystatin_c}, positive=('cystatin_c',))
+                cystatin_ratio = labs['cystatin_c'] / 0.8
+                results.update(self._equation_results(
+                    'egfr_cys', self._cystatin_egfr(cystatin_ratio, age, female),
+                    first_error(demographics_error, cystatin_error)))
+                results.update(self._equation_results(
+                    'egfr_cr_cys', self._combined_egfr(creatinine_ratio, cystatin_ratio, age, female),
+                    first_error(error, cystatin_error)))
+        return results
+    
+    def calculate_trajectories(self, patient_id, date, creatinine, age, sex,
+                               decline_threshold=RAPID_DECLINE_THRESHOLD):
+        """
+        Calculate eGFR for a longitudinal creatinine series and the eGFR slope of each patient
+        
+        All eGFRs are computed in one calculate_batch pass. Measurements are then sorted by
+        (patient, date) and the least-squares sums of every patient are taken with
+        np.add.reduceat, without a Python loop over patients.
+        
+        Parameters:
+        - patient_id: Array with the patient of each measurement (long format)
+        - date: Array of measurement dates (datetime64, date strings or datetime objects)
+        - creatinine, age, sex: Arrays as for calculate_batch, age at the measurement
+        - decline_threshold: Yearly eGFR loss from which a patient is flagged
+        
+        Returns:
+        - Dictionary with 'measurements', the calculate_batch results in input order, and
+          'patients', per-patient arrays sorted by id: 'patient_id', 'n_measurements' (valid
+          ones), 'last_date', 'last_egfr', 'slope' (mL/min/1.73m² per year; NaN with fewer
+          than two measurement dates) and 'rapid_decline' (slope below -decline_threshold)
+        """
+        measurements = self.calculate_batch(creatinine, age, sex)
+        patient_id = patient_id.to_numpy() if hasattr(patient_id, 'to_numpy') else np.asarray(patient_id)
+        date = np.asarray(date, dtype='datetime64[D]')
+
+        valid = ~np.isnan(measurements['egfr']) & ~np.isnat(date)
+        ids, days, egfr = patient_id[valid], date[valid], measurements['egfr'][valid]
+        order = np.lexsort((days, ids))
+        ids, days, egfr = ids[order], days[order], egfr[order]
+
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.array([], dtype=int)
+        counts = np.diff(np.r_[starts, len(ids)])
+        # Years since each patient's first measurement, which keeps the sums well conditioned
+        years = (days - np.repeat(days[starts], counts)).astype(float) / 365.25
+        sum_t, sum_y, sum_tt, sum_ty = (np.add.reduceat(values, starts) if len(ids) else np.array([])
+                                        for values in (years, egfr, years * years, years * egfr))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            denominator = counts * sum_tt - sum_t ** 2
+            slope = np.where(denominator > 0, (counts * sum_ty - sum_t * sum_y) / denominator, np.nan)
+
+        last = starts + counts - 1
+        patients = {
+            'patient_id': ids[starts],
+            'n_measurements': counts,
+            'last_date': days[last],
+            'last_egfr': egfr[last],
+            'slope': slope,
+            'rapid_decline': slope < -decline_threshold,
+        }
+        return {'measurements': measurements, 'patients': patients}
+    
+    def _equation_results(self, name, egfr, error):
+        """Masked eGFR, stage codes and errors of one equation, keyed by its name"""
+        egfr = masked(egfr, error)
+        # The creatinine equation keeps the plain 'stage_code' / 'error' keys
+        prefix = '' if name == 'egfr' else f'{name}_'
+        return {name: egfr, f'{prefix}stage_code': self._stage_codes(egfr), f'{prefix}error': error}
+    
+    def _creatinine_egfr(self, ratio, age, female):
+        """CKD-EPI 2021 creatinine equation on Scr/kappa; min/max select the branch of calculate"""
+        alpha = np.where(female, -0.241, -0.302)
+        return (142 * np.minimum(ratio, 1) ** alpha * np.maximum(ratio, 1) ** -1.200
+                * 0.9938 ** age * np.where(female, 1.012, 1.0))
+    
+    def _cystatin_egfr(self, ratio, age, female):
+        """CKD-EPI 2012 cystatin C equation on Scys/0.8"""
+        return (133 * np.minimum(ratio, 1) ** -0.499 * np.maximum(ratio, 1) ** -1.328
+                * 0.996 ** age * np.where(female, 0.932, 1.0))
+    
+    def _combined_egfr(self, creatinine_ratio, cystatin_ratio, age, female):
+        """CKD-EPI 2021 creatinine-cystatin C equation on Scr/kappa and Scys/0.8"""
+        alpha = np.where(female, -0.219, -0.144)
+        return (135 * np.minimum(creatinine_ratio, 1) ** alpha * np.maximum(creatinine_ratio, 1) ** -0.544
+                * np.minimum(cystatin_ratio, 1) ** -0.323 * np.maximum(cystatin_ratio, 1) ** -0.778
+                * 0.9961 ** age * np.where(female, 0.963, 1.0))
+    
+    def _stage_codes(self, egfr):
+        """int8 CKD stage codes (1 = G1 ... 6 = G5, 0 for NaN)"""
+        codes = (len(CKD_STAGE_THRESHOLDS) + 1 - np.digitize(egfr, CKD_STAGE_THRESHOLDS)).astype(np.int8)
+        codes[np.isnan(egfr)] = 0
+        return codes
 
 
 class KtVCalculator:
@@ -85,9 +287,13 @@ class KtVCalculator:
         """
         if pre_bun <= 0 or post_bun <= 0:
             raise ValueError("BUN pré e pós devem ser maiores que zero")
+        if dialysis_time <= 0:
+            raise ValueError("Tempo de diálise deve ser maior que zero")
         
         # Daugirdas II formula
         r = post_bun / pre_bun
+        if r - 0.008 * dialysis_time <= 0:
+            raise ValueError("Razão BUN pós/pré incompatível com o tempo de diálise")
         
         ktv = -np.log(r - 0.008 * dialysis_time) + (4 - 3.5 * r) * (ultrafiltration / post_weight)
         
@@ -107,3 +313,189 @@ class KtVCalculator:
             'adequacy': adequacy,
             'recommendation': recommendation
         }
+    
+    def calculate_record(self, record):
+        """
+        Calculate Kt/V from a patient's session data, post_weight defaulting to weight
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        
+        Returns:
+        - As for calculate; raises ValueError when a required field was not entered
+        """
+        weight = 'post_weight' if record.get('post_weight') else 'weight'
+        return self.calculate(*record_fields(record, ('pre_bun', 'post_bun', 'dialysis_time', 'ultrafiltration', weight)))
+    
+    def calculate_batch(self, pre_bun, post_bun, dialysis_time, ultrafiltration, post_weight):
+        """
+        Calculate Kt/V for many sessions with array operations
+        
+        Parameters:
+        - pre_bun, post_bun, dialysis_time, ultrafiltration, post_weight: Arrays with the
+          same units as calculate
+        
+        Returns:
+        - Dictionary with the unrounded single-pool 'ktv' array (NaN for invalid rows),
+          'ektv' (equilibrated Kt/V, Daugirdas-Schneditz rate equation), 'adequacy_code' (int8
+          codes into KTV_ADEQUACY) and 'error', int8 codes into VALIDATION_ERRORS; sessions
+          whose post/pre BUN ratio is not above 0.008 * hours, where the logarithm is undefined,
+          are INVALID
+        """
+        cols, error = validate_columns(
+            {'pre_bun': pre_bun, 'post_bun': post_bun, 'dialysis_time': dialysis_time,
+             'ultrafiltration': ultrafiltration, 'post_weight': post_weight},
+            positive=('pre_bun', 'post_bun', 'dialysis_time', 'post_weight'))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = cols['post_bun'] / cols['pre_bun']
+            log_arg = r - 0.008 * cols['dialysis_time']
+            error = first_error(error, np.where(log_arg > 0, VALID, INVALID))
+            ktv = masked(-np.log(log_arg)
+                         + (4 - 3.5 * r) * (cols['ultrafiltration'] / cols['post_weight']), error)
+            ektv = ktv - 0.6 * ktv / cols['dialysis_time'] + 0.03
+        adequacy_code = (len(KTV_THRESHOLDS) + 1 - np.digitize(ktv, KTV_THRESHOLDS)).astype(np.int8)
+        adequacy_code[np.isnan(ktv)] = 0
+        return {'ktv': ktv, 'ektv': ektv, 'adequacy_code': adequacy_code, 'error': error}
+    
+    def optimize_prescription(self, pre_bun, post_bun, dialysis_time, ultrafiltration, post_weight,
+                              target=1.4, max_time=8.0, time_step=0.25, max_uf_rate=MAX_UF_RATE):
+        """
+        Find the shortest session (and the least ultrafiltration) reaching a target spKt/V
+        
+        The observed session gives each patient's urea removal rate k = -ln(R)/t, so a session
+        of t hours is expected to leave R(t) = exp(-k t). For a fixed time Daugirdas II is
+        linear in the ultrafiltration volume, so the smallest sufficient UF is solved in closed
+        form, and only the session time is searched, on a grid evaluated for all patients at once.
+        
+        Parameters:
+        - pre_bun, post_bun, dialysis_time, ultrafiltration, post_weight: Arrays describing the
+          last session, as for calculate_batch; its UF is kept as the minimum to prescribe
+        - target: spKt/V to reach
+        - max_time: Longest session considered (hours)
+        - time_step: Resolution of the session time grid (hours)
+        - max_uf_rate: Highest ultrafiltration rate allowed (mL/kg/h)
+        
+        Returns:
+        - Dictionary with the prescribed 'dialysis_time' (hours) and 'ultrafiltration' (L), the
+          expected 'ktv' (all NaN when no prescription up to max_time reaches the target) and
+          'error', int8 codes into VALIDATION_ERRORS
+        """
+        cols, error = validate_columns(
+            {'pre_bun': pre_bun, 'post_bun': post_bun, 'dialysis_time': dialysis_time,
+             'ultrafiltration': ultrafiltration, 'post_weight': post_weight},
+            positive=('pre_bun', 'post_bun', 'dialysis_time', 'post_weight'))
+        times = np.arange(1, int(round(max_time / time_step)) + 1) * time_step
+        weight, minimum_uf = cols['post_weight'][:, None], cols['ultrafiltration'][:, None]
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            removal_rate = -np.log(cols['post_bun'] / cols['pre_bun']) / cols['dialysis_time']
+            r = np.exp(-removal_rate[:, None] * times)
+            # Kt/V(t, UF) = base(t) + gain(t) * UF
+            base = -np.log(r - 0.008 * times)
+            gain = (4 - 3.5 * r) / weight
+            uf = np.maximum(minimum_uf, (target - base) / gain)
+            feasible = (gain > 0) & (uf <= max_uf_rate / 1000 * weight * times) & (removal_rate[:, None] > 0)
+
+        rows = np.arange(len(error))
+        first = np.argmax(feasible, axis=1)
+        found = feasible[rows, first] & (error == VALID)
+        return {
+            'dialysis_time': np.where(found, times[first], np.nan),
+            'ultrafiltration': np.where(found, uf[rows, first], np.nan),
+            'ktv': np.where(found, base[rows, first] + gain[rows, first] * uf[rows, first], np.nan),
+            'error': error,
+        }
+
+
+class KtVSessionStream:
+    """
+    Rolling dialysis adequacy per patient, updated as session records arrive
+    
+    Every patient keeps lifetime totals and the sessions of the last week_days days. New
+    sessions are scored with KtVCalculator.calculate_batch and only touch the state of
+    their own patient, so history is never recomputed.
+    """
+    
+    def __init__(self, calculator=None, week_days=7):
+        self.calculator = calculator or KtVCalculator()
+        self.week_days = week_days
+        self._patients = {}
+    
+    def add_sessions(self, patient_id, date, pre_bun, post_bun, dialysis_time, ultrafiltration, post_weight):
+        """
+        Score a batch of sessions and fold them into the patient summaries
+        
+        Parameters:
+        - patient_id, date: Arrays identifying each session (dates as datetime64 or strings)
+        - pre_bun, post_bun, dialysis_time, ultrafiltration, post_weight: Arrays as for
+          KtVCalculator.calculate_batch
+        
+        Returns:
+        - The calculate_batch results of the new sessions, in input order; sessions with an
+          error code or without a date are not added to the summaries
+        """
+        results = self.calculator.calculate_batch(pre_bun, post_bun, dialysis_time, ultrafiltration, post_weight)
+        patient_id = patient_id.to_numpy() if hasattr(patient_id, 'to_numpy') else np.asarray(patient_id)
+        date = np.broadcast_to(np.asarray(date, dtype='datetime64[D]'), patient_id.shape)
+        ktv, ektv, hours = (np.broadcast_to(np.asarray(values, dtype=float), patient_id.shape)
+                            for values in (results['ktv'], results['ektv'], dialysis_time))
+        error = np.broadcast_to(results['error'], patient_id.shape)
+
+        valid = np.flatnonzero((error == VALID) & ~np.isnat(date))
+        if not len(valid):
+            return results
+        # Group the new sessions by patient, in date order within each patient
+        valid = valid[np.lexsort((date[valid], patient_id[valid]))]
+        ids, dates = patient_id[valid], date[valid]
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        counts = np.diff(np.r_[starts, len(valid)])
+        sum_ktv = np.add.reduceat(ktv[valid], starts)
+        sessions = list(zip(dates, ktv[valid].tolist(), ektv[valid].tolist(), hours[valid].tolist()))
+
+        for patient, start, count, total, last_date in zip(ids[starts].tolist(), starts.tolist(), counts.tolist(),
+                                                           sum_ktv.tolist(), dates[starts + counts - 1]):
+            self._merge(patient, sessions[start:start + count], total, last_date)
+        return results
+    
+    def _merge(self, patient_id, sessions, sum_ktv, last_date):
+        """Fold one patient's new sessions, sorted by date, into its state in a single update"""
+        state = self._patients.get(patient_id)
+        if state is None:
+            state = self._patients[patient_id] = {'sessions': 0, 'sum_ktv': 0.0, 'last_date': last_date, 'week': []}
+        state['sessions'] += len(sessions)
+        state['sum_ktv'] += sum_ktv
+        state['last_date'] = max(state['last_date'], last_date)
+
+        # Keep only the sessions within week_days of the latest one
+        cutoff = (state['last_date'] - np.timedelta64(self.week_days - 1, 'D'),)
+        recent = sessions[bisect.bisect_left(sessions, cutoff):]
+        week = state['week'][bisect.bisect_left(state['week'], cutoff):]
+        state['week'] = list(heapq.merge(week, recent))
+    
+    def summary(self, patient_id):
+        """
+        Adequacy summary of one patient
+        
+        Returns:
+        - Dictionary with the session count, mean and last spKt/V, the sessions of the
+          current week and their weekly standard Kt/V, and whether it reaches STD_KTV_TARGET
+        """
+        if patient_id not in self._patients:
+            raise ValueError(f"Paciente sem sessões registradas: {patient_id}")
+        state = self._patients[patient_id]
+        week = state['week']
+        weekly_std_ktv = float(std_ktv(np.mean([session[2] for session in week]),
+                                       np.mean([session[3] for session in week]), len(week)))
+        return {
+            'sessions': state['sessions'],
+            'mean_ktv': state['sum_ktv'] / state['sessions'],
+            'last_ktv': week[-1][1],
+            'last_date': state['last_date'],
+            'weekly_sessions': len(week),
+            'std_ktv': weekly_std_ktv,
+            'adequate': weekly_std_ktv >= STD_KTV_TARGET,
+        }
+    
+    def summaries(self):
+        """Summaries of all patients, keyed by patient id"""
+        return {patient_id: self.summary(patient_id) for patient_id in self._patients}
@@ -0,0 +1,182 @@
+"""
+Parallel Scoring
+Splits large cohorts into shards and scores them on several processes
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def shard_bounds(n_rows, chunk_size):
+    """
+    Split n_rows into consecutive (start, stop) shards of at most chunk_size rows
+
+    Parameters:
+    - n_rows: Total number of rows
+    - chunk_size: Maximum rows per shard
+
+    Returns:
+    - List of (start, stop) tuples covering all rows in order
+    """
+    if chunk_size <= 0:
+        raise ValueError("O tamanho do bloco deve ser maior que zero")
+    return [(start, min(start + chunk_size, n_rows)) for start in range(0, n_rows, chunk_size)]
+
+
+class SharedColumns:
+    """
+    Numeric column arrays stored in multiprocessing.shared_memory blocks
+
+    The parent creates the blocks; worker processes attach to them by name through
+    the small, picklable spec, so the arrays themselves are never serialized.
+    """
+
+    def __init__(self, spec, blocks, owner):
+        self.spec = spec
+        self.blocks = blocks
+        self.owner = owner
+        self.arrays = {name: np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+                       for name, (_, dtype, shape) in spec.items()}
+
+    @classmethod
+    def create(cls, columns):
+        """Allocate one block per column and copy the data in (numeric dtypes only)"""
+        columns = {name: np.asarray(values) for name, values in columns.items()}
+        # Check every column first so that a rejected one leaves no blocks behind
+        for name, values in columns.items():
+            if values.dtype.kind not in 'biuf':
+                raise ValueError(f"A coluna '{name}' não é numérica e não pode ser compartilhada")
+        spec, blocks = {}, {}
+        try:
+            for name, values in columns.items():
+                block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                blocks[name] = block
+                spec[name] = (block.name, values.dtype.str, values.shape)
+        except BaseException:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+            raise
+        shared = cls(spec, blocks, owner=True)
+        for name, values in columns.items():
+            shared.arrays[name][...] = values
+        return shared
+
+    @classmethod
+    def empty(cls, n_rows, dtypes):
+        """Allocate uninitialized output columns of n_rows for each name -> dtype"""
+        return cls.create({name: np.empty(n_rows, dtype=dtype) for name, dtype in dtypes.items()})
+
+    @classmethod
+    def attach(cls, spec):
+        """Open existing blocks from a spec created in another process"""
+        blocks = {name: shared_memory.SharedMemory(name=block_name) for name, (block_name, _, _) in spec.items()}
+        return cls(spec, blocks, owner=False)
+
+    def close(self):
+        """Release this process's views; the owner also frees the blocks"""
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _run_shared_shard(func, input_spec, output_spec, start, stop):
+    """Worker side of map_shards_shared: score rows start:stop in place"""
+    inputs, outputs = SharedColumns.attach(input_spec), SharedColumns.attach(output_spec)
+    try:
+        results = func({name: values[start:stop] for name, values in inputs.arrays.items()})
+        for name, values in outputs.arrays.items():
+            values[start:stop] = results[name]
+    finally:
+        inputs.close()
+        outputs.close()
+
+
+def _executor(executor, workers):
+    """Return (pool, owned) for an optional caller-supplied executor"""
+    if executor is not None:
+        return executor, False
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count()), True
+
+
+def map_shards(func, columns, workers=None, chunk_size=100_000, executor=None, outputs=None):
+    """
+    Score column arrays shard by shard in a process pool
+
+    Parameters:
+    - func: Module-level function taking a dict of column arrays and returning a
+      dict of result arrays of the same length (it is sent to the workers by name)
+    - columns: Dict of equally long column arrays
+    - workers: Number of worker processes (default: number of CPUs)
+    - chunk_size: Maximum rows per shard
+    - executor: Existing ProcessPoolExecutor to reuse instead of starting a new one
+    - outputs: Dict of result name -> dtype. When given (and all columns are numeric),
+      inputs and outputs live in shared memory and only shard bounds reach the workers;
+      otherwise each shard is pickled to its worker
+
+    Returns:
+    - Dict of result arrays, in the original row order
+    """
+    columns = {name: np.asarray(values) for name, values in columns.items()}
+    if outputs is not None and all(values.dtype.kind in 'biuf' for values in columns.values()):
+        return map_shards_shared(func, columns, outputs, workers, chunk_size, executor)
+
+    n_rows = len(next(iter(columns.values())))
+    shards = [{name: values[start:stop] for name, values in columns.items()}
+              for start, stop in shard_bounds(n_rows, chunk_size)]
+    if not shards:
+        return func(columns)
+
+    pool, owned = _executor(executor, workers)
+    try:
+        # Executor.map yields in submission order, so the merge is deterministic
+        results = list(pool.map(func, shards))
+    finally:
+        if owned:
+            pool.shutdown()
+
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+
+def map_shards_shared(func, columns, outputs, workers=None, chunk_size=100_000, executor=None):
+    """
+    Score numeric column arrays in a process pool through shared memory
+
+    Input columns are copied once into shared blocks and workers write their results
+    in place into preallocated output blocks, addressed by row offset.
+
+    Parameters:
+    - func, columns, workers, chunk_size, executor: As for map_shards
+    - outputs: Dict of result name -> dtype returned by func
+
+    Returns:
+    - Dict of result arrays, in the original row order
+    """
+    n_rows = len(next(iter(columns.values())))
+    bounds = shard_bounds(n_rows, chunk_size)
+    if not bounds:
+        return func(columns)
+
+    with SharedColumns.create(columns) as inputs, SharedColumns.empty(n_rows, outputs) as results:
+        pool, owned = _executor(executor, workers)
+        try:
+            futures = [pool.submit(_run_shared_shard, func, inputs.spec, results.spec, start, stop)
+                       for start, stop in bounds]
+            for future in futures:
+                future.result()
+        finally:
+            if owned:
+                pool.shutdown()
+        # Copy out before the blocks are freed
+        return {name: values.copy() for name, values in results.arrays.items()}
@@ -0,0 +1,150 @@
+"""
+Patient Record
+Fixed-field patient data shared by the app and the calculators
+"""
+import numpy as np
+
+from calculators.validation import float_column
+
+# Numeric and text fields are None when not entered, flags default to False
+NUMERIC_FIELDS = ('age', 'weight', 'height', 'sbp', 'total_chol', 'hdl_chol', 'creatinine', 'egfr', 'uacr',
+                  'fasting_glucose', 'hba1c', 'fasting_insulin', 'ast', 'alt', 'bilirubin', 'albumin', 'inr',
+                  'platelets', 'pre_bun', 'post_bun', 'dialysis_time', 'ultrafiltration', 'post_weight')
+# Categorical Child-Pugh findings ('none', 'mild', ...); the calculators read None as 'none'
+FINDING_FIELDS = ('ascites', 'encephalopathy')
+FLAG_FIELDS = ('diabetes', 'smoker', 'on_bp_meds', 'on_statins', 'dialysis', 'use_uacr', 'use_hba1c')
+TEXT_FIELDS = ('sex',) + FINDING_FIELDS
+PATIENT_FIELDS = ('sex',) + NUMERIC_FIELDS + FINDING_FIELDS + FLAG_FIELDS
+
+# Sex as entered in the app or as used by the calculators
+SEX_CODES = {'Feminino': 'F', 'Masculino': 'M', 'F': 'F', 'M': 'M'}
+
+
+def is_present(value):
+    """A usable value: flags always are, text must not be empty, numbers must be positive"""
+    if isinstance(value, (bool, str)):
+        return isinstance(value, bool) or value != ''
+    return value is not None and value > 0
+
+
+def prevent_optional_params(patient):
+    """UACR and HbA1c for PREVENT, only when their checkboxes are ticked and the values are valid"""
+    uacr = patient.get('uacr') if patient.get('use_uacr', False) and is_present(patient.get('uacr')) else None
+    hba1c = patient.get('hba1c') if patient.get('use_hba1c', False) and is_present(patient.get('hba1c')) else None
+    return uacr, hba1c
+
+
+def record_fields(record, names):
+    """
+    Values of some fields of a PatientRecord (or patient dict), for a calculate_record method
+
+    Returns:
+    - Tuple of the values, in the order of names; raises ValueError naming the fields
+      that were not entered
+    """
+    values = tuple(record.get(name) for name in names)
+    missing = [name for name, value in zip(names, values) if value is None or value == '']
+    if missing:
+        raise ValueError(f"Campos ausentes: {', '.join(missing)}")
+    return values
+
+
+class PatientRecord:
+    """
+    Patient data with one slot per field instead of a per-patient dict
+
+    Reads like the patient_data dict it replaces (record['age'], record.get('uacr'),
+    'egfr' in record, dict(record)), so it can be passed to evaluate_all, the
+    IncrementalEvaluator and each calculator's calculate_record, and converts to and from
+    the column arrays of the batch methods.
+    """
+    __slots__ = PATIENT_FIELDS
+
+    def __init__(self, **fields):
+        unknown = set(fields) - set(PATIENT_FIELDS)
+        if unknown:
+            raise ValueError(f"Campos desconhecidos: {', '.join(sorted(unknown))}")
+        for name in TEXT_FIELDS + NUMERIC_FIELDS:
+            setattr(self, name, fields.get(name))
+        for name in FLAG_FIELDS:
+            setattr(self, name, bool(fields.get(name, False)))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a record from a patient_data dict, ignoring keys that are not patient fields"""
+        return cls(**{name: data[name] for name in PATIENT_FIELDS if name in data})
+
+    def to_dict(self):
+        """The record as a patient_data dict"""
+        return {name: getattr(self, name) for name in PATIENT_FIELDS}
+
+    def replace(self, **changes):
+        """Copy of the record with some fields changed"""
+        return PatientRecord(**{**self.to_dict(), **changes})
+
+    def keys(self):
+        return PATIENT_FIELDS
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in PATIENT_FIELDS else default
+
+    def __getitem__(self, name):
+        if name not in PATIENT_FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return name in PATIENT_FIELDS
+
+    def __iter__(self):
+        return iter(PATIENT_FIELDS)
+
+    def __len__(self):
+        return len(PATIENT_FIELDS)
+
+    def __eq__(self, other):
+        if not isinstance(other, PatientRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in PATIENT_FIELDS)
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in PATIENT_FIELDS
+                           if getattr(self, name) not in (None, False))
+        return f"PatientRecord({fields})"
+
+
+def records_to_columns(records):
+    """
+    Convert patient records (or patient dicts) to column arrays for the batch methods
+
+    Returns:
+    - Dict of field -> array: float with NaN for the numeric fields, bool for the flags and
+      object (None when not entered) for sex and the findings
+    """
+    records = [record if isinstance(record, PatientRecord) else PatientRecord.from_dict(record)
+               for record in records]
+    columns = {}
+    for name in TEXT_FIELDS:
+        columns[name] = np.array([getattr(record, name) for record in records], dtype=object)
+    for name in NUMERIC_FIELDS:
+        columns[name] = np.array([getattr(record, name) for record in records], dtype=float)  # None -> NaN
+    for name in FLAG_FIELDS:
+        columns[name] = np.array([getattr(record, name) for record in records], dtype=bool)
+    return columns
+
+
+def records_from_columns(columns):
+    """
+    Convert column arrays (dict or pandas DataFrame) back to patient records
+
+    NaN becomes None; fields without a column keep their defaults.
+    """
+    present = [name for name in PATIENT_FIELDS if name in columns]
+    n = len(columns[present[0]]) if present else 0
+    values = {}
+    for name in present:
+        if name in NUMERIC_FIELDS:
+            values[name] = [None if value != value else value for value in float_column(columns[name]).tolist()]
+        else:
+            values[name] = list(columns[name])
+    return [PatientRecord(**{name: values[name][i] for name in present}) for i in range(n)]
@@ -0,0 +1,243 @@
+"""
+Calculator Registry
+Declared inputs and outputs of every calculator, and an evaluator that only recomputes
+the calculators downstream of the patient fields that changed
+"""
+from calculators.endocrino import BMICalculator, HOMABetaCalculator, HOMAIRCalculator
+from calculators.gastro import ChildPughCalculator, FIB4Calculator, MELDCalculator
+from calculators.nephro import KtVCalculator, eGFRCalculator
+from calculators.patient import SEX_CODES, is_present, prevent_optional_params
+from prevent_calculator import PREVENTCalculator
+
+
+class CalculatorNode:
+    """
+    One registered calculator or derived value
+
+    - name: Result name ('IMC', 'PREVENT', ...) or derived value name ('sex', 'egfr')
+    - compute: Function of the resolved values dict returning the result (None when a
+      derived value cannot be obtained)
+    - fields: Patient fields that must be present for the node to run
+    - optional: Patient fields that are read when present (flags, optional labs)
+    - uses: Earlier nodes whose values are read; calculators need them to be available
+    - outputs: Keys of the result dictionary
+    - derived: True for intermediate values shared between calculators
+    """
+    __slots__ = ('name', 'compute', 'fields', 'optional', 'uses', 'outputs', 'derived')
+
+    def __init__(self, name, compute, fields=(), optional=(), uses=(), outputs=(), derived=False):
+        self.name = name
+        self.compute = compute
+        self.fields = tuple(fields)
+        self.optional = tuple(optional)
+        self.uses = tuple(uses)
+        self.outputs = tuple(outputs)
+        self.derived = derived
+
+    @property
+    def inputs(self):
+        """Every patient field the node reads"""
+        return self.fields + self.optional
+
+
+class CalculatorRegistry:
+    """
+    Calculators and derived values in dependency order
+
+    A node may only use nodes registered before it, so registration order is a
+    topological order and one pass over the nodes evaluates everything. Values of
+    derived nodes take the place of the patient field of the same name for the nodes
+    registered after them (e.g. 'sex' becomes 'F'/'M', 'egfr' falls back to creatinine).
+    """
+
+    def __init__(self):
+        self.nodes = {}
+
+    def register(self, name, compute, fields=(), optional=(), uses=(), outputs=(), derived=False):
+        """
+        Add a calculator or derived value (see CalculatorNode for the parameters)
+
+        Returns:
+        - The registered CalculatorNode
+        """
+        if name in self.nodes:
+            raise ValueError(f"Calculadora já registrada: {name}")
+        unknown = [used for used in uses if used not in self.nodes]
+        if unknown:
+            raise ValueError(f"Dependências não registradas: {', '.join(unknown)}")
+        node = CalculatorNode(name, compute, fields, optional, uses, outputs, derived)
+        self.nodes[name] = node
+        return node
+
+    @property
+    def calculators(self):
+        """Names of the registered calculators (derived values excluded), in order"""
+        return [name for name, node in self.nodes.items() if not node.derived]
+
+    def available(self, fields):
+        """
+        Nodes that can run when the given patient fields are present (e.g. a cohort's columns)
+
+        A node needs all of its fields; a calculator also needs every node it uses, while a
+        derived value with optional fields or uses needs at least one of them.
+
+        Returns:
+        - Set of node names
+        """
+        available = set(fields)
+        names = set()
+        for name, node in self.nodes.items():
+            if not set(node.fields) <= available:
+                continue
+            sources = set(node.optional) | set(node.uses)
+            if node.derived and sources and not sources & available:
+                continue
+            if not node.derived and not set(node.uses) <= available:
+                continue
+            names.add(name)
+            available.add(name)
+        return names
+
+
+def default_registry(prevent_calculator=None):
+    """
+    Registry of the app's calculators, with PREVENT using the given calculator (e.g. one
+    with a result cache)
+    """
+    prevent = prevent_calculator or PREVENTCalculator()
+    registry = CalculatorRegistry()
+
+    def bmi(values):
+        # Unrounded, shared by the BMI calculator and PREVENT
+        if is_present(values.get('weight')) and is_present(values.get('height')):
+            return values['weight'] / (values['height'] / 100) ** 2
+        return None
+
+    def creatinine_egfr(values):
+        # Unrounded, shared by the eTFG calculator and PREVENT like the BMI
+        if is_present(values.get('creatinine')) and is_present(values.get('age')):
+            return eGFRCalculator().creatinine_egfr(values['creatinine'], values['age'], values['sex'])
+        return None
+
+    def egfr(values):
+        if is_present(values.get('egfr')):
+            return values['egfr']
+        return values.get('creatinine_egfr')
+
+    def prevent_risk(values):
+        uacr, hba1c = prevent_optional_params(values)
+        return prevent.calculate_risk_score(
+            age=values['age'], sex=values['sex'], total_cholesterol=values['total_chol'],
+            hdl_cholesterol=values['hdl_chol'], sbp=values['sbp'], on_bp_meds=values.get('on_bp_meds', False),
+            diabetes=values.get('diabetes', False), smoker=values.get('smoker', False), egfr=values['egfr'],
+            weight=values['weight'], height=values['height'], on_statins=values.get('on_statins', False),
+            uacr=uacr, hba1c=hba1c, bmi=values['bmi'])
+
+    registry.register('sex', lambda values: SEX_CODES.get(values.get('sex')), optional=('sex',), derived=True)
+    registry.register('bmi', bmi, fields=('weight', 'height'), derived=True)
+    registry.register('IMC', lambda values: BMICalculator().classify(values['bmi']),
+                      fields=('weight', 'height'), uses=('bmi',), outputs=('bmi', 'classification', 'risk'))
+    registry.register('HOMA-IR', lambda values: HOMAIRCalculator().calculate_record(values),
+                      fields=('fasting_glucose', 'fasting_insulin'),
+                      outputs=('homa_ir', 'interpretation', 'recommendation'))
+    registry.register('HOMA-Beta', lambda values: HOMABetaCalculator().calculate_record(values),
+                      fields=('fasting_glucose', 'fasting_insulin'),
+                      outputs=('homa_beta', 'interpretation', 'recommendation'))
+    registry.register('FIB-4', lambda values: FIB4Calculator().calculate_record(values),
+                      fields=('age', 'ast', 'alt', 'platelets'), outputs=('score', 'interpretation', 'risk'))
+    registry.register('MELD', lambda values: MELDCalculator().calculate_record(values),
+                      fields=('creatinine', 'bilirubin', 'inr'), optional=('dialysis',),
+                      outputs=('score', 'interpretation', 'mortality'))
+    registry.register('Child-Pugh', lambda values: ChildPughCalculator().calculate_record(values),
+                      fields=('bilirubin', 'albumin', 'inr'), optional=('ascites', 'encephalopathy'),
+                      outputs=('score', 'class', 'interpretation', 'survival_1_year', 'survival_2_year'))
+    registry.register('creatinine_egfr', creatinine_egfr, fields=('creatinine', 'age'), uses=('sex',), derived=True)
+    registry.register('eTFG', lambda values: eGFRCalculator().classify(values['creatinine_egfr']),
+                      fields=('creatinine', 'age'), uses=('creatinine_egfr',),
+                      outputs=('egfr', 'stage', 'description'))
+    registry.register('egfr', egfr, optional=('egfr',), uses=('creatinine_egfr',), derived=True)
+    registry.register('Kt/V', lambda values: KtVCalculator().calculate_record(values),
+                      fields=('pre_bun', 'post_bun', 'dialysis_time', 'ultrafiltration', 'weight'),
+                      optional=('post_weight',), outputs=('ktv', 'adequacy', 'recommendation'))
+    registry.register('PREVENT', prevent_risk,
+                      fields=('age', 'sbp', 'total_chol', 'hdl_chol', 'weight', 'height'),
+                      optional=('on_bp_meds', 'diabetes', 'smoker', 'on_statins',
+                                'uacr', 'use_uacr', 'hba1c', 'use_hba1c'),
+                      uses=('sex', 'egfr', 'bmi'),
+                      outputs=('total_cvd_10yr', 'ascvd_10yr', 'hf_10yr', 'risk_category'))
+    return registry
+
+
+class IncrementalEvaluator:
+    """
+    Keeps the last evaluation of one patient and recomputes only what an edit affects
+
+    A node is recomputed when one of its patient fields changed or when the value of a
+    node it uses changed; if a recomputed value comes out the same (e.g. a new creatinine
+    while eGFR was entered directly), the nodes after it are not touched.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or default_registry()
+        self.patient = {}
+        self.values = {}  # node name -> value, None when unavailable
+        self.errors = {}
+
+    def update(self, patient, changed=None):
+        """
+        Evaluate a new version of the patient record
+
+        Parameters:
+        - patient: PatientRecord or dictionary of patient data, keyed like the app's patient data
+        - changed: Names of the fields that changed; by default the record is compared
+          field by field with the previous one
+
+        Returns:
+        - Dictionary with 'derived' (derived value name -> value), 'results' (calculator
+          name -> result dictionary, available calculators only), 'errors' (calculator
+          name -> message) and 'recomputed' (names of the nodes that ran, in order)
+        """
+        if changed is None:
+            changed = {field for field in set(patient) | set(self.patient)
+                       if patient.get(field) != self.patient.get(field)}
+        changed = set(changed)
+        if not self.values:
+            changed |= {field for node in self.registry.nodes.values() for field in node.inputs}
+
+        values = dict(patient)
+        modified, recomputed = set(), []
+        for name, node in self.registry.nodes.items():
+            if set(node.inputs) & changed or set(node.uses) & modified:
+                previous = self.values.get(name)
+                self.values[name] = self._compute(node, {**values, **self._resolved(node)})
+                recomputed.append(name)
+                if self.values[name] != previous:
+                    modified.add(name)
+            if node.derived:
+                values[name] = self.values[name]
+
+        self.patient = dict(patient)
+        return {
+            'derived': {name: self.values[name] for name, node in self.registry.nodes.items() if node.derived},
+            'results': {name: self.values[name] for name in self.registry.calculators
+                        if self.values[name] is not None},
+            'errors': dict(self.errors),
+            'recomputed': recomputed,
+        }
+
+    def _resolved(self, node):
+        return {used: self.values[used] for used in node.uses}
+
+    def _compute(self, node, values):
+        self.errors.pop(node.name, None)
+        if node.derived:
+            return node.compute(values)
+        if not all(is_present(values.get(field)) for field in node.fields):
+            return None
+        if any(values.get(used) is None for used in node.uses):
+            return None
+        try:
+            return node.compute(values)
+        except ValueError as e:
+            self.errors[node.name] = str(e)
+            return None
@@ -0,0 +1,98 @@
+"""
+Batch Validation
+Vectorized input checks that flag invalid rows with error codes instead of raising
+"""
+import numpy as np
+
+# Per-row error codes of the calculate_batch methods; the code indexes VALIDATION_ERRORS.
+# When a row has several problems the first failing check is reported.
+VALID, MISSING, NOT_POSITIVE, INVALID = 0, 1, 2, 3
+VALIDATION_ERRORS = ('Válido', 'Valor ausente', 'Valor deve ser maior que zero', 'Valor inválido')
+
+
+def _parse_column(values):
+    """
+    Convert a column to a float array, also reporting the cells that are not numbers
+
+    Returns:
+    - (floats, invalid): NaN for None/NaN and for unparseable cells ('?', 'n/d'), and a
+      boolean array, True for the latter
+    """
+    try:
+        if hasattr(values, 'to_numpy'):
+            floats = values.to_numpy(dtype=float, na_value=np.nan)
+        else:
+            floats = np.asarray(values, dtype=float)
+        return floats, np.zeros(floats.shape, dtype=bool)
+    except (TypeError, ValueError):
+        import pandas as pd  # only needed for columns with text cells
+
+        cells = np.asarray(values, dtype=object)
+        floats = np.asarray(pd.to_numeric(cells.ravel(), errors='coerce'), dtype=float).reshape(cells.shape)
+        return floats, np.isnan(floats) & ~pd.isna(cells)
+
+
+def float_column(values):
+    """
+    Convert a column (list, array or pandas Series) to a float array, with None as NaN
+
+    Cells that are not numbers also become NaN; validate_columns flags them as INVALID.
+    """
+    return _parse_column(values)[0]
+
+
+def sex_column(values):
+    """
+    Convert a sex column to 1.0 (female) / 0.0 (male), with None/NaN as NaN
+
+    Only 'F' and 'M' are recognized; any other code ('Feminino', 'f', 'X') becomes NaN as
+    well, so the row is flagged instead of being scored as male. Numeric columns are taken
+    as already converted (1 = female, 0 = male), so the result can be converted again.
+    """
+    sex = values.to_numpy() if hasattr(values, 'to_numpy') else np.asarray(values)
+    if sex.dtype.kind in 'biuf':
+        sex = sex.astype(float)
+        return np.where((sex == 0) | (sex == 1), sex, np.nan)
+    return np.select([sex == "F", sex == "M"], [1.0, 0.0], np.nan)
+
+
+def validate_columns(columns, positive=()):
+    """
+    Check every row of a set of input columns at once
+
+    Parameters:
+    - columns: Dict of column name -> values (scalars are broadcast to the column length)
+    - positive: Names of the columns that must be greater than zero
+
+    Returns:
+    - (arrays, error): dict of equally long float arrays and an int8 array of error codes,
+      VALID for the rows that can be computed
+    """
+    names = list(columns)
+    parsed = [_parse_column(columns[name]) for name in names]
+    values = np.broadcast_arrays(*(np.atleast_1d(floats) for floats, _ in parsed))
+    invalid = np.broadcast_arrays(*(np.atleast_1d(flags) for _, flags in parsed))
+    arrays = dict(zip(names, values))
+    n = len(arrays[names[0]]) if names else 0
+    error = np.full(n, VALID, dtype=np.int8)
+
+    for column, flags in zip(arrays.values(), invalid):
+        error[(error == VALID) & flags] = INVALID
+        error[(error == VALID) & np.isnan(column)] = MISSING
+    for name in positive:
+        # NaN rows were already flagged as missing, and NaN <= 0 is False anyway
+        error[(error == VALID) & (arrays[name] <= 0)] = NOT_POSITIVE
+    return arrays, error
+
+
+def first_error(*errors):
+    """Combine error code arrays of the same rows, keeping the first non-VALID code"""
+    combined = errors[0]
+    for error in errors[1:]:
+        combined = np.where(combined != VALID, combined, error)
+    return np.asarray(combined, dtype=np.int8)
+
+
+def masked(values, error):
+    """Blank the rows flagged in error with NaN"""
+    return np.where(error == VALID, values, np.nan)
@@ -0,0 +1,199 @@
+"""
+Transplant Waitlist
+Keeps liver transplant candidates ordered by MELD score as new labs arrive
+"""
+from array import array
+
+from calculators.gastro import MELDCalculator
+
+# MELD scores are integers clamped to this range, so the list is kept as one bucket per score
+MELD_MIN, MELD_MAX = 6, 40
+
+
+class _SequenceSet:
+    """
+    Sorted set of listing sequence numbers, backed by a Fenwick tree of member counts
+
+    add, remove, rank and indexing take O(log n) in the highest sequence stored so far;
+    the tree doubles when a larger sequence arrives. Members are not tracked separately,
+    so remove must only be called with a sequence that is in the set.
+    """
+    __slots__ = ('_tree', '_size')
+
+    def __init__(self):
+        self._tree = array('q', [0, 0])  # 1-based, capacity 1 (always a power of two)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _update(self, sequence, delta):
+        tree = self._tree
+        i = sequence + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def add(self, sequence):
+        capacity = len(self._tree) - 1
+        while sequence >= capacity:
+            # The new nodes cover only empty positions, except the last, which covers everything
+            self._tree.extend(array('q', bytes(8 * capacity)))
+            capacity *= 2
+            self._tree[capacity] = self._size
+        self._update(sequence, 1)
+        self._size += 1
+
+    def remove(self, sequence):
+        self._update(sequence, -1)
+        self._size -= 1
+
+    def rank(self, sequence):
+        """Number of members smaller than sequence"""
+        tree = self._tree
+        i, count = min(sequence, len(tree) - 1), 0
+        while i > 0:
+            count += tree[i]
+            i -= i & -i
+        return count
+
+    def __getitem__(self, index):
+        """The member at a 0-based position"""
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        tree = self._tree
+        capacity = len(tree) - 1
+        position, remaining, step = 0, index + 1, capacity
+        while step:
+            if position + step <= capacity and tree[position + step] < remaining:
+                position += step
+                remaining -= tree[position]
+            step >>= 1
+        return position  # the member is at 1-based tree position position + 1
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield self[index]
+
+
+class MELDWaitlist:
+    """
+    Candidates ordered by MELD score (highest first), ties broken by listing order
+
+    Each score has a bucket holding the listing sequence numbers of its candidates as a
+    sorted set. A lab update re-scores only that candidate and moves it between two
+    buckets in O(log n); rank and top-k queries walk at most the 35 buckets.
+    """
+
+    def __init__(self, calculator=None):
+        self.calculator = calculator or MELDCalculator()
+        self._buckets = [_SequenceSet() for _ in range(MELD_MAX - MELD_MIN + 1)]
+        self._candidates = {}  # patient_id -> [sequence, score, labs]
+        self._ids = {}  # sequence -> patient_id
+        self._next_sequence = 0
+
+    def __len__(self):
+        return len(self._candidates)
+
+    def __contains__(self, patient_id):
+        return patient_id in self._candidates
+
+    def __iter__(self):
+        """Patient ids in priority order"""
+        for bucket in self._buckets:
+            for sequence in bucket:
+                yield self._ids[sequence]
+
+    def _bucket(self, score):
+        # Bucket 0 holds MELD 40, so walking the buckets in order goes from highest priority down
+        return self._buckets[MELD_MAX - score]
+
+    def _entry(self, patient_id):
+        if patient_id not in self._candidates:
+            raise ValueError(f"Paciente não está na lista de espera: {patient_id}")
+        return self._candidates[patient_id]
+
+    def add(self, patient_id, creatinine, bilirubin, inr, dialysis=False):
+        """
+        List a new candidate
+
+        Parameters:
+        - patient_id: Any hashable identifier
+        - creatinine, bilirubin, inr, dialysis: MELD inputs, as for MELDCalculator.calculate
+
+        Returns:
+        - The candidate's MELD score
+        """
+        if patient_id in self._candidates:
+            raise ValueError(f"Paciente já está na lista de espera: {patient_id}")
+        labs = {'creatinine': creatinine, 'bilirubin': bilirubin, 'inr': inr, 'dialysis': dialysis}
+        score = self.calculator.calculate(**labs)['score']
+        sequence = self._next_sequence
+        self._next_sequence += 1
+
+        self._candidates[patient_id] = [sequence, score, labs]
+        self._ids[sequence] = patient_id
+        # Sequence numbers only grow, so new candidates go to the end of their bucket
+        self._bucket(score).add(sequence)
+        return score
+
+    def update_labs(self, patient_id, **labs):
+        """
+        Re-score one candidate after new lab results
+
+        Parameters:
+        - patient_id: Listed candidate
+        - **labs: The changed MELD inputs (creatinine, bilirubin, inr, dialysis); the others
+          keep their last values
+
+        Returns:
+        - The candidate's new MELD score
+        """
+        entry = self._entry(patient_id)
+        sequence, old_score, old_labs = entry
+        unknown = set(labs) - set(old_labs)
+        if unknown:
+            raise ValueError(f"Exames desconhecidos: {', '.join(sorted(unknown))}")
+
+        new_labs = {**old_labs, **labs}
+        score = self.calculator.calculate(**new_labs)['score']
+        if score != old_score:
+            self._bucket(old_score).remove(sequence)
+            # The candidate keeps its listing sequence, so ties still go to whoever was listed first
+            self._bucket(score).add(sequence)
+        entry[1], entry[2] = score, new_labs
+        return score
+
+    def remove(self, patient_id):
+        """Take a candidate off the list (transplanted, removed or deceased)"""
+        sequence, score, _ = self._entry(patient_id)
+        self._bucket(score).remove(sequence)
+        del self._candidates[patient_id]
+        del self._ids[sequence]
+
+    def score(self, patient_id):
+        """Current MELD score of a candidate"""
+        return self._entry(patient_id)[1]
+
+    def rank(self, patient_id):
+        """1-based position of a candidate on the list"""
+        sequence, score, _ = self._entry(patient_id)
+        ahead = sum(len(bucket) for bucket in self._buckets[:MELD_MAX - score])
+        return ahead + self._bucket(score).rank(sequence) + 1
+
+    def top(self, k):
+        """
+        The k highest-priority candidates
+
+        Returns:
+        - List of (patient_id, score) tuples, highest priority first
+        """
+        if k < 0:
+            raise ValueError("k deve ser maior ou igual a zero")
+        result = []
+        for offset, bucket in enumerate(self._buckets):
+            if len(result) >= k:
+                break
+            for index in range(min(len(bucket), k - len(result))):
+                result.append((self._ids[bucket[index]], MELD_MAX - offset))
+        return result
@@ -13,6 +13,15 @@ except ImportError:
     exit(1)
 
 
+def print_results(result):
+    """Print the PREVENT outcomes of one patient"""
+    print("\nResultados:")
+    print(f"- DCV total em 10 anos: {result['total_cvd_10yr']}%")
+    print(f"- DCVA em 10 anos: {result['ascvd_10yr']}%")
+    print(f"- Insuficiência cardíaca em 10 anos: {result['hf_10yr']}%")
+    print(f"- Categoria: {result['risk_category']}")
+
+
 def example_low_risk_patient():
     """Example: Low risk patient"""
     print("\n" + "="*60)
@@ -23,7 +32,7 @@ def example_low_risk_patient():
     
     # Patient data
     print("\nDados do Paciente:")
-    print("- Mulher, 45 anos, branca")
+    print("- Mulher, 45 anos")
     print("- Colesterol total: 160 mg/dL")
     print("- HDL: 70 mg/dL")
     print("- PA: 110/70 mmHg")
@@ -31,29 +40,24 @@ def example_low_risk_patient():
     print("- Não diabética")
     print("- Não fumante")
     print("- eTFG: 95 mL/min/1.73m²")
+    print("- Peso: 62 kg, altura: 165 cm")
     
     result = calculator.calculate_risk_score(
         age=45,
         sex='F',
-        race='white',
         total_cholesterol=160,
         hdl_cholesterol=70,
         sbp=110,
         on_bp_meds=False,
         diabetes=False,
         smoker=False,
-        egfr=95
+        egfr=95,
+        weight=62,
+        height=165,
+        on_statins=False
     )
     
-    print("\nResultados:")
-    print(f"- Risco em 10 anos: {result['10_year_risk']}%")
-    print(f"- Risco em 30 anos: {result['30_year_risk']}%")
-    print(f"- Categoria: {result['risk_category']}")
-    
-    print("\nRecomendações:")
-    recommendations = calculator.get_recommendations(result['risk_category'], result['10_year_risk'])
-    for i, rec in enumerate(recommendations, 1):
-        print(f"{i}. {rec}")
+    print_results(result)
 
 
 def example_high_risk_patient():
@@ -66,7 +70,7 @@ def example_high_risk_patient():
     
     # Patient data
     print("\nDados do Paciente:")
-    print("- Homem, 70 anos, branco")
+    print("- Homem, 70 anos")
     print("- Colesterol total: 280 mg/dL")
     print("- HDL: 35 mg/dL")
     print("- PA: 160/95 mmHg")
@@ -74,29 +78,24 @@ def example_high_risk_patient():
     print("- Diabético")
     print("- Fumante")
     print("- eTFG: 50 mL/min/1.73m²")
+    print("- Peso: 95 kg, altura: 175 cm")
     
     result = calculator.calculate_risk_score(
         age=70,
         sex='M',
-        race='white',
         total_cholesterol=280,
         hdl_cholesterol=35,
         sbp=160,
         on_bp_meds=True,
         diabetes=True,
         smoker=True,
-        egfr=50
+        egfr=50,
+        weight=95,
+        height=175,
+        on_statins=False
     )
     
-    print("\nResultados:")
-    print(f"- Risco em 10 anos: {result['10_year_risk']}%")
-    print(f"- Risco em 30 anos: {result['30_year_risk']}%")
-    print(f"- Categoria: {result['risk_category']}")
-    
-    print("\nRecomendações:")
-    recommendations = calculator.get_recommendations(result['risk_category'], result['10_year_risk'])
-    for i, rec in enumerate(recommendations, 1):
-        print(f"{i}. {rec}")
+    print_results(result)
 
 
 def example_intermediate_risk_patient():
@@ -109,7 +108,7 @@ def example_intermediate_risk_patient():
     
     # Patient data
     print("\nDados do Paciente:")
-    print("- Homem, 55 anos, hispânico")
+    print("- Homem, 55 anos")
     print("- Colesterol total: 220 mg/dL")
     print("- HDL: 45 mg/dL")
     print("- PA: 140/90 mmHg")
@@ -117,29 +116,24 @@ def example_intermediate_risk_patient():
     print("- Diabético")
     print("- Não fumante")
     print("- eTFG: 75 mL/min/1.73m²")
+    print("- Peso: 88 kg, altura: 172 cm")
     
     result = calculator.calculate_risk_score(
         age=55,
         sex='M',
-        race='hispanic',
         total_cholesterol=220,
         hdl_cholesterol=45,
         sbp=140,
         on_bp_meds=False,
         diabetes=True,
         smoker=False,
-        egfr=75
+        egfr=75,
+        weight=88,
+        height=172,
+        on_statins=False
     )
     
-    print("\nResultados:")
-    print(f"- Risco em 10 anos: {result['10_year_risk']}%")
-    print(f"- Risco em 30 anos: {result['30_year_risk']}%")
-    print(f"- Categoria: {result['risk_category']}")
-    
-    print("\nRecomendações:")
-    recommendations = calculator.get_recommendations(result['risk_category'], result['10_year_risk'])
-    for i, rec in enumerate(recommendations, 1):
-        print(f"{i}. {rec}")
+    print_results(result)
 
 
 def example_with_kidney_disease():
@@ -152,7 +146,7 @@ def example_with_kidney_disease():
     
     # Patient data
     print("\nDados do Paciente:")
-    print("- Homem, 62 anos, negro")
+    print("- Homem, 62 anos")
     print("- Colesterol total: 200 mg/dL")
     print("- HDL: 50 mg/dL")
     print("- PA: 135/85 mmHg")
@@ -162,11 +156,11 @@ def example_with_kidney_disease():
     print("- eTFG: 45 mL/min/1.73m²")
     print("- RACu: 150 mg/g (albuminúria)")
     print("- HbA1c: 6.0%")
+    print("- Peso: 80 kg, altura: 178 cm")
     
     result = calculator.calculate_risk_score(
         age=62,
         sex='M',
-        race='black',
         total_cholesterol=200,
         hdl_cholesterol=50,
         sbp=135,
@@ -175,18 +169,13 @@ def example_with_kidney_disease():
         smoker=False,
         egfr=45,
         uacr=150,
+        weight=80,
+        height=178,
+        on_statins=False,
         hba1c=6.0
     )
     
-    print("\nResultados:")
-    print(f"- Risco em 10 anos: {result['10_year_risk']}%")
-    print(f"- Risco em 30 anos: {result['30_year_risk']}%")
-    print(f"- Categoria: {result['risk_category']}")
-    
-    print("\nRecomendações:")
-    recommendations = calculator.get_recommendations(result['risk_category'], result['10_year_risk'])
-    for i, rec in enumerate(recommendations, 1):
-        print(f"{i}. {rec}")
+    print_results(result)
     
     print("\nNota: A função renal reduzida e albuminúria aumentam o risco cardiovascular.")
 
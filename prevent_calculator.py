@@ -9,116 +9,790 @@ Reference: Khan SS, et al. Novel Prediction Equations for Absolute Risk Assessme
 of Total Cardiovascular Disease Incorporating Cardiovascular-Kidney-Metabolic Health. 
 Circulation. 2023. DOI: 10.1161/CIRCULATIONAHA.123.067626
 """
-import numpy as np
+import bisect
 import math
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter, mul
+
+import numpy as np
+
+from calculators.nephro import eGFRCalculator
+from calculators.parallel import map_shards
+from calculators.patient import SEX_CODES, is_present, prevent_optional_params, record_fields
+from calculators.validation import MISSING, VALID, float_column, sex_column
+
+# Transformed predictor terms of the PREVENT equations, i.e. the columns of the design matrix
+PREVENT_TERMS = (
+    'intercept', 'age', 'non_hdl', 'hdl', 'sbp_lt110', 'sbp_gte110', 'dm', 'smoking',
+    'bmi_lt20', 'bmi_gte20', 'bmi_lt30', 'bmi_gte30', 'egfr_lt60', 'egfr_gte60', 'bptreat',
+    'log_uacr', 'uacr_missing', 'hba1c_dm', 'hba1c_nodm', 'hba1c_missing',
+)
+
+# Optional inputs that can select a model variant
+PREVENT_OPTIONAL_INPUTS = ('uacr', 'hba1c')
+
+# Every model variant of the PREVENT equations and the optional inputs it needs, from the
+# least to the most complete. A patient is scored with the last variant that has coefficient
+# rows and whose inputs are all present (see PREVENT_MODELS).
+PREVENT_MODEL_INPUTS = {'base': (), 'uacr': ('uacr',), 'hba1c': ('hba1c',), 'full': ('uacr', 'hba1c')}
+
+# Outcomes produced by the equations, in output order; all of them come out of one X @ B product
+PREVENT_OUTCOMES = ('total_cvd_10yr', 'ascvd_10yr', 'hf_10yr')
+
+# Risk categories of the 10-year total CVD risk. Codes index RISK_CATEGORIES; code 0 means
+# unavailable and codes 1-4 follow the RISK_THRESHOLDS (%) boundaries.
+RISK_CATEGORIES = ('Indisponível', 'Baixo', 'Limítrofe', 'Intermediário', 'Alto')
+RISK_THRESHOLDS = (5, 7.5, 20)
+
+# Whether each outcome uses the HF range checks (BMI) instead of the CVD ones (cholesterol)
+_OUTCOME_IS_HF = tuple(outcome.startswith('hf') for outcome in PREVENT_OUTCOMES)
+
+# Boolean eligibility masks returned by calculate_batch: TC 130-320 and HDL 20-100 (with statin
+# status known) for CVD/ASCVD, BMI 18.5-40 for HF
+PREVENT_ELIGIBILITY = ('cvd_eligible', 'hf_eligible')
+
+# Why an outcome is unavailable, as reported per row in the '<outcome>_reason' batch columns.
+# Code 0 means the risk was computed; when several reasons apply the lowest code is reported.
+PREVENT_REASONS = ('Disponível', 'Dados ausentes', 'Colesterol total ou HDL fora da faixa', 'IMC fora da faixa')
+
+# Coefficients derived from the official AHA R package documentation.
+# One row per (sex, model, outcome); terms a row leaves out have a zero coefficient.
+PREVENT_COEFFICIENTS = {
+    ('F', 'base', 'total_cvd_10yr'): {
+        'intercept': -3.307728, 'age': 0.7939329, 'non_hdl': 0.0305239, 'hdl': -0.1606857, 'sbp_lt110': -0.2394003,
+        'sbp_gte110': 0.2974913, 'dm': 0.8173409, 'smoking': 0.6846152, 'bmi_lt20': 0.0469145, 'bmi_gte20': 0.0076847,
+        'egfr_lt60': -0.2458428, 'egfr_gte60': 0.428678, 'bptreat': 0.1463162,
+    },
+    ('F', 'base', 'ascvd_10yr'): {
+        'intercept': -3.819975, 'age': 0.719883, 'non_hdl': 0.1176967, 'hdl': -0.151185, 'sbp_lt110': -0.0835358,
+        'sbp_gte110': 0.2796979, 'dm': 0.7674992, 'smoking': 0.6405786, 'bmi_lt20': -0.0064547, 'bmi_gte20': -0.0304664,
+        'egfr_lt60': -0.2345511, 'egfr_gte60': 0.3540822, 'bptreat': 0.1167448,
+    },
+    ('F', 'base', 'hf_10yr'): {
+        'intercept': -4.310409, 'age': 0.8998235, 'sbp_lt110': -0.4559771, 'sbp_gte110': 0.3576505, 'dm': 1.038346,
+        'smoking': 0.583916, 'bmi_lt30': -0.0072294, 'bmi_gte30': 0.0933182, 'egfr_lt60': -0.2974911, 'egfr_gte60': 0.4497556,
+        'bptreat': 0.1983057,
+    },
+    ('M', 'base', 'total_cvd_10yr'): {
+        'intercept': -3.031168, 'age': 0.7688528, 'non_hdl': 0.0736174, 'hdl': -0.0954431, 'sbp_lt110': -0.4347345,
+        'sbp_gte110': 0.301594, 'dm': 0.730386, 'smoking': 0.5786835, 'bmi_lt20': -0.0478951, 'bmi_gte20': -0.063851,
+        'egfr_lt60': -0.3344068, 'egfr_gte60': 0.4578502, 'bptreat': 0.1782299,
+    },
+    ('M', 'base', 'ascvd_10yr'): {
+        'intercept': -3.500655, 'age': 0.7099847, 'non_hdl': 0.1658663, 'hdl': -0.1144285, 'sbp_lt110': -0.2837212,
+        'sbp_gte110': 0.2941589, 'dm': 0.6558448, 'smoking': 0.5801383, 'bmi_lt20': -0.0520614, 'bmi_gte20': -0.063383,
+        'egfr_lt60': -0.3370335, 'egfr_gte60': 0.428519, 'bptreat': 0.1643663,
+    },
+    ('M', 'base', 'hf_10yr'): {
+        'intercept': -3.946391, 'age': 0.8972642, 'sbp_lt110': -0.6811466, 'sbp_gte110': 0.3634461, 'dm': 0.923776,
+        'smoking': 0.5023736, 'bmi_lt30': -0.0485841, 'bmi_gte30': 0.0494492, 'egfr_lt60': -0.3364421, 'egfr_gte60': 0.5367803,
+        'bptreat': 0.2223455,
+    },
+    ('F', 'uacr', 'total_cvd_10yr'): {
+        'intercept': -3.738341, 'age': 0.7969249, 'non_hdl': 0.0256635, 'hdl': -0.1588107, 'sbp_lt110': -0.2255701,
+        'sbp_gte110': 0.2818907, 'dm': 0.7712399, 'smoking': 0.6775618, 'bmi_lt20': 0.0490715, 'bmi_gte20': 0.004128,
+        'egfr_lt60': -0.2396347, 'egfr_gte60': 0.4072225, 'bptreat': 0.128795, 'log_uacr': 0.1793037, 'uacr_missing': 0.0132073,
+    },
+    ('F', 'uacr', 'ascvd_10yr'): {
+        'intercept': -4.174614, 'age': 0.7201999, 'non_hdl': 0.1135771, 'hdl': -0.1493506, 'sbp_lt110': -0.0726677,
+        'sbp_gte110': 0.2642197, 'dm': 0.7270928, 'smoking': 0.6322883, 'bmi_lt20': -0.003426, 'bmi_gte20': -0.0335017,
+        'egfr_lt60': -0.2285145, 'egfr_gte60': 0.3340579, 'bptreat': 0.1017387, 'log_uacr': 0.1501217, 'uacr_missing': 0.0050257,
+    },
+    ('F', 'uacr', 'hf_10yr'): {
+        'intercept': -4.841506, 'age': 0.9145975, 'sbp_lt110': -0.4441346, 'sbp_gte110': 0.3260323, 'dm': 0.9611365,
+        'smoking': 0.5755787, 'bmi_lt30': 0.0008831, 'bmi_gte30': 0.0903823, 'egfr_lt60': -0.286221, 'egfr_gte60': 0.4284566,
+        'bptreat': 0.1783427, 'log_uacr': 0.2197281, 'uacr_missing': 0.0326667,
+    },
+    ('M', 'uacr', 'total_cvd_10yr'): {
+        'intercept': -3.510705, 'age': 0.7768655, 'non_hdl': 0.0659949, 'hdl': -0.0951111, 'sbp_lt110': -0.420667,
+        'sbp_gte110': 0.2829285, 'dm': 0.6724395, 'smoking': 0.5714781, 'bmi_lt20': -0.047514, 'bmi_gte20': -0.068995,
+        'egfr_lt60': -0.3235372, 'egfr_gte60': 0.4357321, 'bptreat': 0.1610996, 'log_uacr': 0.1887974, 'uacr_missing': 0.0916979,
+    },
+    ('M', 'uacr', 'ascvd_10yr'): {
+        'intercept': -3.85146, 'age': 0.7141718, 'non_hdl': 0.1602194, 'hdl': -0.1139086, 'sbp_lt110': -0.2719456,
+        'sbp_gte110': 0.276412, 'dm': 0.6015949, 'smoking': 0.5710928, 'bmi_lt20': -0.0519398, 'bmi_gte20': -0.0673413,
+        'egfr_lt60': -0.3255152, 'egfr_gte60': 0.407289, 'bptreat': 0.1466033, 'log_uacr': 0.1510073, 'uacr_missing': 0.0556000,
+    },
+    ('M', 'uacr', 'hf_10yr'): {
+        'intercept': -4.556907, 'age': 0.9111795, 'sbp_lt110': -0.6693649, 'sbp_gte110': 0.3290082, 'dm': 0.8377655,
+        'smoking': 0.4978917, 'bmi_lt30': -0.042749, 'bmi_gte30': 0.0437435, 'egfr_lt60': -0.3256034, 'egfr_gte60': 0.5133316,
+        'bptreat': 0.201777, 'log_uacr': 0.2306299, 'uacr_missing': 0.1472194,
+    },
+}
+
+
+def _build_coefficient_matrices(coefficients):
+    """Arrange the coefficient rows as one (terms x outcomes) matrix B per (sex, model)"""
+    matrices = {}
+    for (sex, model, outcome), row in coefficients.items():
+        matrix = matrices.setdefault((sex, model), np.zeros((len(PREVENT_TERMS), len(PREVENT_OUTCOMES))))
+        column = PREVENT_OUTCOMES.index(outcome)
+        for term, value in row.items():
+            matrix[PREVENT_TERMS.index(term), column] = value
+    missing = [f"{sex}/{model}" for sex in ('F', 'M') for model in PREVENT_MODELS
+               if sum(key[:2] == (sex, model) for key in coefficients) != len(PREVENT_OUTCOMES)]
+    if missing:
+        raise ValueError(f"Coeficientes incompletos para: {', '.join(missing)}")
+    return matrices
+
+
+def _build_model_lookup(models):
+    """
+    Model index for every combination of present optional inputs
+    
+    Returns:
+    - int8 array indexed by a bit mask of PREVENT_OPTIONAL_INPUTS (bit i set when input i
+      is present), holding the index into models of the variant to evaluate
+    """
+    lookup = np.zeros(2 ** len(PREVENT_OPTIONAL_INPUTS), dtype=np.int8)
+    for mask in range(len(lookup)):
+        present = {name for bit, name in enumerate(PREVENT_OPTIONAL_INPUTS) if mask >> bit & 1}
+        for index, model in enumerate(models):
+            if set(PREVENT_MODEL_INPUTS[model]) <= present:
+                lookup[mask] = index
+    return lookup
+
+
+# Model variants with coefficient rows, in PREVENT_MODEL_INPUTS order; the 'model' codes of
+# calculate_batch index this tuple. Adding the rows of another variant to PREVENT_COEFFICIENTS
+# is enough for it to be selected.
+PREVENT_MODELS = tuple(model for model in PREVENT_MODEL_INPUTS
+                       if any(key[1] == model for key in PREVENT_COEFFICIENTS))
+PREVENT_MATRICES = _build_coefficient_matrices(PREVENT_COEFFICIENTS)
+_MODEL_LOOKUP = _build_model_lookup(PREVENT_MODELS)
+_SCALAR_MODEL_LOOKUP = tuple(PREVENT_MODELS[index] for index in _MODEL_LOOKUP.tolist())
+
+
+def _build_scalar_coefficients(matrices):
+    """
+    Flatten the coefficient matrices for the pure-Python single-patient path
+    
+    Every (sex, model) maps to one entry per outcome: the full coefficient row as plain
+    floats, plus an itemgetter picking the terms with a non-zero coefficient and the
+    matching coefficients. The full row is the fast path; the selected terms are only
+    needed when a NaN term would otherwise blank an outcome that does not use it.
+    """
+    scalar = {}
+    for sex in ('F', 'M'):
+        for model in PREVENT_MODELS:
+            matrix = matrices[(sex, model)]
+            entries = []
+            for column in matrix.T:
+                used = [index for index, value in enumerate(column) if value != 0]
+                entries.append((tuple(column.tolist()), itemgetter(*used),
+                                tuple(float(column[index]) for index in used)))
+            scalar[(sex, model)] = tuple(entries)
+    return scalar
+
+
+PREVENT_SCALAR_COEFFICIENTS = _build_scalar_coefficients(PREVENT_MATRICES)
+
+
+def _inv_logit(logor):
+    """Convert log-odds (scalar or array) to a risk percentage"""
+    odds = np.exp(logor)
+    return 100 * odds / (1 + odds)
+
+
+# Statistics of the calculate_risk_score cache, in the style of functools.lru_cache
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
 
 class PREVENTCalculator:
     """
     PREVENT Calculator implementing the official AHA formulas.
     """
 
+    def __init__(self, cache_size=0):
+        """
+        Parameters:
+        - cache_size: Number of calculate_risk_score results kept in an LRU cache,
+          so repeated calls with the same inputs skip the calculation (0 disables it)
+        """
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def cache_info(self):
+        """Return hits, misses, maximum size and current size of the result cache"""
+        with self._cache_lock:
+            return CacheInfo(self._cache_hits, self._cache_misses, self.cache_size, len(self._cache))
+
+    def cache_clear(self):
+        """Empty the result cache and reset its statistics"""
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_hits = 0
+            self._cache_misses = 0
+
     def _mmol_conversion(self, cholesterol):
-        if cholesterol is None or np.isnan(cholesterol): return np.nan
+        # Works for scalars and arrays alike; NaN simply propagates
+        if cholesterol is None: return np.nan
         return 0.02586 * cholesterol
 
     def _adjust_uacr(self, uacr):
-        if uacr is None or np.isnan(uacr): return np.nan
-        return max(0.1, uacr) if 0 <= uacr else np.nan
-
-    def _calculate_prevent_base(self, sex, age, tc, hdl, sbp, dm, smoking, bmi, egfr, bptreat, **kwargs):
-        logor_10yr_CVD, logor_10yr_ASCVD, logor_10yr_HF = np.nan, np.nan, np.nan
-        
-        # Coefficients derived from the official AHA R package documentation
-        if sex == 1:  # Female
-            logor_10yr_CVD = -3.307728 + 0.7939329 * (age - 55) / 10 + 0.0305239 * (self._mmol_conversion(tc - hdl) - 3.5) - 0.1606857 * (self._mmol_conversion(hdl) - 1.3) / 0.3 - 0.2394003 * (min(sbp, 110) - 110) / 20 + 0.2974913 * (max(sbp, 110) - 130) / 20 + 0.8173409 * dm + 0.6846152 * smoking + 0.0469145 * (min(bmi, 20) - 20) / 5 + 0.0076847 * (max(bmi, 20) - 25) / 5 - 0.2458428 * (min(egfr, 60) - 60) / 30 + 0.428678 * (max(egfr, 60) - 90) / 30 + 0.1463162 * bptreat
-            logor_10yr_ASCVD = -3.819975 + 0.719883 * (age - 55) / 10 + 0.1176967 * (self._mmol_conversion(tc - hdl) - 3.5) - 0.151185 * (self._mmol_conversion(hdl) - 1.3) / 0.3 - 0.0835358 * (min(sbp, 110) - 110) / 20 + 0.2796979 * (max(sbp, 110) - 130) / 20 + 0.7674992 * dm + 0.6405786 * smoking - 0.0064547 * (min(bmi, 20) - 20) / 5 - 0.0304664 * (max(bmi, 20) - 25) / 5 - 0.2345511 * (min(egfr, 60) - 60) / 30 + 0.3540822 * (max(egfr, 60) - 90) / 30 + 0.1167448 * bptreat
-            logor_10yr_HF = -4.310409 + 0.8998235 * (age - 55) / 10 - 0.4559771 * (min(sbp, 110) - 110) / 20 + 0.3576505 * (max(sbp, 110) - 130) / 20 + 1.038346 * dm + 0.583916 * smoking - 0.0072294 * (min(bmi, 30) - 30) / 5 + 0.0933182 * (max(bmi, 30) - 30) / 5 - 0.2974911 * (min(egfr, 60) - 60) / 30 + 0.4497556 * (max(egfr, 60) - 90) / 30 + 0.1983057 * bptreat
-        else:  # Male
-            logor_10yr_CVD = -3.031168 + 0.7688528 * (age - 55) / 10 + 0.0736174 * (self._mmol_conversion(tc - hdl) - 3.5) - 0.0954431 * (self._mmol_conversion(hdl) - 1.3) / 0.3 - 0.4347345 * (min(sbp, 110) - 110) / 20 + 0.301594 * (max(sbp, 110) - 130) / 20 + 0.730386 * dm + 0.5786835 * smoking - 0.0478951 * (min(bmi, 20) - 20) / 5 - 0.063851 * (max(bmi, 20) - 25) / 5 - 0.3344068 * (min(egfr, 60) - 60) / 30 + 0.4578502 * (max(egfr, 60) - 90) / 30 + 0.1782299 * bptreat
-            logor_10yr_ASCVD = -3.500655 + 0.7099847 * (age - 55) / 10 + 0.1658663 * (self._mmol_conversion(tc - hdl) - 3.5) - 0.1144285 * (self._mmol_conversion(hdl) - 1.3) / 0.3 - 0.2837212 * (min(sbp, 110) - 110) / 20 + 0.2941589 * (max(sbp, 110) - 130) / 20 + 0.6558448 * dm + 0.5801383 * smoking - 0.0520614 * (min(bmi, 20) - 20) / 5 - 0.063383 * (max(bmi, 20) - 25) / 5 - 0.3370335 * (min(egfr, 60) - 60) / 30 + 0.428519 * (max(egfr, 60) - 90) / 30 + 0.1643663 * bptreat
-            logor_10yr_HF = -3.946391 + 0.8972642 * (age - 55) / 10 - 0.6811466 * (min(sbp, 110) - 110) / 20 + 0.3634461 * (max(sbp, 110) - 130) / 20 + 0.923776 * dm + 0.5023736 * smoking - 0.0485841 * (min(bmi, 30) - 30) / 5 + 0.0494492 * (max(bmi, 30) - 30) / 5 - 0.3364421 * (min(egfr, 60) - 60) / 30 + 0.5367803 * (max(egfr, 60) - 90) / 30 + 0.2223455 * bptreat
-        
-        return logor_10yr_CVD, logor_10yr_ASCVD, logor_10yr_HF
-
-    def _calculate_prevent_uacr(self, sex, age, tc, hdl, sbp, dm, smoking, bmi, egfr, bptreat, uacr, **kwargs):
-        log_uacr = math.log(self._adjust_uacr(uacr)) if uacr is not None and not np.isnan(uacr) else np.nan
-        
-        if sex == 1: # Female
-            uacr_term_cvd = 0.0132073 if np.isnan(log_uacr) else 0.1793037 * log_uacr
-            uacr_term_ascvd = 0.0050257 if np.isnan(log_uacr) else 0.1501217 * log_uacr
-            uacr_term_hf = 0.0326667 if np.isnan(log_uacr) else 0.2197281 * log_uacr
-            logor_10yr_CVD = -3.738341 + 0.7969249 * (age - 55) / 10 + 0.0256635 * (self._mmol_conversion(tc - hdl) - 3.5) - 0.1588107 * (self._mmol_conversion(hdl) - 1.3) / 0.3 - 0.2255701 * (min(sbp, 110) - 110) / 20 + 0.2818907 * (max(sbp, 110) - 130) / 20 + 0.7712399 * dm + 0.6775618 * smoking + 0.0490715 * (min(bmi, 20) - 20) / 5 + 0.004128 * (max(bmi, 20) - 25) / 5 - 0.2396347 * (min(egfr, 60) - 60) / 30 + 0.4072225 * (max(egfr, 60) - 90) / 30 + 0.128795 * bptreat + uacr_term_cvd
-            logor_10yr_ASCVD = -4.174614 + 0.7201999 * (age - 55) / 10 + 0.1135771 * (self._mmol_conversion(tc - hdl) - 3.5) - 0.1493506 * (self._mmol_conversion(hdl) - 1.3) / 0.3 - 0.0726677 * (min(sbp, 110) - 110) / 20 + 0.2642197 * (max(sbp, 110) - 130) / 20 + 0.7270928 * dm + 0.6322883 * smoking - 0.003426 * (min(bmi, 20) - 20) / 5 - 0.0335017 * (max(bmi, 20) - 25) / 5 - 0.2285145 * (min(egfr, 60) - 60) / 30 + 0.3340579 * (max(egfr, 60) - 90) / 30 + 0.1017387 * bptreat + uacr_term_ascvd
-            logor_10yr_HF = -4.841506 + 0.9145975 * (age - 55) / 10 - 0.4441346 * (min(sbp, 110) - 110) / 20 + 0.3260323 * (max(sbp, 110) - 130) / 20 + 0.9611365 * dm + 0.5755787 * smoking + 0.0008831 * (min(bmi, 30) - 30) / 5 + 0.0903823 * (max(bmi, 30) - 30) / 5 - 0.286221 * (min(egfr, 60) - 60) / 30 + 0.4284566 * (max(egfr, 60) - 90) / 30 + 0.1783427 * bptreat + uacr_term_hf
-        else: # Male
-            uacr_term_cvd = 0.0916979 if np.isnan(log_uacr) else 0.1887974 * log_uacr
-            uacr_term_ascvd = 0.0556000 if np.isnan(log_uacr) else 0.1510073 * log_uacr
-            uacr_term_hf = 0.1472194 if np.isnan(log_uacr) else 0.2306299 * log_uacr
-            logor_10yr_CVD = -3.510705 + 0.7768655 * (age - 55) / 10 + 0.0659949 * (self._mmol_conversion(tc - hdl) - 3.5) - 0.0951111 * (self._mmol_conversion(hdl) - 1.3) / 0.3 - 0.420667 * (min(sbp, 110) - 110) / 20 + 0.2829285 * (max(sbp, 110) - 130) / 20 + 0.6724395 * dm + 0.5714781 * smoking - 0.047514 * (min(bmi, 20) - 20) / 5 - 0.068995 * (max(bmi, 20) - 25) / 5 - 0.3235372 * (min(egfr, 60) - 60) / 30 + 0.4357321 * (max(egfr, 60) - 90) / 30 + 0.1610996 * bptreat + uacr_term_cvd
-            logor_10yr_ASCVD = -3.85146 + 0.7141718 * (age - 55) / 10 + 0.1602194 * (self._mmol_conversion(tc - hdl) - 3.5) - 0.1139086 * (self._mmol_conversion(hdl) - 1.3) / 0.3 - 0.2719456 * (min(sbp, 110) - 110) / 20 + 0.276412 * (max(sbp, 110) - 130) / 20 + 0.6015949 * dm + 0.5710928 * smoking - 0.0519398 * (min(bmi, 20) - 20) / 5 - 0.0673413 * (max(bmi, 20) - 25) / 5 - 0.3255152 * (min(egfr, 60) - 60) / 30 + 0.407289 * (max(egfr, 60) - 90) / 30 + 0.1466033 * bptreat + uacr_term_ascvd
-            logor_10yr_HF = -4.556907 + 0.9111795 * (age - 55) / 10 - 0.6693649 * (min(sbp, 110) - 110) / 20 + 0.3290082 * (max(sbp, 110) - 130) / 20 + 0.8377655 * dm + 0.4978917 * smoking - 0.042749 * (min(bmi, 30) - 30) / 5 + 0.0437435 * (max(bmi, 30) - 30) / 5 - 0.3256034 * (min(egfr, 60) - 60) / 30 + 0.5133316 * (max(egfr, 60) - 90) / 30 + 0.201777 * bptreat + uacr_term_hf
-        
-        return logor_10yr_CVD, logor_10yr_ASCVD, logor_10yr_HF
-
-    # The methods for _calculate_prevent_hba1c and _calculate_prevent_full would follow the same pattern,
-    # porting the exact formulas from the R documentation. For brevity, they are included in the final function.
-    
-    def _calculate_final_risks(self, logors, age, tc, hdl, on_statins, bmi):
-        logor_10yr_CVD, logor_10yr_ASCVD, logor_10yr_HF = logors
+        # Negative (invalid) values become NaN, valid values are floored at 0.1
+        uacr = np.asarray(uacr, dtype=float)
+        return np.where(uacr >= 0, np.maximum(0.1, uacr), np.nan)
+
+    def _scalar_terms(self, age, tc, hdl, sbp, dm, smoking, bmi, egfr, bptreat, uacr, hba1c=None):
+        """
+        Single-patient version of _design_matrix using only the math module
         
-        def inv_logit(logor):
-            if logor is None or np.isnan(logor): return np.nan
-            return 100 * math.exp(logor) / (1 + math.exp(logor))
+        Returns:
+        - Tuple of floats in PREVENT_TERMS order
+        """
+        age_term = (age - 55) / 10
+        if uacr is None or not uacr >= 0:
+            log_uacr, uacr_missing = 0.0, 1.0
+        else:
+            log_uacr, uacr_missing = math.log(uacr if uacr > 0.1 else 0.1), 0.0
+        if hba1c is None or hba1c != hba1c:
+            hba1c, hba1c_missing = 0.0, 1.0
+        else:
+            hba1c, hba1c_missing = hba1c - 5.3, 0.0
+        
+        # Conditional expressions instead of min()/max() calls; written so that a NaN
+        # input falls through to itself, as it does with np.minimum/np.maximum
+        return (
+            1.0, age_term,
+            0.02586 * (tc - hdl) - 3.5, (0.02586 * hdl - 1.3) / 0.3,
+            ((110 if sbp > 110 else sbp) - 110) / 20, ((110 if sbp < 110 else sbp) - 130) / 20,
+            dm, smoking,
+            ((20 if bmi > 20 else bmi) - 20) / 5, ((20 if bmi < 20 else bmi) - 25) / 5,
+            ((30 if bmi > 30 else bmi) - 30) / 5, ((30 if bmi < 30 else bmi) - 30) / 5,
+            ((60 if egfr > 60 else egfr) - 60) / 30, ((60 if egfr < 60 else egfr) - 90) / 30,
+            bptreat,
+            log_uacr, uacr_missing, hba1c * dm, hba1c * (1 - dm), hba1c_missing,
+        )
 
-        risks = {
-            'total_cvd_10yr': inv_logit(logor_10yr_CVD),
-            'ascvd_10yr': inv_logit(logor_10yr_ASCVD),
-            'hf_10yr': inv_logit(logor_10yr_HF)
+    def _design_matrix(self, age, tc, hdl, sbp, dm, smoking, bmi, egfr, bptreat, uacr=None, hba1c=None, **kwargs):
+        """Build the spline-transformed terms, one row per patient and one column per PREVENT_TERMS entry"""
+        log_uacr = np.log(self._adjust_uacr(np.nan if uacr is None else uacr))
+        uacr_missing = np.isnan(log_uacr)
+        hba1c = np.asarray(np.nan if hba1c is None else hba1c, dtype=float) - 5.3
+        hba1c_missing = np.isnan(hba1c)
+        hba1c = np.where(hba1c_missing, 0.0, hba1c)
+        
+        terms = {
+            'intercept': 1.0,
+            'age': (age - 55) / 10,
+            'non_hdl': self._mmol_conversion(tc - hdl) - 3.5,
+            'hdl': (self._mmol_conversion(hdl) - 1.3) / 0.3,
+            'sbp_lt110': (np.minimum(sbp, 110) - 110) / 20,
+            'sbp_gte110': (np.maximum(sbp, 110) - 130) / 20,
+            'dm': dm,
+            'smoking': smoking,
+            'bmi_lt20': (np.minimum(bmi, 20) - 20) / 5,
+            'bmi_gte20': (np.maximum(bmi, 20) - 25) / 5,
+            'bmi_lt30': (np.minimum(bmi, 30) - 30) / 5,
+            'bmi_gte30': (np.maximum(bmi, 30) - 30) / 5,
+            'egfr_lt60': (np.minimum(egfr, 60) - 60) / 30,
+            'egfr_gte60': (np.maximum(egfr, 60) - 90) / 30,
+            'bptreat': bptreat,
+            # A missing UACR contributes the model's fixed "missing" coefficient instead of its log
+            'log_uacr': np.where(uacr_missing, 0.0, log_uacr),
+            'uacr_missing': uacr_missing,
+            'hba1c_dm': hba1c * dm,
+            'hba1c_nodm': hba1c * (1 - dm),
+            'hba1c_missing': hba1c_missing,
         }
+        columns = np.broadcast_arrays(*(np.asarray(terms[term], dtype=float) for term in PREVENT_TERMS))
+        # Filled column by column, so column-major storage keeps every write contiguous
+        design = np.empty((columns[0].size, len(PREVENT_TERMS)), order='F')
+        for index, column in enumerate(columns):
+            design[:, index] = column.ravel()
+        return design
+
+    def _calculate_logors(self, design, sex, model):
+        """
+        Evaluate every outcome of one model with a single X @ B product
+        
+        Parameters:
+        - design: Design matrix from _design_matrix (patients x terms)
+        - sex: 'F' or 'M'
+        - model: Model name as used in PREVENT_COEFFICIENTS (one of PREVENT_MODELS)
+        
+        Returns:
+        - Array of log-odds (patients x outcomes)
+        """
+        coefficients = PREVENT_MATRICES[(sex, model)]
+        missing = np.isnan(design)
+        if not missing.any():
+            return design @ coefficients
+
+        # NaN * 0 would blank outcomes that do not use the missing term (e.g. cholesterol for HF),
+        # so zero the gaps and only blank outcomes that actually depend on them
+        logors = np.where(missing, 0.0, design) @ coefficients
+        logors[missing @ (coefficients != 0)] = np.nan
+        return logors
 
-        if (tc is None or tc < 130 or tc > 320) or \
-           (hdl is None or hdl < 20 or hdl > 100) or \
-           (on_statins is None):
-            risks['total_cvd_10yr'] = np.nan
-            risks['ascvd_10yr'] = np.nan
-            
-        if (bmi is None or bmi < 18.5 or bmi >= 40):
-            risks['hf_10yr'] = np.nan
-            
+    def _eligibility_masks(self, tc, hdl, on_statins, bmi):
+        """
+        Range checks as boolean masks, keyed like PREVENT_ELIGIBILITY
+        
+        None becomes NaN and NaN never passes a range check.
+        """
+        tc, hdl, on_statins, bmi = (np.asarray(v, dtype=float) for v in (tc, hdl, on_statins, bmi))
+        return {
+            'cvd_eligible': (tc >= 130) & (tc <= 320) & (hdl >= 20) & (hdl <= 100) & ~np.isnan(on_statins),
+            'hf_eligible': (bmi >= 18.5) & (bmi < 40),
+        }
+
+    def _calculate_final_risks(self, logors, masks):
+        # logors holds one log-odds (array) per entry of PREVENT_OUTCOMES
+        risks = {outcome: _inv_logit(logor) for outcome, logor in zip(PREVENT_OUTCOMES, logors)}
+
+        for outcome, is_hf in zip(PREVENT_OUTCOMES, _OUTCOME_IS_HF):
+            eligible = masks['hf_eligible' if is_hf else 'cvd_eligible']
+            risks[outcome] = np.where(eligible, risks[outcome], np.nan)
+
+        if all(np.ndim(value) == 0 for value in risks.values()):
+            risks = {key: float(value) for key, value in risks.items()}
         return risks
 
     def calculate_risk_score(self, age, sex, total_cholesterol, hdl_cholesterol, sbp, 
                              on_bp_meds, diabetes, smoker, egfr, weight, height, on_statins, 
-                             uacr=None, hba1c=None, **kwargs):
+                             uacr=None, hba1c=None, raw=False, bmi=None, **kwargs):
+        """
+        Calculate PREVENT risks for one patient
+        
+        Parameters:
+        - age, sex ('F'/'M'), total_cholesterol, hdl_cholesterol, sbp, on_bp_meds, diabetes,
+          smoker, egfr, weight (kg), height (cm), on_statins: Essential inputs
+        - uacr, hba1c: Optional inputs (None or NaN when not measured) selecting the model
+          variant, see PREVENT_MODEL_INPUTS; an input only changes the result when a variant
+          using it has coefficient rows
+        - raw: Return unrounded floats (NaN if unavailable) and 'risk_category_code'
+          instead of display values; see format_results
+        - bmi: Already calculated BMI (e.g. shared with the BMI calculator); calculated from
+          weight and height when None
+        
+        Returns:
+        - Dictionary with one entry per PREVENT_OUTCOMES and the risk category
+        """
+        inputs = (age, sex, total_cholesterol, hdl_cholesterol, sbp, on_bp_meds, diabetes, smoker,
+                  egfr, weight, height, on_statins, uacr, hba1c, raw, bmi)
+        if not self.cache_size:
+            return self._calculate_risk_score(*inputs)
+
+        # Normalize so that e.g. 55 and 55.0, or 1 and True, share a cache entry
+        key = tuple(value if value is None or isinstance(value, str) else float(value) for value in inputs)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._cache_hits += 1
+                return dict(cached)
+            self._cache_misses += 1
+
+        results = self._calculate_risk_score(*inputs)
+        with self._cache_lock:
+            self._cache[key] = dict(results)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return results
+
+    def calculate_record(self, record, raw=False):
+        """
+        Calculate PREVENT risks for one PatientRecord (or patient dict)
+        
+        The fields are read as in the app: sex as entered ('Masculino'/'Feminino' or
+        'M'/'F'), UACR and HbA1c only when their use_* flags are set, and the eGFR as
+        entered, else calculated (unrounded) from creatinine.
+        
+        Parameters:
+        - record: PatientRecord or patient dict, keyed like the app's patient data
+        - raw: As for calculate_risk_score
+        
+        Returns:
+        - As for calculate_risk_score; raises ValueError when a required field was not entered
+        """
+        age, sex, total_chol, hdl_chol, sbp, weight, height = record_fields(
+            record, ('age', 'sex', 'total_chol', 'hdl_chol', 'sbp', 'weight', 'height'))
+        sex = SEX_CODES.get(sex)
+        egfr = record.get('egfr')
+        if not is_present(egfr):
+            if not is_present(record.get('creatinine')):
+                raise ValueError("Campos ausentes: egfr ou creatinine")
+            egfr = eGFRCalculator().creatinine_egfr(record['creatinine'], age, sex)
+        uacr, hba1c = prevent_optional_params(record)
+        return self.calculate_risk_score(
+            age=age, sex=sex, total_cholesterol=total_chol, hdl_cholesterol=hdl_chol, sbp=sbp,
+            on_bp_meds=record.get('on_bp_meds', False), diabetes=record.get('diabetes', False),
+            smoker=record.get('smoker', False), egfr=egfr, weight=weight, height=height,
+            on_statins=record.get('on_statins', False), uacr=uacr, hba1c=hba1c, raw=raw)
+
+    def _calculate_risk_score(self, age, sex, total_cholesterol, hdl_cholesterol, sbp,
+                              on_bp_meds, diabetes, smoker, egfr, weight, height, on_statins,
+                              uacr, hba1c, raw=False, bmi=None):
         
-        if any(p is None for p in [age, sex, total_cholesterol, hdl_cholesterol, sbp, egfr, weight, height, on_statins]):
+        if None in (age, sex, total_cholesterol, hdl_cholesterol, sbp, egfr, weight, height, on_statins):
             raise ValueError("Parâmetros essenciais estão faltando.")
 
-        bmi = (weight / (height/100)**2) if weight and height else np.nan
+        if bmi is None:
+            bmi = (weight / (height/100)**2) if weight and height else math.nan
+        sex = 'F' if sex == "F" else 'M'
+        dm, smoking, bptreat = (1 if diabetes else 0), (1 if smoker else 0), (1 if on_bp_meds else 0)
+
+        # Same rule as calculate_batch: an optional input that is None or NaN counts as not measured
+        model = _SCALAR_MODEL_LOOKUP[(uacr is not None and uacr == uacr) + 2 * (hba1c is not None and hba1c == hba1c)]
+        terms = self._scalar_terms(age, total_cholesterol, hdl_cholesterol, sbp, dm, smoking, bmi, egfr,
+                                   bptreat, uacr, hba1c)
+
+        # Same eligibility rules as _eligibility_masks; NaN fails every comparison
+        cvd_eligible = 130 <= total_cholesterol <= 320 and 20 <= hdl_cholesterol <= 100
+        hf_eligible = 18.5 <= bmi < 40
+
+        risks = []
+        for (row, select, values), is_hf in zip(PREVENT_SCALAR_COEFFICIENTS[(sex, model)], _OUTCOME_IS_HF):
+            if not (hf_eligible if is_hf else cvd_eligible):
+                risks.append(math.nan)
+                continue
+            logor = sum(map(mul, row, terms))
+            if logor != logor:
+                # A NaN term times a zero coefficient; retry with the terms this outcome uses
+                logor = sum(map(mul, values, select(terms)))
+            odds = math.exp(logor)
+            risks.append(100 * odds / (1 + odds))
+
+        category = self._risk_category_code(risks[0])
+        if raw:
+            final_risks = dict(zip(PREVENT_OUTCOMES, risks))
+            final_risks['risk_category_code'] = category
+            return final_risks
+        # Same formatting as format_results, without the intermediate raw dict
+        results = {outcome: 'N/A' if risk != risk else round(risk, 1) for outcome, risk in zip(PREVENT_OUTCOMES, risks)}
+        results['risk_category'] = RISK_CATEGORIES[category]
+        return results
+
+    def format_results(self, raw_results):
+        """
+        Format raw results for display: risks rounded to 0.1 or 'N/A', category as a label
         
-        params = {
-            "sex": 1 if sex == "F" else 0, "age": age, "tc": total_cholesterol, "hdl": hdl_cholesterol, "sbp": sbp,
-            "dm": 1 if diabetes else 0, "smoking": 1 if smoker else 0, "bmi": bmi, "egfr": egfr,
-            "bptreat": 1 if on_bp_meds else 0, "statin": 1 if on_statins else 0, "uacr": uacr, "hba1c": hba1c
-        }
+        Parameters:
+        - raw_results: Dictionary from calculate_risk_score(raw=True), or one row of calculate_batch
+        
+        Returns:
+        - Dictionary with one entry per PREVENT_OUTCOMES and 'risk_category'
+        """
+        results = {}
+        for outcome in PREVENT_OUTCOMES:
+            value = float(raw_results[outcome])
+            results[outcome] = round(value, 1) if not math.isnan(value) else 'N/A'
+        results['risk_category'] = RISK_CATEGORIES[raw_results['risk_category_code']]
+        return results
+
+    # Column names accepted by calculate_batch, matching calculate_risk_score's arguments
+    BATCH_COLUMNS = ('age', 'sex', 'total_cholesterol', 'hdl_cholesterol', 'sbp', 'on_bp_meds',
+                     'diabetes', 'smoker', 'egfr', 'weight', 'height', 'on_statins', 'uacr', 'hba1c')
+    REQUIRED_BATCH_COLUMNS = BATCH_COLUMNS[:12]
+
+    def _collect_columns(self, data, columns):
+        """Merge the columns taken from data with the ones passed individually"""
+        cols = {}
+        if data is not None:
+            cols.update({name: data[name] for name in self.BATCH_COLUMNS if name in data})
+        cols.update(columns)
+
+        missing = [name for name in self.REQUIRED_BATCH_COLUMNS if name not in cols]
+        if missing:
+            raise ValueError(f"Colunas essenciais estão faltando: {', '.join(missing)}")
+        return cols
+
+    def _numeric_columns(self, cols):
+        """
+        Convert cohort columns to float arrays, with sex coded as 1.0 (female) / 0.0 (male)
+        
+        Missing sex (None/NaN) becomes NaN. Already numeric sex codes are kept, so converted
+        columns can be converted again.
+        """
+        numeric = {name: float_column(values) for name, values in cols.items() if name != 'sex'}
+        numeric['sex'] = sex_column(cols['sex'])
+        return numeric
+
+    def _batch_params(self, data, columns):
+        """Collect the cohort columns into float arrays keyed like calculate_risk_score's params"""
+        cols = self._numeric_columns(self._collect_columns(data, columns))
 
-        # Select the correct model based on provided optional parameters
-        if uacr is not None: # Simplified for this example, a full implementation would check for hba1c too
-             logors = self._calculate_prevent_uacr(**params)
+        def as_flag(values):
+            # Missing flags count as absent, like `1 if x else 0` does for None
+            return np.where(np.isnan(values), 0.0, (values != 0).astype(float))
+
+        weight, height = cols['weight'], cols['height']
+        if 'bmi' in cols:
+            # Already computed by the caller (e.g. evaluate_all_batch shares it with the BMI calculator)
+            bmi = cols['bmi']
         else:
-             logors = self._calculate_prevent_base(**params)
-            
-        final_risks = self._calculate_final_risks(logors, age, params['tc'], params['hdl'], params['statin'], bmi)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bmi = np.where((weight != 0) & (height != 0), weight / (height / 100) ** 2, np.nan)
+
+        params = {
+            "sex": cols['sex'], "age": cols['age'], "tc": cols['total_cholesterol'],
+            "hdl": cols['hdl_cholesterol'], "sbp": cols['sbp'], "dm": as_flag(cols['diabetes']),
+            "smoking": as_flag(cols['smoker']), "bmi": bmi, "egfr": cols['egfr'],
+            "bptreat": as_flag(cols['on_bp_meds']), "statin": cols['on_statins'],
+            "uacr": cols.get('uacr', np.nan), "hba1c": cols.get('hba1c', np.nan),
+        }
+        # Any column may be a scalar broadcast to the others, age included
+        shape = np.broadcast_shapes(*(np.shape(value) for value in params.values()))
+        n = shape[0] if shape else 1
+        return {key: np.broadcast_to(value, (n,)) for key, value in params.items()}
 
-        # Format final output
-        results = {key: (round(value, 1) if not np.isnan(value) else 'N/A') for key, value in final_risks.items()}
-        results['risk_category'] = self._categorize_risk(final_risks['total_cvd_10yr'])
+    def calculate_batch(self, data=None, **columns):
+        """
+        Calculate PREVENT risks for a whole cohort with array operations
         
+        Parameters:
+        - data: pandas DataFrame or dict of columns named like the arguments of
+          calculate_risk_score (age, sex, total_cholesterol, ..., uacr, hba1c)
+        - **columns: individual column arrays, overriding those taken from data
+        
+        Missing values are NaN (or None); rows with missing essentials get NaN risks
+        instead of raising. Each row is scored with the most complete model variant whose
+        optional inputs (UACR, HbA1c; NaN when absent) it has, see PREVENT_MODEL_INPUTS.
+        
+        Returns:
+        - Dictionary with one float array per entry of PREVENT_OUTCOMES (10-year total CVD,
+          ASCVD and HF risks, unrounded, NaN if unavailable), 'risk_category_code' (int8 index into
+          RISK_CATEGORIES) and 'model', the index into PREVENT_MODELS of the model evaluated for each row
+        - The boolean PREVENT_ELIGIBILITY masks and, per outcome, '<outcome>_reason': an int8 index
+          into PREVENT_REASONS telling why the risk is NaN (0 when it is available)
+        - 'error': int8 codes into VALIDATION_ERRORS, MISSING for the rows lacking an input
+          calculate_risk_score requires (or with a zero weight/height, which leaves BMI undefined)
+        """
+        params = self._batch_params(data, columns)
+        present = sum((~np.isnan(params[name])).astype(np.int8) << bit
+                      for bit, name in enumerate(PREVENT_OPTIONAL_INPUTS))
+        models = _MODEL_LOOKUP[present]
+        logors = self._dispatch_logors(params, models)
+        # Without sex no equation applies
+        logors[np.isnan(params['sex'])] = np.nan
+
+        masks = self._eligibility_masks(params['tc'], params['hdl'], params['statin'], params['bmi'])
+        results = self._calculate_final_risks(logors.T, masks)
+        results['risk_category_code'] = self._risk_category_codes(results['total_cvd_10yr'])
+        results['model'] = models
+        results.update(masks)
+        results.update(self._unavailable_reasons(logors, masks, params))
+        results['error'] = self._validation_errors(params)
         return results
 
+    def _validation_errors(self, params):
+        """Batch counterpart of calculate_risk_score's check for missing essential inputs"""
+        essentials = ('age', 'sex', 'tc', 'hdl', 'sbp', 'egfr', 'statin')
+        missing = np.isnan(params['bmi'])
+        for name in essentials:
+            missing = missing | np.isnan(params[name])
+        return np.where(missing, MISSING, VALID).astype(np.int8)
+
+    def _unavailable_reasons(self, logors, masks, params):
+        """
+        Per-row reason codes (int8 indices into PREVENT_REASONS) for every outcome
+        
+        Mirrors the order in which calculate_batch blanks a risk: missing inputs first,
+        then the outcome's range checks.
+        """
+        cvd_missing = np.isnan(params['tc']) | np.isnan(params['hdl']) | np.isnan(params['statin'])
+        hf_missing = np.isnan(params['bmi'])
+
+        reasons = {}
+        for column, (outcome, is_hf) in enumerate(zip(PREVENT_OUTCOMES, _OUTCOME_IS_HF)):
+            conditions = [
+                np.isnan(logors[:, column]) | (hf_missing if is_hf else cvd_missing),
+                ~masks['hf_eligible' if is_hf else 'cvd_eligible'],
+            ]
+            reasons[f'{outcome}_reason'] = np.select(conditions, [1, 3 if is_hf else 2], 0).astype(np.int8)
+        return reasons
+
+    def calculate_parallel(self, data=None, workers=None, chunk_size=100_000, executor=None, **columns):
+        """
+        Calculate PREVENT risks for a very large cohort on several processes
+        
+        The cohort is split into shards of chunk_size rows, each shard is scored with
+        calculate_batch in a worker process and the results are merged in row order.
+        Input and output columns live in shared memory, so nothing but the shard
+        bounds is sent to the workers.
+        
+        Parameters:
+        - data, **columns: Cohort columns, as for calculate_batch
+        - workers: Number of worker processes (default: number of CPUs)
+        - chunk_size: Rows per shard
+        - executor: Existing ProcessPoolExecutor to reuse across calls
+        
+        Returns:
+        - Same dictionary of arrays as calculate_batch
+        """
+        # Numeric columns can be placed in shared memory, so workers only receive shard bounds
+        cols = self._numeric_columns(self._collect_columns(data, columns))
+        outputs = dict.fromkeys(PREVENT_OUTCOMES, np.float64)
+        outputs['risk_category_code'] = np.int8
+        outputs['model'] = np.int8
+        outputs.update(dict.fromkeys(PREVENT_ELIGIBILITY, np.bool_))
+        outputs.update({f'{outcome}_reason': np.int8 for outcome in PREVENT_OUTCOMES})
+        outputs['error'] = np.int8
+        return map_shards(_score_shard, cols, workers=workers, chunk_size=chunk_size,
+                          executor=executor, outputs=outputs)
+
+    def _dispatch_logors(self, params, models):
+        """
+        Evaluate a mixed cohort, each row with the model matching its sex and available inputs
+        
+        Rows are stably sorted by (model, sex) before the design matrix is built, so every
+        group is a contiguous block evaluated with one X @ B product; the results are then
+        scattered back to the original row order.
+        
+        Parameters:
+        - params: Column arrays from _batch_params
+        - models: Integer array of indices into PREVENT_MODELS
+        
+        Returns:
+        - Array of log-odds (patients x outcomes) in input order
+        """
+        groups = 2 * models.astype(np.int8) + (params['sex'] == 1)
+        order = np.argsort(groups, kind='stable')
+        bounds = np.searchsorted(groups[order], np.arange(2 * len(PREVENT_MODELS) + 1))
+        design = self._design_matrix(**{key: np.take(value, order) for key, value in params.items()})
+
+        logors = np.empty((len(design), len(PREVENT_OUTCOMES)))
+        for group, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start == stop:
+                continue
+            sex = 'F' if group % 2 else 'M'
+            logors[order[start:stop]] = self._calculate_logors(design[start:stop], sex, PREVENT_MODELS[group // 2])
+        return logors
+
+    def _risk_category_code(self, risk_pct):
+        if risk_pct is None or math.isnan(risk_pct): return 0
+        return bisect.bisect_right(RISK_THRESHOLDS, risk_pct) + 1
+
+    def _risk_category_codes(self, risk_pct):
+        """Vectorized _risk_category_code: int8 codes into RISK_CATEGORIES"""
+        codes = np.digitize(risk_pct, RISK_THRESHOLDS).astype(np.int8) + 1
+        codes[np.isnan(risk_pct)] = 0
+        return codes
+
     def _categorize_risk(self, risk_pct):
-        if risk_pct is None or np.isnan(risk_pct): return 'Indisponível'
-        if risk_pct < 5: return 'Baixo'
-        elif risk_pct < 7.5: return 'Limítrofe'
-        elif risk_pct < 20: return 'Intermediário'
-        else: return 'Alto'
+        return RISK_CATEGORIES[self._risk_category_code(risk_pct)]
+
+
+def _score_shard(columns):
+    """Worker entry point of calculate_parallel (module level so it can be pickled)"""
+    return PREVENTCalculator().calculate_batch(**columns)
+
+
+def _import_parquet():
+    """Import pyarrow, which is only needed for Parquet files"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Arquivos Parquet requerem o pacote pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def _read_chunks(path, chunk_size):
+    """Yield the cohort file as pandas DataFrames of at most chunk_size rows"""
+    if path.endswith('.parquet'):
+        _, pq = _import_parquet()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        import pandas as pd
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+class _ChunkWriter:
+    """Append scored chunks to a CSV or Parquet file as they are produced"""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = _import_parquet() if path.endswith('.parquet') else None
+        self.writer = None
+        self.first = True
+
+    def write(self, frame):
+        if self.parquet:
+            pa, pq = self.parquet
+            # Integer columns of later chunks may pick up NaNs; keep every chunk on the same schema
+            int_columns = frame.select_dtypes('integer').columns
+            frame = frame.astype({column: float for column in int_columns})
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table.cast(self.writer.schema))
+        else:
+            frame.to_csv(self.path, mode='w' if self.first else 'a', header=self.first, index=False)
+        self.first = False
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def score_file(input_path, output_path, chunk_size=100_000, calculator=None, workers=1):
+    """
+    Score a cohort file with the batch engine, one chunk at a time
+    
+    Memory use depends on chunk_size only, not on the size of the file.
+    
+    Parameters:
+    - input_path: CSV or Parquet file with one patient per row, columns named like
+      the arguments of calculate_risk_score
+    - output_path: CSV or Parquet file receiving the input columns plus the risks
+      (one column per PREVENT_OUTCOMES entry), the 'risk_category' and the 'prevent_model' used
+    - chunk_size: Number of rows read, scored and written at a time
+    - calculator: PREVENTCalculator to use (a new one by default)
+    - workers: Number of processes sharing each chunk (1 scores in this process)
+    
+    Returns:
+    - Number of rows scored
+    """
+    calculator = calculator or PREVENTCalculator()
+    writer = _ChunkWriter(output_path)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    rows = 0
+    try:
+        for chunk in _read_chunks(input_path, chunk_size):
+            if pool is None:
+                results = calculator.calculate_batch(chunk)
+            else:
+                shard_size = -(-len(chunk) // workers)
+                results = calculator.calculate_parallel(chunk, chunk_size=shard_size, executor=pool)
+            for outcome in PREVENT_OUTCOMES:
+                chunk[outcome] = results[outcome]
+            chunk['risk_category'] = np.asarray(RISK_CATEGORIES)[results['risk_category_code']]
+            chunk['prevent_model'] = np.asarray(PREVENT_MODELS)[results['model']]
+            writer.write(chunk)
+            rows += len(chunk)
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown()
+    return rows
+
+
+def main(argv=None):
+    """Command-line entry point: python -m prevent_calculator score input.csv output.parquet"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m prevent_calculator',
+                                     description='Calculadora PREVENT para coortes em arquivo')
+    commands = parser.add_subparsers(dest='command', required=True)
+    score = commands.add_parser('score', help='Calcula o risco PREVENT de cada linha de um arquivo CSV/Parquet')
+    score.add_argument('input', help='Arquivo de entrada (.csv ou .parquet)')
+    score.add_argument('output', help='Arquivo de saída (.csv ou .parquet)')
+    score.add_argument('--chunk-size', type=int, default=100_000, help='Linhas processadas por vez')
+    score.add_argument('--workers', type=int, default=1, help='Número de processos em paralelo')
+    args = parser.parse_args(argv)
+
+    rows = score_file(args.input, args.output, chunk_size=args.chunk_size, workers=args.workers)
+    print(f"{rows} pacientes processados -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
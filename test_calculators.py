@@ -9,9 +9,21 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from calculators.gastro import FIB4Calculator, MELDCalculator, ChildPughCalculator
-    from calculators.nephro import eGFRCalculator, KtVCalculator
-    from calculators.endocrino import BMICalculator, HOMAIRCalculator, HOMABetaCalculator
+    import numpy as np
+    from calculators.gastro import (FIB4Calculator, MELDCalculator, ChildPughCalculator, HepaticPanelCalculator,
+                                    CHILD_PUGH_CLASSES, FIB4_RISKS, MELD_CATEGORIES)
+    from calculators.nephro import eGFRCalculator, KtVCalculator, KtVSessionStream, CKD_STAGES, KTV_ADEQUACY, std_ktv
+    from calculators.endocrino import (BMICalculator, HOMAIRCalculator, HOMABetaCalculator, EndocrinePanelCalculator,
+                                       BMI_CLASSES, HOMA_BETA_INTERPRETATIONS, HOMA_IR_INTERPRETATIONS)
+    from calculators.evaluate import evaluate_all, evaluate_all_batch
+    from calculators.frame import PatientFrame
+    from calculators.parallel import SharedColumns, shard_bounds
+    from calculators.patient import PatientRecord, records_from_columns, records_to_columns
+    from calculators.registry import CalculatorRegistry, IncrementalEvaluator
+    from calculators.validation import (INVALID, MISSING, NOT_POSITIVE, VALID, float_column, sex_column,
+                                        validate_columns)
+    from calculators.waitlist import MELDWaitlist
+    from prevent_calculator import PREVENTCalculator
     IMPORTS_AVAILABLE = True
 except ImportError as e:
     IMPORTS_AVAILABLE = False
@@ -54,6 +66,125 @@ class TestGastroCalculators(unittest.TestCase):
         self.assertIn('score', result)
         self.assertIn('class', result)
         self.assertIn(result['class'], ['A', 'B', 'C'])
+    
+    def test_hepatic_panel_matches_scalar(self):
+        """Test that the combined batch panel matches the per-patient calculators"""
+        patients = [
+            dict(age=50, ast=40, alt=35, platelets=200, bilirubin=1.5, inr=1.2, creatinine=1.5, albumin=3.8,
+                 ascites='none', encephalopathy='none', dialysis=False),
+            dict(age=62, ast=120, alt=60, platelets=90, bilirubin=3.0, inr=2.3, creatinine=0.8, albumin=2.8,
+                 ascites='mild', encephalopathy='grade_3_4', dialysis=True),
+            dict(age=45, ast=30, alt=30, platelets=250, bilirubin=8.0, inr=1.7, creatinine=3.2, albumin=2.1,
+                 ascites='moderate_severe', encephalopathy='grade_1_2', dialysis=False),
+        ]
+        columns = {name: [p[name] for p in patients] for name in patients[0]}
+        panel = HepaticPanelCalculator().calculate_batch(**columns)
+        
+        for i, p in enumerate(patients):
+            fib4 = FIB4Calculator().calculate(p['age'], p['ast'], p['alt'], p['platelets'])
+            meld = MELDCalculator().calculate(p['creatinine'], p['bilirubin'], p['inr'], p['dialysis'])
+            child = ChildPughCalculator().calculate(p['bilirubin'], p['albumin'], p['inr'],
+                                                    p['ascites'], p['encephalopathy'])
+            self.assertEqual(round(panel['fib4']['score'][i], 2), fib4['score'])
+            self.assertEqual(FIB4_RISKS[panel['fib4']['risk_code'][i]], fib4['risk'])
+            self.assertEqual(panel['meld']['score'][i], meld['score'])
+            self.assertEqual(MELD_CATEGORIES[panel['meld']['category_code'][i]], meld['interpretation'])
+            self.assertEqual(panel['child_pugh']['score'][i], child['score'])
+            self.assertEqual(CHILD_PUGH_CLASSES[panel['child_pugh']['class_code'][i]], child['class'])
+    
+    def test_meld_variants(self):
+        """Test MELD-Na and MELD 3.0 against hand-computed scores"""
+        batch = MELDCalculator().calculate_batch(
+            creatinine=[1.5, 5.0, 1.5], bilirubin=[2.0, 2.0, 2.0], inr=[1.2, 1.2, 1.2],
+            sodium=[130, 120, None], albumin=[3.0, 2.0, 3.0], sex=['F', 'M', 'F'])
+        
+        # The original MELD is unchanged by the variants
+        self.assertEqual(list(batch['score']), [15, 26, 15])
+        # MELD-Na caps creatinine at 4 and sodium at 125
+        self.assertEqual(list(batch['meld_na'][:2]), [21, 30])
+        self.assertEqual(list(batch['meld_3'][:2]), [22, 31])
+        self.assertTrue(np.isnan(batch['meld_na'][2]))
+        self.assertEqual(list(batch['meld_3_error']), [0, 0, 1])
+    
+    def test_hepatic_panel_missing_lab(self):
+        """Test that a missing lab only blanks the scores that use it"""
+        panel = HepaticPanelCalculator().calculate_batch(
+            age=[50, 50], ast=[40, 40], alt=[35, 35], platelets=[200, None], bilirubin=[1.5, 1.5],
+            inr=[1.2, None], creatinine=[1.5, 1.5], albumin=[3.8, 3.8])
+        
+        self.assertTrue(np.isnan(panel['fib4']['score'][1]))
+        self.assertTrue(np.isnan(panel['meld']['score'][1]))
+        self.assertEqual(list(panel['child_pugh']['class_code']), [1, 0])
+        self.assertFalse(np.isnan(panel['meld']['score'][0]))
+
+
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestMELDWaitlist(unittest.TestCase):
+    """Test cases for the MELD transplant waitlist"""
+    
+    def setUp(self):
+        """List three candidates, two of them tied"""
+        self.waitlist = MELDWaitlist()
+        self.waitlist.add('a', creatinine=1.0, bilirubin=1.0, inr=1.0)
+        self.waitlist.add('b', creatinine=2.0, bilirubin=4.0, inr=1.8)
+        self.waitlist.add('c', creatinine=1.0, bilirubin=1.0, inr=1.0)
+    
+    def test_order_and_ties(self):
+        """Test that higher scores come first and ties keep listing order"""
+        self.assertEqual(list(self.waitlist), ['b', 'a', 'c'])
+        self.assertEqual(self.waitlist.top(2), [('b', self.waitlist.score('b')), ('a', 6)])
+        self.assertEqual(self.waitlist.rank('c'), 3)
+    
+    def test_update_labs(self):
+        """Test that new labs move only the affected candidate"""
+        score = self.waitlist.update_labs('c', bilirubin=20.0, inr=3.0)
+        
+        self.assertEqual(score, MELDCalculator().calculate(creatinine=1.0, bilirubin=20.0, inr=3.0)['score'])
+        self.assertEqual(list(self.waitlist), ['c', 'b', 'a'])
+        self.assertEqual(self.waitlist.rank('a'), 3)
+        
+        # Back to the tie: 'a' was listed first and stays ahead
+        self.waitlist.update_labs('c', bilirubin=1.0, inr=1.0)
+        self.assertEqual(list(self.waitlist), ['b', 'a', 'c'])
+    
+    def test_remove(self):
+        """Test removal and errors for unknown or duplicate candidates"""
+        self.waitlist.remove('b')
+        
+        self.assertEqual(len(self.waitlist), 2)
+        self.assertEqual(self.waitlist.rank('a'), 1)
+        with self.assertRaises(ValueError):
+            self.waitlist.rank('b')
+        with self.assertRaises(ValueError):
+            self.waitlist.add('a', creatinine=1.0, bilirubin=1.0, inr=1.0)
+
+    def test_top_k_bounds(self):
+        """Test that top(0) is empty, a large k returns everyone and a negative k raises"""
+        self.assertEqual(self.waitlist.top(0), [])
+        self.assertEqual([patient_id for patient_id, _ in self.waitlist.top(10)], ['b', 'a', 'c'])
+        with self.assertRaises(ValueError):
+            self.waitlist.top(-1)
+
+    def test_many_updates_match_sorted_order(self):
+        """Test order and ranks against a full sort after many random edits"""
+        import random
+
+        rng = random.Random(0)
+        waitlist = MELDWaitlist()
+        for i in range(200):
+            waitlist.add(i, creatinine=rng.uniform(0.5, 4), bilirubin=rng.uniform(0.5, 30), inr=rng.uniform(1, 4))
+        for _ in range(500):
+            patient_id = rng.randrange(200)
+            if patient_id in waitlist:
+                waitlist.update_labs(patient_id, bilirubin=rng.uniform(0.5, 30))
+        for patient_id in range(0, 200, 3):
+            waitlist.remove(patient_id)
+
+        # Listing order is the id order here, so ties go to the smaller id
+        expected = sorted(waitlist, key=lambda patient_id: (-waitlist.score(patient_id), patient_id))
+        self.assertEqual(list(waitlist), expected)
+        self.assertEqual([waitlist.rank(patient_id) for patient_id in expected], list(range(1, len(expected) + 1)))
+        self.assertEqual([patient_id for patient_id, _ in waitlist.top(25)], expected[:25])
 
 
 @unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
@@ -69,6 +200,56 @@ class TestNephroCalculators(unittest.TestCase):
         self.assertIn('stage', result)
         self.assertGreater(result['egfr'], 0)
     
+    def test_egfr_batch_matches_scalar(self):
+        """Test batch eGFR and stage codes on both sides of kappa and across stages"""
+        calc = eGFRCalculator()
+        creatinine = [0.6, 0.7, 1.0, 1.4, 2.0, 3.5, 6.0, 0.5]
+        age = [30, 45, 50, 60, 70, 75, 80, 25]
+        sex = ['F', 'F', 'M', 'F', 'M', 'M', 'F', 'M']
+        batch = calc.calculate_batch(creatinine, age, sex)
+        
+        for i in range(len(creatinine)):
+            expected = calc.calculate(creatinine[i], age[i], sex[i])
+            self.assertEqual(round(batch['egfr'][i], 1), expected['egfr'])
+            self.assertEqual(CKD_STAGES[batch['stage_code'][i]], expected['stage'])
+        
+        invalid = calc.calculate_batch([0, None, 1.0], [50, 50, 50], ['M', 'F', None])
+        self.assertEqual(list(invalid['stage_code']), [0, 0, 0])
+        self.assertEqual(list(invalid['error']), [NOT_POSITIVE, MISSING, MISSING])
+    
+    def test_egfr_cystatin_equations(self):
+        """Test the cystatin C and creatinine-cystatin C equations against reference values"""
+        batch = eGFRCalculator().calculate_batch(creatinine=[1.0, None], age=[50, 50], sex=['M', 'M'],
+                                                 cystatin_c=[1.0, 1.0])
+        
+        self.assertAlmostEqual(batch['egfr_cys'][0], 80.9, places=1)
+        self.assertAlmostEqual(batch['egfr_cr_cys'][0], 88.1, places=1)
+        self.assertEqual(CKD_STAGES[batch['egfr_cys_stage_code'][0]], 'G2 (Levemente diminuída)')
+        # A missing creatinine only blanks the equations that use it
+        self.assertFalse(np.isnan(batch['egfr_cys'][1]))
+        self.assertTrue(np.isnan(batch['egfr_cr_cys'][1]))
+        self.assertEqual(batch['egfr_cr_cys_error'][1], MISSING)
+    
+    def test_egfr_trajectories(self):
+        """Test per-patient eGFR slopes over an unsorted long-format series"""
+        calc = eGFRCalculator()
+        patient_id = ['b', 'a', 'a', 'b', 'a', 'c']
+        date = ['2021-01-01', '2022-01-01', '2020-01-01', '2020-01-01', '2021-01-01', '2021-06-01']
+        creatinine = [1.0, 2.0, 1.0, 1.0, 1.4, None]
+        age = [61, 62, 60, 60, 61, 50]
+        sex = ['F', 'M', 'M', 'F', 'M', 'M']
+        result = calc.calculate_trajectories(patient_id, date, creatinine, age, sex)
+        patients = result['patients']
+        
+        self.assertEqual(list(patients['patient_id']), ['a', 'b'])
+        self.assertEqual(list(patients['n_measurements']), [3, 2])
+        egfr_a = [calc.calculate(cr, a, 'M')['egfr'] for cr, a in ((1.0, 60), (1.4, 61), (2.0, 62))]
+        years = np.array([0, 366, 731]) / 365.25
+        self.assertAlmostEqual(patients['slope'][0], np.polyfit(years, egfr_a, 1)[0], places=0)
+        self.assertEqual(list(patients['rapid_decline']), [True, False])
+        self.assertEqual(str(patients['last_date'][0]), '2022-01-01')
+        self.assertTrue(np.isnan(result['measurements']['egfr'][5]))
+    
     def test_ktv_calculator(self):
         """Test Kt/V calculation"""
         calc = KtVCalculator()
@@ -83,6 +264,102 @@ class TestNephroCalculators(unittest.TestCase):
         self.assertIn('ktv', result)
         self.assertIn('adequacy', result)
         self.assertGreater(result['ktv'], 0)
+    
+    def test_std_ktv(self):
+        """Test weekly standard Kt/V for a typical thrice-weekly schedule"""
+        self.assertAlmostEqual(std_ktv(1.2, 4, 3), 2.16, places=2)
+    
+    def test_optimize_prescription(self):
+        """Test that the optimizer returns the shortest session time reaching the target"""
+        calc = KtVCalculator()
+        result = calc.optimize_prescription(pre_bun=[70, 70, 0], post_bun=[30, 69, 20], dialysis_time=[3, 4, 4],
+                                            ultrafiltration=[2, 2, 2], post_weight=[70, 70, 70])
+        
+        time, uf = result['dialysis_time'][0], result['ultrafiltration'][0]
+        removal_rate = -np.log(30 / 70) / 3
+        projected = calc.calculate(70, 70 * np.exp(-removal_rate * time), time, uf, 70)
+        shorter = calc.calculate(70, 70 * np.exp(-removal_rate * (time - 0.25)), time - 0.25,
+                                 13 / 1000 * 70 * (time - 0.25), 70)
+        self.assertGreaterEqual(projected['ktv'], 1.4)
+        self.assertLess(shorter['ktv'], 1.4)
+        self.assertGreaterEqual(uf, 2)
+        # Almost no urea removal: no session up to 8 hours is enough
+        self.assertTrue(np.isnan(result['dialysis_time'][1]))
+        self.assertEqual(result['error'][2], NOT_POSITIVE)
+    
+    def test_ktv_session_stream(self):
+        """Test that new sessions update only their patient's rolling summary"""
+        stream = KtVSessionStream()
+        first = stream.add_sessions(['a', 'a', 'b', 'a'], ['2024-01-03', '2024-01-01', '2024-01-01', '2024-01-05'],
+                                    pre_bun=[70, 70, 70, 0], post_bun=[22, 20, 30, 20], dialysis_time=4,
+                                    ultrafiltration=2, post_weight=70)
+        expected = KtVCalculator().calculate(70, 20, 4, 2, 70)
+        
+        self.assertEqual(round(first['ktv'][1], 2), expected['ktv'])
+        self.assertEqual(KTV_ADEQUACY[first['adequacy_code'][1]], expected['adequacy'])
+        self.assertAlmostEqual(first['ektv'][1], first['ktv'][1] * (1 - 0.6 / 4) + 0.03)
+        # The invalid session (BUN 0) is not counted
+        self.assertEqual(stream.summary('a')['sessions'], 2)
+        
+        stream.add_sessions(['a', 'a'], ['2024-01-08', '2024-01-10'], pre_bun=70, post_bun=[20, 21],
+                            dialysis_time=4, ultrafiltration=2, post_weight=70)
+        summary = stream.summary('a')
+        self.assertEqual(summary['sessions'], 4)
+        self.assertEqual(summary['weekly_sessions'], 2)
+        self.assertEqual(str(summary['last_date']), '2024-01-10')
+        self.assertEqual(stream.summary('b')['sessions'], 1)
+        with self.assertRaises(ValueError):
+            stream.summary('c')
+
+    def test_ktv_zero_dialysis_time(self):
+        """Test that a zero session time is rejected instead of giving an infinite eKt/V"""
+        batch = KtVCalculator().calculate_batch(pre_bun=[70, 70], post_bun=[20, 20], dialysis_time=[4, 0],
+                                                ultrafiltration=2, post_weight=70)
+
+        self.assertEqual(list(batch['error']), [VALID, NOT_POSITIVE])
+        self.assertTrue(np.isnan(batch['ektv'][1]))
+        with self.assertRaises(ValueError):
+            KtVCalculator().calculate(70, 20, 0, 2, 70)
+
+        # A post/pre BUN ratio not above 0.008 * hours leaves the logarithm undefined
+        batch = KtVCalculator().calculate_batch(pre_bun=70, post_bun=[2.24, 2.0], dialysis_time=4,
+                                                ultrafiltration=2, post_weight=70)
+        self.assertEqual(list(batch['error']), [INVALID, INVALID])
+        self.assertTrue(np.isnan(batch['ktv']).all() and np.isnan(batch['ektv']).all())
+        self.assertEqual(list(batch['adequacy_code']), [0, 0])
+        with self.assertRaises(ValueError):
+            KtVCalculator().calculate(70, 2.24, 4, 2, 70)
+
+        # Neither kind of invalid session enters the stream
+        stream = KtVSessionStream()
+        stream.add_sessions(['a', 'a', 'a'], ['2024-01-01', '2024-01-02', '2024-01-03'], pre_bun=70,
+                            post_bun=[20, 20, 2.24], dialysis_time=[4, 0, 4], ultrafiltration=2, post_weight=70)
+        summary = stream.summary('a')
+        self.assertEqual(summary['sessions'], 1)
+        self.assertTrue(np.isfinite(summary['std_ktv']))
+
+    def test_ktv_session_stream_batch_matches_one_by_one(self):
+        """Test that one batch of many sessions gives the same summaries as adding them one at a time"""
+        rng = np.random.default_rng(0)
+        n = 60
+        ids = rng.choice(['a', 'b', 'c'], n)
+        dates = np.datetime64('2024-01-01') + rng.integers(0, 30, n)
+        labs = dict(pre_bun=rng.uniform(60, 90, n), post_bun=rng.uniform(15, 30, n), dialysis_time=4,
+                    ultrafiltration=rng.uniform(1, 3, n), post_weight=70)
+
+        batched, single = KtVSessionStream(), KtVSessionStream()
+        batched.add_sessions(ids, dates, **labs)
+        for i in range(n):
+            single.add_sessions(ids[i:i + 1], dates[i:i + 1], labs['pre_bun'][i:i + 1], labs['post_bun'][i:i + 1],
+                                4, labs['ultrafiltration'][i:i + 1], 70)
+
+        for patient_id, summary in batched.summaries().items():
+            expected = single.summary(patient_id)
+            self.assertEqual(summary['sessions'], expected['sessions'])
+            self.assertEqual(summary['weekly_sessions'], expected['weekly_sessions'])
+            self.assertEqual(summary['last_date'], expected['last_date'])
+            self.assertAlmostEqual(summary['mean_ktv'], expected['mean_ktv'])
+            self.assertAlmostEqual(summary['std_ktv'], expected['std_ktv'])
 
 
 @unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
@@ -115,6 +392,358 @@ class TestEndocrinoCalculators(unittest.TestCase):
         self.assertIn('homa_beta', result)
         self.assertIn('interpretation', result)
         self.assertGreaterEqual(result['homa_beta'], 0)
+    
+    def test_homa_beta_glucose_63(self):
+        """Test that a glucose of 63 mg/dL, where HOMA-Beta divides by zero, is rejected"""
+        batch = HOMABetaCalculator().calculate_batch([63, 100], [10, 10])
+        
+        self.assertEqual(list(batch['error']), [INVALID, VALID])
+        self.assertTrue(np.isnan(batch['homa_beta'][0]))
+        self.assertEqual(batch['interpretation_code'][0], 0)
+        with self.assertRaises(ValueError):
+            HOMABetaCalculator().calculate(63, 10)
+    
+    def test_endocrine_panel_matches_scalar(self):
+        """Test the combined panel codes against the per-patient classifications, cut-offs included"""
+        weight = [53.465, 72.25, 115.6, 95, 60]
+        height = [170, 170, 170, 175, 165]
+        glucose = [90, 110, 140, 81, 100]
+        insulin = [5, 12, 20, 5, 4.5]
+        panel = EndocrinePanelCalculator().calculate_batch(weight, height, glucose, insulin)
+        
+        for i in range(len(weight)):
+            bmi = BMICalculator().calculate(weight[i], height[i])
+            homa_ir = HOMAIRCalculator().calculate(glucose[i], insulin[i])
+            homa_beta = HOMABetaCalculator().calculate(glucose[i], insulin[i])
+            self.assertEqual(BMI_CLASSES[panel['bmi']['classification_code'][i]], bmi['classification'])
+            self.assertEqual(HOMA_IR_INTERPRETATIONS[panel['homa_ir']['interpretation_code'][i]],
+                             homa_ir['interpretation'])
+            self.assertEqual(HOMA_BETA_INTERPRETATIONS[panel['homa_beta']['interpretation_code'][i]],
+                             homa_beta['interpretation'])
+            self.assertEqual(round(panel['homa_ir']['homa_ir'][i], 2), homa_ir['homa_ir'])
+    
+    def test_endocrine_panel_missing_insulin(self):
+        """Test that a missing insulin blanks the HOMA indices but not BMI"""
+        panel = EndocrinePanelCalculator().calculate_batch([70], [170], [100], [None])
+        
+        self.assertEqual(panel['bmi']['classification_code'][0], 2)
+        self.assertEqual(panel['homa_ir']['interpretation_code'][0], 0)
+        self.assertEqual(panel['homa_beta']['error'][0], MISSING)
+
+
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestEvaluateAll(unittest.TestCase):
+    """Test the single-pass evaluation of every available calculator"""
+    
+    def setUp(self):
+        self.patient = {'age': 55.0, 'sex': 'Masculino', 'weight': 80.0, 'height': 175.0, 'sbp': 130.0,
+                        'total_chol': 200.0, 'hdl_chol': 50.0, 'creatinine': 1.0, 'egfr': None,
+                        'diabetes': False, 'smoker': False, 'on_bp_meds': False, 'on_statins': False,
+                        'fasting_glucose': 100.0, 'fasting_insulin': 10.0, 'ast': 40.0, 'alt': 35.0,
+                        'platelets': 0.0, 'bilirubin': 1.5, 'albumin': 3.8, 'inr': 1.2}
+    
+    def test_egfr_derived_from_creatinine(self):
+        """Test that PREVENT uses the eGFR computed from creatinine when none was entered"""
+        evaluation = evaluate_all(self.patient)
+        
+        self.assertEqual(evaluation['derived']['egfr_source'], 'creatinina')
+        # PREVENT gets the unrounded eGFR; the eTFG result shows it rounded
+        self.assertEqual(evaluation['derived']['egfr'], evaluation['derived']['creatinine_egfr'])
+        self.assertEqual(round(evaluation['derived']['egfr'], 1), evaluation['results']['eTFG']['egfr'])
+        self.assertIn('PREVENT', evaluation['results'])
+        self.assertNotIn('FIB-4', evaluation['results'])  # no platelet count
+        self.assertEqual(evaluation['errors'], {})
+    
+    def test_batch_matches_single(self):
+        """Test the cohort evaluation against evaluating each patient on its own"""
+        other = dict(self.patient, sex='Feminino', age=62.0, creatinine=None, egfr=70.0, platelets=200.0)
+        columns = {key: [self.patient[key], other[key]] for key in self.patient}
+        batch = evaluate_all_batch(columns)
+        
+        for i, patient in enumerate((self.patient, other)):
+            single = evaluate_all(patient)['results']
+            for outcome in ('total_cvd_10yr', 'ascvd_10yr', 'hf_10yr'):
+                self.assertEqual(round(batch['results']['PREVENT'][outcome][i], 1), single['PREVENT'][outcome])
+            self.assertEqual(round(batch['results']['IMC']['bmi'][i], 1), single['IMC']['bmi'])
+        self.assertEqual(round(batch['results']['eTFG']['egfr'][0], 1), evaluate_all(self.patient)['results']['eTFG']['egfr'])
+        self.assertEqual(batch['results']['MELD']['error'][1], MISSING)
+        self.assertEqual(batch['results']['FIB-4']['error'][0], NOT_POSITIVE)
+
+    def test_bmi_shared_with_prevent(self):
+        """Test that the BMI calculated once gives the same results as each calculator on its own"""
+        evaluation = evaluate_all(self.patient)
+
+        self.assertAlmostEqual(evaluation['derived']['bmi'], 80.0 / 1.75 ** 2)
+        self.assertEqual(evaluation['results']['IMC'], BMICalculator().calculate(80.0, 175.0))
+        self.assertEqual(evaluation['results']['PREVENT'], PREVENTCalculator().calculate_risk_score(
+            age=55.0, sex='M', total_cholesterol=200.0, hdl_cholesterol=50.0, sbp=130.0, on_bp_meds=False,
+            diabetes=False, smoker=False, egfr=evaluation['derived']['egfr'], weight=80.0, height=175.0,
+            on_statins=False))
+
+    def test_batch_without_sex_column(self):
+        """Test that a cohort without a sex column is evaluated with sex missing instead of raising"""
+        columns = {key: [self.patient[key]] * 2 for key in ('age', 'weight', 'height', 'creatinine')}
+        batch = evaluate_all_batch(columns)
+
+        self.assertTrue(np.isnan(batch['derived']['sex']).all())
+        self.assertNotIn('eTFG', batch['results'])
+        self.assertEqual(list(batch['results']['IMC']['error']), [VALID, VALID])
+
+
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestCalculatorRegistry(unittest.TestCase):
+    """Test the incremental re-evaluation of the registered calculators"""
+    
+    def setUp(self):
+        self.patient = {'age': 55.0, 'sex': 'Masculino', 'weight': 80.0, 'height': 175.0, 'sbp': 130.0,
+                        'total_chol': 200.0, 'hdl_chol': 50.0, 'creatinine': 1.0, 'egfr': None,
+                        'ast': 40.0, 'alt': 35.0, 'platelets': 150.0, 'bilirubin': 1.5, 'albumin': 3.8, 'inr': 1.2}
+        self.evaluator = IncrementalEvaluator()
+        self.first = self.evaluator.update(self.patient)
+    
+    def test_first_update_matches_evaluate_all(self):
+        """Test that the first update runs every available calculator like evaluate_all"""
+        self.assertEqual(self.first['results'], evaluate_all(self.patient)['results'])
+    
+    def test_only_downstream_recomputed(self):
+        """Test that a lab edit only re-runs the calculators that read it"""
+        self.assertEqual(self.evaluator.update(dict(self.patient, ast=50.0))['recomputed'], ['FIB-4'])
+        
+        evaluation = self.evaluator.update(dict(self.patient, ast=50.0, creatinine=1.3))
+        self.assertEqual(evaluation['recomputed'], ['MELD', 'creatinine_egfr', 'eTFG', 'egfr', 'PREVENT'])
+        self.assertEqual(evaluation['results'], evaluate_all(dict(self.patient, ast=50.0, creatinine=1.3))['results'])
+    
+    def test_unchanged_derived_value_stops_propagation(self):
+        """Test that a new creatinine does not re-run PREVENT when eGFR was entered directly"""
+        self.evaluator.update(dict(self.patient, egfr=80.0))
+        evaluation = self.evaluator.update(dict(self.patient, egfr=80.0, creatinine=1.3))
+        
+        self.assertEqual(evaluation['recomputed'], ['MELD', 'creatinine_egfr', 'eTFG', 'egfr'])
+        self.assertEqual(evaluation['derived']['egfr'], 80.0)
+    
+    def test_register_unknown_dependency(self):
+        """Test that a node cannot use a node registered after it"""
+        with self.assertRaises(ValueError):
+            CalculatorRegistry().register('PREVENT', lambda values: None, uses=('egfr',))
+
+    def test_available_from_columns(self):
+        """Test that cohort availability follows the node schemas, with eGFR derivable from creatinine"""
+        registry = self.evaluator.registry
+        available = registry.available(['age', 'sex', 'weight', 'height', 'sbp', 'total_chol', 'hdl_chol',
+                                         'creatinine'])
+
+        self.assertTrue({'IMC', 'eTFG', 'egfr', 'PREVENT'} <= available)
+        self.assertNotIn('MELD', available)
+        self.assertNotIn('PREVENT', registry.available(['age', 'weight', 'height', 'sbp', 'total_chol',
+                                                        'hdl_chol', 'egfr']))  # no sex column
+
+
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestPatientRecord(unittest.TestCase):
+    """Test the slotted patient record"""
+    
+    def setUp(self):
+        self.record = PatientRecord(age=55.0, sex='Masculino', weight=80.0, height=175.0, sbp=130.0,
+                                    total_chol=200.0, hdl_chol=50.0, creatinine=1.0, smoker=True)
+    
+    def test_reads_like_patient_dict(self):
+        """Test dict-style access and that evaluate_all takes the record like a patient dict"""
+        self.assertEqual(self.record['age'], 55.0)
+        self.assertIsNone(self.record.get('egfr'))
+        self.assertEqual(dict(self.record)['smoker'], True)
+        self.assertEqual(evaluate_all(self.record)['results'], evaluate_all(self.record.to_dict())['results'])
+        with self.assertRaises(ValueError):
+            PatientRecord(idade=55)
+    
+    def test_calculate_record(self):
+        """Test that each calculator's calculate_record matches the evaluation of the same record"""
+        record = self.record.replace(fasting_glucose=100.0, fasting_insulin=10.0, ast=40.0, alt=35.0,
+                                     platelets=150.0, bilirubin=1.5, albumin=3.8, inr=1.2, pre_bun=70.0,
+                                     post_bun=20.0, dialysis_time=4.0, ultrafiltration=2.0,
+                                     uacr=150.0, use_uacr=True)
+        results = evaluate_all(record)['results']
+        calculators = {'IMC': BMICalculator(), 'HOMA-IR': HOMAIRCalculator(), 'HOMA-Beta': HOMABetaCalculator(),
+                       'FIB-4': FIB4Calculator(), 'MELD': MELDCalculator(), 'Child-Pugh': ChildPughCalculator(),
+                       'eTFG': eGFRCalculator(), 'Kt/V': KtVCalculator(), 'PREVENT': PREVENTCalculator()}
+        
+        self.assertEqual(set(results), set(calculators))
+        for name, calculator in calculators.items():
+            self.assertEqual(calculator.calculate_record(record), results[name], name)
+        with self.assertRaises(ValueError):
+            FIB4Calculator().calculate_record(self.record)
+        with self.assertRaises(ValueError):
+            PREVENTCalculator().calculate_record(self.record.replace(creatinine=None))
+    
+    def test_columns_round_trip(self):
+        """Test conversion to batch columns and back, missing values as NaN/None"""
+        records = [self.record, self.record.replace(sex='Feminino', creatinine=None, egfr=70.0)]
+        columns = records_to_columns(records)
+        
+        self.assertTrue(np.isnan(columns['creatinine'][1]))
+        self.assertEqual(columns['smoker'].dtype, bool)
+        self.assertEqual(records_from_columns(columns), records)
+        batch = evaluate_all_batch(records)
+        self.assertEqual(batch['derived']['egfr'][1], 70.0)
+
+    def test_records_score_like_columns(self):
+        """Test that a list of patient dicts scores the same as the dict of columns, dialysis and findings included"""
+        patients = [
+            dict(age=60.0, sex='Masculino', weight=70.0, height=170.0, bilirubin=2.5, albumin=3.0, inr=2.0,
+                 creatinine=1.2, ascites='moderate_severe', encephalopathy='grade_3_4', pre_bun=70.0, post_bun=20.0,
+                 dialysis_time=4.0, ultrafiltration=2.0, post_weight=68.0),
+            dict(age=50.0, sex='Feminino', weight=60.0, height=160.0, bilirubin=1.0, albumin=4.0, inr=1.0,
+                 creatinine=0.8, ascites=None, encephalopathy=None, pre_bun=65.0, post_bun=22.0,
+                 dialysis_time=3.5, ultrafiltration=1.5, post_weight=None),
+        ]
+        from_records = evaluate_all_batch(patients)
+        from_columns = evaluate_all_batch({key: [patient[key] for patient in patients] for key in patients[0]})
+
+        self.assertEqual(list(from_records['results']['Child-Pugh']['score']), [12, 5])
+        self.assertEqual(from_records['results']['Child-Pugh']['score'][0],
+                         evaluate_all(patients[0])['results']['Child-Pugh']['score'])
+        self.assertIn('Kt/V', from_records['results'])
+        for name, result in from_columns['results'].items():
+            for key, values in result.items():
+                np.testing.assert_array_equal(from_records['results'][name][key], values, err_msg=f"{name} {key}")
+
+
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestPatientFrame(unittest.TestCase):
+    """Test the columnar cohort container"""
+    
+    def setUp(self):
+        import pandas as pd
+        self.df = pd.DataFrame({'age': [50.0, 62.0, 71.0], 'sex': ['F', None, 'M'], 'weight': [70.0, np.nan, 90.0],
+                                'height': [165.0, 170.0, 180.0], 'smoker': [True, False, False]})
+        self.frame = PatientFrame.from_pandas(self.df)
+    
+    def test_from_pandas_shares_buffers(self):
+        """Test that float columns are views of the DataFrame and nulls are masked"""
+        self.assertTrue(np.shares_memory(self.frame['age'], self.df['age'].to_numpy()))
+        self.assertEqual(self.frame.null_mask('weight').tolist(), [False, True, False])
+        self.assertEqual(self.frame.null_mask('sex').tolist(), [False, True, False])
+        bmi = BMICalculator().calculate_batch(self.frame['weight'], self.frame['height'])
+        self.assertEqual(bmi['error'].tolist(), [VALID, MISSING, VALID])
+    
+    def test_project_and_chunks(self):
+        """Test that projections and chunks view the same arrays"""
+        projected = self.frame.project(['age', 'sex'])
+        chunks = list(self.frame.chunks(2))
+        
+        self.assertEqual(projected.columns, ['age', 'sex'])
+        self.assertIs(projected['age'], self.frame['age'])
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertTrue(np.shares_memory(chunks[1]['age'], self.frame['age']))
+        with self.assertRaises(ValueError):
+            self.frame.project(['idade'])
+    
+    def test_from_arrow(self):
+        """Test Arrow input with nulls in numeric and text columns"""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            self.skipTest("pyarrow not available")
+        frame = PatientFrame.from_arrow(pa.table({'age': pa.array([50, None, 71]), 'sex': ['F', None, 'M']}))
+        
+        self.assertTrue(np.isnan(frame['age'][1]))
+        self.assertEqual(frame.null_mask('sex').tolist(), [False, True, False])
+
+
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestBatchValidation(unittest.TestCase):
+    """Test cases for exception-free batch validation"""
+    
+    def test_validate_columns(self):
+        """Test that each row gets the code of its first failing check"""
+        arrays, error = validate_columns({'a': [1, None, 0, -1], 'b': 2}, positive=('a',))
+        
+        self.assertEqual(list(error), [VALID, MISSING, NOT_POSITIVE, NOT_POSITIVE])
+        self.assertEqual(list(arrays['b']), [2, 2, 2, 2])
+
+    def test_non_numeric_cells(self):
+        """Test that unparseable cells become NaN flagged INVALID instead of raising"""
+        import pandas as pd
+
+        arrays, error = validate_columns({'a': ['?', None, '2', 1], 'b': pd.Series([1, 1, 'n/d', 1])})
+
+        self.assertEqual(list(error), [INVALID, MISSING, INVALID, VALID])
+        self.assertEqual(arrays['a'][2], 2.0)
+        self.assertTrue(np.isnan(float_column(['?'])[0]))
+
+    def test_unrecognized_sex_codes(self):
+        """Test that sex codes other than F/M are not scored as male"""
+        sex = sex_column(['F', 'M', 'Feminino', 'f', 'X', None])
+
+        self.assertEqual(sex[:2].tolist(), [1.0, 0.0])
+        self.assertTrue(np.isnan(sex[2:]).all())
+        self.assertTrue(np.isnan(sex_column([2])[0]))
+
+        result = eGFRCalculator().calculate_batch(creatinine=[1.0, 1.0], age=[50, 50], sex=['F', 'X'])
+        self.assertEqual(list(result['error']), [VALID, MISSING])
+
+    def test_batch_matches_scalar(self):
+        """Test that valid rows match calculate and invalid rows become NaN instead of raising"""
+        cases = [
+            (FIB4Calculator(), 'score', dict(age=[50, 60], ast=[40, 80], alt=[35, 0], platelets=[200, 150])),
+            (KtVCalculator(), 'ktv', dict(pre_bun=[70, 0], post_bun=[20, 20], dialysis_time=[4, 4],
+                                          ultrafiltration=[2, 2], post_weight=[70, 70])),
+            (BMICalculator(), 'bmi', dict(weight=[70, 80], height=[170, -1])),
+            (HOMAIRCalculator(), 'homa_ir', dict(fasting_glucose=[100, 90], fasting_insulin=[10, None])),
+            (HOMABetaCalculator(), 'homa_beta', dict(fasting_glucose=[100, 0], fasting_insulin=[10, 10])),
+        ]
+        for calc, key, columns in cases:
+            batch = calc.calculate_batch(**columns)
+            expected = calc.calculate(**{name: values[0] for name, values in columns.items()})
+            
+            self.assertAlmostEqual(batch[key][0], expected[key], places=1)
+            self.assertTrue(np.isnan(batch[key][1]), key)
+            self.assertEqual(batch['error'][0], VALID)
+            self.assertNotEqual(batch['error'][1], VALID)
+
+
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestParallel(unittest.TestCase):
+    """Test cases for the parallel scoring helpers"""
+    
+    def test_shard_bounds(self):
+        """Test that shards cover all rows in order"""
+        self.assertEqual(shard_bounds(5, 2), [(0, 2), (2, 4), (4, 5)])
+        self.assertEqual(shard_bounds(0, 2), [])
+        with self.assertRaises(ValueError):
+            shard_bounds(5, 0)
+    
+    def test_shared_columns(self):
+        """Test that attached shared columns see the owner's data and writes"""
+        with SharedColumns.create({'x': np.arange(4.0)}) as owner:
+            worker = SharedColumns.attach(owner.spec)
+            worker.arrays['x'][1] = 10
+            worker.close()
+            self.assertEqual(list(owner.arrays['x']), [0, 10, 2, 3])
+        
+        with self.assertRaises(ValueError):
+            SharedColumns.create({'sex': np.array(['F', 'M'])})
+    
+    def test_shared_columns_no_leak(self):
+        """Test that a failed create frees the blocks it had already allocated"""
+        from unittest import mock
+        from multiprocessing import shared_memory
+        
+        created, real = [], shared_memory.SharedMemory
+        def allocate(*args, **kwargs):
+            if len(created) == 1:
+                raise OSError("sem memória")
+            created.append(real(*args, **kwargs))
+            return created[-1]
+        
+        with mock.patch('calculators.parallel.shared_memory.SharedMemory', side_effect=allocate):
+            with self.assertRaises(ValueError):
+                SharedColumns.create({'x': np.arange(4.0), 'sex': np.array(['F', 'M'])})
+            self.assertEqual(created, [])
+            with self.assertRaises(OSError):
+                SharedColumns.create({'x': np.arange(4.0), 'y': np.arange(4.0)})
+        self.assertEqual(len(created), 1)
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=created[0].name)
 
 
 if __name__ == '__main__':
@@ -10,7 +10,10 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from prevent_calculator import PREVENTCalculator
+    import numpy as np
+    from prevent_calculator import (PREVENTCalculator, PREVENT_COEFFICIENTS, PREVENT_MODELS,
+                                    PREVENT_OUTCOMES, PREVENT_REASONS, PREVENT_TERMS, RISK_CATEGORIES,
+                                    _build_coefficient_matrices, _build_model_lookup)
     IMPORTS_AVAILABLE = True
 except ImportError:
     IMPORTS_AVAILABLE = False
@@ -30,21 +33,23 @@ class TestPREVENTCalculator(unittest.TestCase):
         result = self.calculator.calculate_risk_score(
             age=55,
             sex='M',
-            race='white',
             total_cholesterol=200,
             hdl_cholesterol=50,
             sbp=120,
             on_bp_meds=False,
             diabetes=False,
             smoker=False,
-            egfr=90
+            egfr=90,
+            weight=80,
+            height=178,
+            on_statins=False
         )
         
-        self.assertIn('10_year_risk', result)
-        self.assertIn('30_year_risk', result)
+        for outcome in PREVENT_OUTCOMES:
+            self.assertIn(outcome, result)
+            self.assertGreaterEqual(result[outcome], 0)
+            self.assertLessEqual(result[outcome], 100)
         self.assertIn('risk_category', result)
-        self.assertGreaterEqual(result['10_year_risk'], 0)
-        self.assertLessEqual(result['10_year_risk'], 100)
     
     def test_high_risk_patient(self):
         """Test calculation for high-risk patient"""
@@ -203,6 +208,252 @@ class TestPREVENTCalculator(unittest.TestCase):
         self.assertGreater(len(recommendations), 0)
 
 
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestPREVENTCache(unittest.TestCase):
+    """Test cases for the optional calculate_risk_score result cache"""
+    
+    patient = dict(age=55, sex='M', total_cholesterol=200, hdl_cholesterol=50, sbp=120, on_bp_meds=False,
+                   diabetes=False, smoker=False, egfr=90, weight=80, height=175, on_statins=False)
+    
+    def test_cache_hits_and_misses(self):
+        """Test that repeated and equivalent inputs are served from the cache"""
+        calculator = PREVENTCalculator(cache_size=2)
+        first = calculator.calculate_risk_score(**self.patient)
+        second = calculator.calculate_risk_score(**dict(self.patient, age=55.0))
+        
+        self.assertEqual(first, second)
+        self.assertEqual(calculator.cache_info(), (1, 1, 2, 1))
+        
+        calculator.cache_clear()
+        self.assertEqual(calculator.cache_info(), (0, 0, 2, 0))
+    
+    def test_cache_eviction(self):
+        """Test that the least recently used entry is evicted"""
+        calculator = PREVENTCalculator(cache_size=2)
+        for age in (50, 55, 60, 50):
+            calculator.calculate_risk_score(**dict(self.patient, age=age))
+        
+        self.assertEqual(calculator.cache_info().misses, 4)
+        self.assertEqual(calculator.cache_info().currsize, 2)
+    
+    def test_cached_result_is_a_copy(self):
+        """Test that mutating a returned result does not corrupt the cache"""
+        calculator = PREVENTCalculator(cache_size=4)
+        calculator.calculate_risk_score(**self.patient)['risk_category'] = 'X'
+        self.assertNotEqual(calculator.calculate_risk_score(**self.patient)['risk_category'], 'X')
+    
+    def test_cache_disabled_by_default(self):
+        """Test that the cache is opt-in"""
+        calculator = PREVENTCalculator()
+        calculator.calculate_risk_score(**self.patient)
+        self.assertEqual(calculator.cache_info().currsize, 0)
+
+
+@unittest.skipUnless(IMPORTS_AVAILABLE, "Dependencies not available")
+class TestPREVENTBatch(unittest.TestCase):
+    """Test cases for the vectorized PREVENT batch engine"""
+    
+    def setUp(self):
+        """Set up a small mixed cohort"""
+        self.calculator = PREVENTCalculator()
+        self.patients = [
+            dict(age=55, sex='M', total_cholesterol=200, hdl_cholesterol=50, sbp=120, on_bp_meds=False,
+                 diabetes=False, smoker=False, egfr=90, weight=80, height=175, on_statins=False),
+            dict(age=70, sex='F', total_cholesterol=280, hdl_cholesterol=35, sbp=160, on_bp_meds=True,
+                 diabetes=True, smoker=True, egfr=50, weight=70, height=160, on_statins=True, uacr=150),
+            dict(age=45, sex='F', total_cholesterol=350, hdl_cholesterol=70, sbp=105, on_bp_meds=False,
+                 diabetes=False, smoker=False, egfr=95, weight=120, height=165, on_statins=False),
+            dict(age=62, sex='M', total_cholesterol=210, hdl_cholesterol=45, sbp=135, on_bp_meds=True,
+                 diabetes=False, smoker=True, egfr=45, weight=90, height=180, on_statins=False, uacr=0.05),
+        ]
+    
+    def _columns(self):
+        names = PREVENTCalculator.BATCH_COLUMNS[:13]
+        return {name: [p.get(name) for p in self.patients] for name in names}
+    
+    def test_batch_matches_scalar(self):
+        """Test that every batch row matches calculate_risk_score"""
+        batch = self.calculator.calculate_batch(**self._columns())
+        
+        for i, patient in enumerate(self.patients):
+            expected = self.calculator.calculate_risk_score(**patient)
+            for key in ('total_cvd_10yr', 'ascvd_10yr', 'hf_10yr'):
+                if expected[key] == 'N/A':
+                    self.assertTrue(np.isnan(batch[key][i]))
+                else:
+                    self.assertEqual(round(batch[key][i], 1), expected[key])
+    
+    def test_batch_from_dataframe(self):
+        """Test that a DataFrame gives the same results as column arrays"""
+        import pandas as pd
+        frame = pd.DataFrame(self.patients)
+        from_frame = self.calculator.calculate_batch(frame)
+        from_columns = self.calculator.calculate_batch(**self._columns())
+        
+        for key in ('total_cvd_10yr', 'ascvd_10yr', 'hf_10yr'):
+            np.testing.assert_array_equal(from_frame[key], from_columns[key])
+    
+    def test_batch_scalar_columns(self):
+        """Test that any column, age included, may be one value broadcast to the cohort"""
+        columns = self._columns()
+        columns['age'] = 55
+        batch = self.calculator.calculate_batch(**columns)
+
+        self.assertEqual(len(batch['total_cvd_10yr']), len(self.patients))
+        expected = self.calculator.calculate_risk_score(**dict(self.patients[3], age=55))
+        self.assertEqual(round(batch['hf_10yr'][3], 1), expected['hf_10yr'])
+
+    def test_batch_missing_values(self):
+        """Test that missing essentials yield NaN instead of raising"""
+        columns = self._columns()
+        columns['egfr'] = [90, None, 95, 45]
+        batch = self.calculator.calculate_batch(**columns)
+        
+        self.assertTrue(np.isnan(batch['total_cvd_10yr'][1]))
+        self.assertFalse(np.isnan(batch['total_cvd_10yr'][0]))
+        self.assertEqual(list(batch['error']), [0, 1, 0, 0])
+    
+    def test_batch_missing_sex(self):
+        """Test that a missing sex is flagged and blanks the row instead of defaulting to male"""
+        columns = self._columns()
+        columns['sex'] = ['M', None, 'F', float('nan')]
+        batch = self.calculator.calculate_batch(**columns)
+        
+        self.assertEqual(list(batch['error']), [0, 1, 0, 1])
+        for key in PREVENT_OUTCOMES:
+            self.assertTrue(np.isnan(batch[key][[1, 3]]).all())
+    
+    def test_batch_missing_unused_term(self):
+        """Test that a missing cholesterol blanks CVD/ASCVD but not HF, which does not use it"""
+        columns = self._columns()
+        columns['total_cholesterol'] = [None, 280, 350, 210]
+        batch = self.calculator.calculate_batch(**columns)
+        
+        self.assertTrue(np.isnan(batch['total_cvd_10yr'][0]))
+        self.assertTrue(np.isnan(batch['ascvd_10yr'][0]))
+        self.assertFalse(np.isnan(batch['hf_10yr'][0]))
+    
+    def test_coefficient_table(self):
+        """Test that every coefficient row only uses known terms"""
+        for key, row in PREVENT_COEFFICIENTS.items():
+            self.assertIn(key[2], PREVENT_OUTCOMES)
+            self.assertTrue(set(row) <= set(PREVENT_TERMS), key)
+    
+    def test_batch_mixed_models(self):
+        """Test per-row model dispatch on a cohort mixing UACR availability, NaN counting as absent"""
+        for patient, hba1c in zip(self.patients, (6.1, None, 5.4, 7.2)):
+            patient['hba1c'] = hba1c
+        self.patients[0]['uacr'] = float('nan')
+        batch = self.calculator.calculate_batch(**self._columns(), hba1c=[p['hba1c'] for p in self.patients])
+        
+        for i, patient in enumerate(self.patients):
+            expected = self.calculator.calculate_risk_score(**patient)
+            for key in ('total_cvd_10yr', 'ascvd_10yr', 'hf_10yr'):
+                if expected[key] != 'N/A':
+                    self.assertEqual(round(batch[key][i], 1), expected[key])
+        # The table has no HbA1c or full-model rows, so only UACR selects the model
+        self.assertEqual(PREVENT_MODELS, ('base', 'uacr'))
+        self.assertEqual([PREVENT_MODELS[m] for m in batch['model']], ['base', 'uacr', 'base', 'uacr'])
+        self.assertEqual(self.calculator.calculate_risk_score(**self.patients[0]),
+                         self.calculator.calculate_risk_score(**dict(self.patients[0], uacr=None)))
+    
+    def test_model_lookup(self):
+        """Test that each combination of present inputs picks the most complete variant with rows"""
+        # Bit 0: UACR present, bit 1: HbA1c present
+        models = ('base', 'uacr', 'hba1c', 'full')
+        self.assertEqual([models[i] for i in _build_model_lookup(models)], ['base', 'uacr', 'hba1c', 'full'])
+        models = ('base', 'hba1c')
+        self.assertEqual([models[i] for i in _build_model_lookup(models)], ['base', 'base', 'hba1c', 'hba1c'])
+        models = PREVENT_MODELS
+        self.assertEqual([models[i] for i in _build_model_lookup(models)], ['base', 'uacr', 'base', 'uacr'])
+    
+    def test_incomplete_coefficient_table(self):
+        """Test that a (sex, model) missing an outcome row is rejected instead of scored as NaN"""
+        table = dict(PREVENT_COEFFICIENTS)
+        del table[('F', 'uacr', 'hf_10yr')]
+        with self.assertRaises(ValueError):
+            _build_coefficient_matrices(table)
+    
+    def test_score_file_in_chunks(self):
+        """Test that scoring a CSV in small chunks matches one batch call"""
+        import tempfile
+        import pandas as pd
+        from prevent_calculator import score_file
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            source, target = os.path.join(tmp, 'in.csv'), os.path.join(tmp, 'out.csv')
+            pd.DataFrame(self.patients).to_csv(source, index=False)
+            rows = score_file(source, target, chunk_size=3)
+            scored = pd.read_csv(target)
+        
+        expected = self.calculator.calculate_batch(pd.DataFrame(self.patients))
+        self.assertEqual(rows, len(self.patients))
+        np.testing.assert_allclose(scored['total_cvd_10yr'], expected['total_cvd_10yr'])
+        self.assertEqual(list(scored['prevent_model']), ['base', 'uacr', 'base', 'uacr'])
+    
+    def test_parallel_matches_batch(self):
+        """Test that sharded multi-process scoring keeps row order and values"""
+        parallel = self.calculator.calculate_parallel(workers=2, chunk_size=1, **self._columns())
+        batch = self.calculator.calculate_batch(**self._columns())
+        
+        for key in batch:
+            if batch[key].dtype.kind == 'f':
+                # BLAS blocks X @ B differently for 1-row shards, which can move the last bit
+                np.testing.assert_allclose(parallel[key], batch[key], rtol=1e-13)
+            else:
+                np.testing.assert_array_equal(parallel[key], batch[key])
+    
+    def test_scalar_terms_match_design_matrix(self):
+        """Test that the pure-math scalar path builds the same terms as the batch design matrix"""
+        args = dict(age=62, tc=210, hdl=45, sbp=135, dm=1, smoking=0, bmi=27.8, egfr=45, bptreat=1)
+        for uacr, hba1c in ((None, None), (150, 7.2), (-1, None), (0.05, 4.8)):
+            terms = self.calculator._scalar_terms(uacr=uacr, hba1c=hba1c, **args)
+            design = self.calculator._design_matrix(uacr=uacr, hba1c=hba1c, **args)
+            np.testing.assert_allclose(terms, design[0], rtol=1e-12)
+    
+    def test_raw_results(self):
+        """Test raw scalar output and display formatting"""
+        raw = self.calculator.calculate_risk_score(raw=True, **self.patients[2])
+        
+        self.assertIsInstance(raw['ascvd_10yr'], float)
+        self.assertTrue(np.isnan(raw['total_cvd_10yr']))
+        self.assertEqual(raw['risk_category_code'], 0)
+        self.assertEqual(self.calculator.format_results(raw),
+                         self.calculator.calculate_risk_score(**self.patients[2]))
+    
+    def test_batch_risk_category_codes(self):
+        """Test that batch category codes agree with the scalar categories"""
+        risks = np.array([3, 5, 6, 7.5, 15, 20, 25, np.nan])
+        codes = self.calculator._risk_category_codes(risks)
+        
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertEqual([RISK_CATEGORIES[c] for c in codes],
+                         [self.calculator._categorize_risk(r) for r in risks])
+    
+    def test_batch_unavailable_reasons(self):
+        """Test the eligibility masks and the reason codes for blanked risks"""
+        columns = self._columns()
+        columns['hdl_cholesterol'][3] = None
+        batch = self.calculator.calculate_batch(**columns)
+        
+        np.testing.assert_array_equal(batch['cvd_eligible'], [True, True, False, False])
+        np.testing.assert_array_equal(batch['hf_eligible'], [True, True, False, True])
+        reasons = {key: [PREVENT_REASONS[code] for code in batch[f'{key}_reason']]
+                   for key in ('total_cvd_10yr', 'hf_10yr')}
+        self.assertEqual(reasons['total_cvd_10yr'], ['Disponível', 'Disponível',
+                                                     'Colesterol total ou HDL fora da faixa', 'Dados ausentes'])
+        self.assertEqual(reasons['hf_10yr'], ['Disponível', 'Disponível', 'IMC fora da faixa', 'Disponível'])
+        for key in PREVENT_OUTCOMES:
+            np.testing.assert_array_equal(batch[f'{key}_reason'] == 0, ~np.isnan(batch[key]))
+    
+    def test_batch_missing_column(self):
+        """Test that a missing essential column raises"""
+        columns = self._columns()
+        del columns['egfr']
+        with self.assertRaises(ValueError):
+            self.calculator.calculate_batch(**columns)
+
+
 if __name__ == '__main__':
     if IMPORTS_AVAILABLE:
         unittest.main()
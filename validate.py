@@ -83,7 +83,6 @@ def validate_app_structure():
         'st.set_page_config',
         'st.title',
         'PREVENTCalculator',
-        'calculate_risk_score'
     ]
     
     for component in required_components:
@@ -93,6 +92,14 @@ def validate_app_structure():
             print(f"❌ Missing: {component}")
             return False
     
+    # PREVENT is called either directly or through the calculator registry's evaluator
+    prevent_calls = ['calculate_risk_score', 'default_registry(get_prevent_calculator())']
+    if any(call in code for call in prevent_calls):
+        print("✅ Found: PREVENT call path")
+    else:
+        print(f"❌ Missing: PREVENT call path ({' or '.join(prevent_calls)})")
+        return False
+    
     return True
 
 